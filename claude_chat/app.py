@@ -1,16 +1,43 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, render_template, request, jsonify, Response, stream_with_context, abort, g, make_response, send_file
 from flask_cors import CORS
-import anthropic
+import assets
+import functools
 import logging
 import base64
+import html
+import json
 import os
 import mimetypes
-from PIL import Image
-from io import BytesIO
-from database import db
+import time
+from database import db, ConversationNotFoundError, SNIPPET_END, SNIPPET_START
+from context import build_context, build_request_params
 from config import Config
-from utils import truncate_messages_to_token_limit, format_error_message
+from image_processing import ImageTooLargeError, process_image_bytes, process_images
+from metrics import finish_request, observe_stage, record_token_usage, registry, stage, start_request
+from response_cache import cache_bypassed, response_cache
+from scheduler import scheduler
+from uploads import UploadBudget, UploadSpool, UploadTooLargeError, receive_upload, request_too_large
+from utils import estimate_image_tokens, format_error_message
 from datetime import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
+
+class UploadRequest(Request):
+    """Request that checks uploads against their size limits while parsing.
+
+    Multipart file parts are written to UploadSpools, which reject a file
+    as soon as it exceeds its limit or the request's upload budget.
+    """
+
+    @property
+    def max_content_length(self):
+        if self.mimetype == 'multipart/form-data':
+            return Config.MAX_REQUEST_SIZE
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not hasattr(self, 'upload_budget'):
+            self.upload_budget = UploadBudget()
+        return UploadSpool(filename, self.upload_budget)
 
 # Initialize Flask app
 # Update the Flask app initialization
@@ -18,18 +45,32 @@ app = Flask(__name__,
     template_folder='templates',
     static_folder='static'
 )
+app.request_class = UploadRequest
 CORS(app)
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
+# At DEBUG the SDK copies and logs each request's options, attachments included
+logging.getLogger('anthropic').setLevel(logging.INFO)
 
-# Initialize Anthropic client
-client = anthropic.Client(api_key=Config.ANTHROPIC_API_KEY)
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """The Anthropic client, created on first use; importing anthropic is slow.
+
+    Retries are handled by the scheduler.
+    """
+    import anthropic
+    return anthropic.Client(api_key=Config.ANTHROPIC_API_KEY, max_retries=0)
 
 # Initialize database
 db.init_db()
 
+# Build the static assets if they changed since the last build
+if Config.ASSETS_BUILD_ON_START:
+    assets.ensure_built()
+app.jinja_env.globals['asset_url'] = assets.asset_url
+
 # File handling configurations
 ALLOWED_TEXT_EXTENSIONS = {
     '.txt', '.py', '.js', '.html', '.css', '.json', '.xml', 
@@ -42,8 +83,6 @@ ALLOWED_IMAGE_EXTENSIONS = {
     '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.tiff'
 }
 
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-
 def get_file_extension(filename):
     return os.path.splitext(filename)[1].lower()
 
@@ -57,47 +96,27 @@ def is_text_file(filename):
     return get_file_extension(filename) in ALLOWED_TEXT_EXTENSIONS
 
 def process_image(file):
-    """Process and optimize image for Claude."""
+    """Process and optimize a single image for Claude."""
     try:
-        image = Image.open(file)
-        
-        # Convert to RGB if necessary
-        if image.mode in ('RGBA', 'P'):
-            image = image.convert('RGB')
-        
-        # Resize if too large while maintaining aspect ratio
-        max_dimension = 2048
-        if max(image.size) > max_dimension:
-            ratio = max_dimension / max(image.size)
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Save to BytesIO
-        buffer = BytesIO()
-        image.save(buffer, format='JPEG', quality=85, optimize=True)
-        buffer.seek(0)
-        
-        # Convert to base64
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        return {
-            'type': 'image',
-            'data': image_base64
-        }
+        return process_image_bytes(file.read())
     except Exception as e:
         logger.error(f"Error processing image: {e}")
         raise
 
-def process_text_file(file):
-    """Process text file content."""
+def process_text_file(upload):
+    """Transcode an uploaded text file to UTF-8 using its sniffed encoding.
+
+    ``content`` is the UTF-8 encoded text rather than a string.
+    """
     try:
-        content = file.read().decode('utf-8', errors='ignore')
-        ext = get_file_extension(file.filename)[1:]  # Remove the dot
+        content, token_count = upload.transcode()
+        ext = get_file_extension(upload.filename)[1:]  # Remove the dot
         return {
             'type': 'text',
-            'filename': file.filename,
+            'filename': upload.filename,
             'extension': ext,
-            'content': content
+            'content': content,
+            'token_count': token_count
         }
     except Exception as e:
         logger.error(f"Error processing text file: {e}")
@@ -105,38 +124,214 @@ def process_text_file(file):
 
 # ... [rest of the routes remain the same]
 
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = start_request(request.endpoint or 'unmatched')
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    if response.is_streamed:
+        # Teardown runs before a streamed body is sent; record once it has been
+        state = g.pop('request_metrics', None)
+        if state is not None:
+            response.call_on_close(lambda: finish_request(state, response.status_code))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error):
+    state = g.pop('request_metrics', None)
+    if state is not None:
+        finish_request(state, g.pop('response_status', 500))
+
 # Add these before the main route
 @app.errorhandler(404)
 def not_found_error(error):
-    return render_template('index.html', conversations=[]), 404
+    return render_template('index.html'), 404
 
 @app.errorhandler(500)
 def internal_error(error):
-    return render_template('index.html', conversations=[]), 500
+    return render_template('index.html'), 500
 
 # ... [previous imports and configurations remain the same] ...
 
+def encode_cursor(conversation):
+    """Opaque cursor pointing just past ``conversation`` in the list order."""
+    raw = json.dumps([conversation['updated_at'], conversation['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Return the ``(updated_at, id)`` pair encoded by encode_cursor, or None if invalid."""
+    try:
+        updated_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(updated_at), int(conversation_id)
+    except (ValueError, TypeError):
+        return None
+
+def conversation_page(limit, after=None, archived=False):
+    """Fetch one page of the conversation list and the cursor for the next."""
+    # Ask for one extra row to learn whether another page exists
+    conversations = db.get_conversations(limit=limit + 1, after=after, archived=archived)
+    next_cursor = encode_cursor(conversations[limit - 1]) if len(conversations) > limit else None
+    return conversations[:limit], next_cursor
+
 # Add this after the error handlers and before the chat route
 @app.route('/')
 def home():
-    try:
-        # Clean up any duplicate messages
-        db.cleanup_duplicate_messages()
-        conversations = db.get_conversations()
-        return render_template('index.html', conversations=conversations)
-    except Exception as e:
-        logger.error(f"Error in home route: {e}")
-        return render_template('index.html', conversations=[])
+    """The app shell. It does not touch the database: the page fetches the
+    conversation list itself, so it can paint while the list loads.
+    """
+    response = make_response(render_template('index.html'))
+    # Revalidated on every load, so a new asset build is picked up at once
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/assets/<path:name>')
+def built_asset(name):
+    """Serve a built static asset, precompressed if the client accepts it."""
+    found = assets.find_asset(name, request.headers.get('Accept-Encoding', ''))
+    if found is None:
+        abort(404)
+    path, content_type, encoding = found
+    response = send_file(path, mimetype=content_type)
+    response.headers.update(assets.asset_headers(encoding))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/conversations', methods=['GET'])
 def get_all_conversations():
+    """One page of the conversation list, newest first.
+
+    Takes ``limit`` and the ``cursor`` returned with the previous page;
+    ``archived=1`` lists the archived conversations instead. Responses
+    carry an ETag derived from the list version, so clients can revalidate
+    with If-None-Match and get a 304 while nothing has changed.
+    """
     try:
-        conversations = db.get_conversations()
-        return jsonify(conversations)
+        limit = request.args.get('limit', Config.CONVERSATIONS_PAGE_SIZE, type=int)
+        if limit <= 0:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        limit = min(limit, Config.CONVERSATIONS_MAX_PAGE_SIZE)
+        
+        after = None
+        cursor = request.args.get('cursor')
+        if cursor:
+            after = decode_cursor(cursor)
+            if after is None:
+                return jsonify({'error': 'Invalid cursor'}), 400
+        
+        # Read the version first: a write landing before the page query makes
+        # the ETag stale, which only costs the client a full response later
+        etag = f'list-{db.get_conversation_list_version()}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            conversations, next_cursor = conversation_page(limit, after, request.args.get('archived') == '1')
+            response = jsonify({'conversations': conversations, 'next_cursor': next_cursor})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         logger.error(f"Error getting conversations: {e}")
         return jsonify({'error': 'Failed to retrieve conversations'}), 500
 
+def render_snippet(snippet):
+    """HTML-escape a search snippet and mark up its matched terms."""
+    return html.escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+@app.route('/search', methods=['GET'])
+def search():
+    """Full-text search over conversation titles and messages.
+
+    Takes ``q``, ``limit`` and ``offset``. Message hits are paginated by
+    ``offset``; matching conversation titles are returned with the first
+    page only. Snippets are HTML with matches wrapped in <mark>.
+    """
+    try:
+        text = request.args.get('q', '').strip()
+        limit = request.args.get('limit', Config.SEARCH_PAGE_SIZE, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if limit <= 0 or offset < 0:
+            return jsonify({'error': 'limit must be positive and offset non-negative'}), 400
+        limit = min(limit, Config.SEARCH_MAX_PAGE_SIZE)
+        
+        # One extra row tells us whether there is another page
+        messages = db.search_messages(text, limit=limit + 1, offset=offset)
+        conversations = db.search_conversations(text) if offset == 0 else []
+        for result in messages + conversations:
+            result['snippet'] = render_snippet(result['snippet'])
+        
+        return jsonify({
+            'conversations': conversations,
+            'messages': messages[:limit],
+            'next_offset': offset + limit if len(messages) > limit else None
+        })
+    except Exception as e:
+        logger.error(f"Error searching conversations: {e}")
+        return jsonify({'error': 'Search failed'}), 500
+
+@app.route('/batch', methods=['POST'])
+def submit_batch():
+    """Queue prompts to be answered through the Message Batches API.
+
+    Takes JSON ``{"requests": [{"message": ..., "conversation_id": ...}]}``;
+    requests without a conversation_id start a new conversation, titled
+    with the optional ``title``. The user messages are stored immediately and
+    the replies are added by batch_worker.py. Returns 202 with the job id to
+    poll at GET /batch/<job_id>.
+    """
+    try:
+        requests = (request.get_json(silent=True) or {}).get('requests')
+        if not isinstance(requests, list) or not requests:
+            return jsonify({'error': 'requests must be a non-empty list'}), 400
+        if len(requests) > Config.BATCH_MAX_SUBMISSION:
+            return jsonify({'error': f'At most {Config.BATCH_MAX_SUBMISSION} requests per job'}), 400
+        
+        items = []
+        seen_conversations = set()
+        for index, item in enumerate(requests):
+            if not isinstance(item, dict) or not isinstance(item.get('message'), str) or not item['message'].strip():
+                return jsonify({'error': f'Request {index} needs a non-empty message'}), 400
+            conversation_id = item.get('conversation_id')
+            if conversation_id is not None:
+                if not isinstance(conversation_id, int):
+                    return jsonify({'error': f'Request {index} has an invalid conversation ID'}), 400
+                if not db.open_conversation(conversation_id):
+                    return jsonify({'error': f'Conversation {conversation_id} does not exist'}), 400
+                # A reply is only well-defined for one pending prompt per conversation
+                if conversation_id in seen_conversations:
+                    return jsonify({'error': f'Conversation {conversation_id} appears more than once'}), 400
+                seen_conversations.add(conversation_id)
+            items.append({
+                'message': item['message'],
+                'conversation_id': conversation_id,
+                'title': str(item.get('title') or new_conversation_title())
+            })
+        
+        try:
+            job_id, queued = db.create_batch_job(items)
+        except ConversationNotFoundError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'job_id': job_id, 'requests': queued}), 202
+    except Exception as e:
+        logger.error(f"Error submitting batch job: {e}")
+        return jsonify({'error': 'Failed to submit batch job'}), 500
+
+@app.route('/batch/<int:job_id>', methods=['GET'])
+def get_batch(job_id):
+    try:
+        job = db.get_batch_job(job_id)
+        if job is None:
+            return jsonify({'error': 'Batch job not found'}), 404
+        return jsonify(job)
+    except Exception as e:
+        logger.error(f"Error getting batch job {job_id}: {e}")
+        return jsonify({'error': 'Failed to retrieve batch job'}), 500
+
 @app.route('/conversation', methods=['POST'])
 def create_new_conversation():
     try:
@@ -151,12 +346,49 @@ def create_new_conversation():
 @app.route('/conversation/<int:conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
     try:
-        messages = db.get_conversation_messages(conversation_id)
+        before_id = request.args.get('before_id', type=int)
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit <= 0:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        
+        # Opening an archived conversation brings it back from the archive
+        if not db.open_conversation(conversation_id):
+            return jsonify({'error': 'Conversation not found'}), 404
+        messages = db.get_conversation_messages(
+            conversation_id, 
+            before_id=before_id, 
+            limit=limit
+        )
         return jsonify(messages)
     except Exception as e:
         logger.error(f"Error getting conversation {conversation_id}: {e}")
         return jsonify({'error': 'Failed to retrieve conversation'}), 500
 
+@app.route('/attachment/<int:attachment_id>', methods=['GET'])
+def get_attachment(attachment_id):
+    """Serve a stored attachment; history responses only carry its metadata."""
+    try:
+        attachment = db.get_attachment(attachment_id)
+        # Attachments are stored in the database, so a row without content has lost its data
+        if attachment is None or not attachment['content']:
+            return jsonify({'error': 'Attachment not found'}), 404
+        
+        if attachment['type'] == 'image':
+            body = base64.b64decode(attachment['content'])
+            mimetype = 'image/jpeg'
+        else:
+            body = attachment['content']
+            mimetype = 'text/plain'
+        
+        response = Response(body, mimetype=mimetype)
+        # Content-addressed, so the body for a given id never changes
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        response.headers['ETag'] = f'"{attachment["sha256"]}"'
+        return response
+    except Exception as e:
+        logger.error(f"Error getting attachment {attachment_id}: {e}")
+        return jsonify({'error': 'Failed to retrieve attachment'}), 500
+
 @app.route('/conversation/<int:conversation_id>', methods=['DELETE'])
 def delete_conv(conversation_id):
     try:
@@ -169,6 +401,29 @@ def delete_conv(conversation_id):
         logger.error(f"Error deleting conversation {conversation_id}: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/conversation/<int:conversation_id>/archive', methods=['POST'])
+def archive_conv(conversation_id):
+    """Move a conversation to the archive store; opening it again restores it."""
+    try:
+        if not db.archive_conversation(conversation_id):
+            return jsonify({'error': 'Conversation has unfinished batch requests'}), 409
+        return jsonify({'status': 'success'})
+    except ConversationNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        logger.error(f"Error archiving conversation {conversation_id}: {e}")
+        return jsonify({'error': 'Failed to archive conversation'}), 500
+
+@app.route('/conversation/<int:conversation_id>/unarchive', methods=['POST'])
+def unarchive_conv(conversation_id):
+    try:
+        if not db.restore_conversation(conversation_id):
+            return jsonify({'error': 'Conversation not found'}), 404
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        logger.error(f"Error restoring conversation {conversation_id}: {e}")
+        return jsonify({'error': 'Failed to restore conversation'}), 500
+
 @app.route('/conversation/<int:conversation_id>/title', methods=['PUT'])
 def update_conversation_title(conversation_id):
     try:
@@ -184,112 +439,268 @@ def update_conversation_title(conversation_id):
 
 # ... [chat route and rest of the code remains the same] ...
 
-@app.route('/chat', methods=['POST'])
-def chat():
+class ChatRequestError(Exception):
+    """Raised when a chat request fails validation."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def parse_conversation_id(conversation_id):
+    """Parse the conversation_id form field, returning None for a new chat."""
+    if not conversation_id or conversation_id == 'null':
+        return None
     try:
-        db.cleanup_duplicate_messages()
-        conversation_id = request.form.get('conversation_id')
-        message = request.form.get('message', '')
-        files = request.files.getlist('attachments[]')
-        
-        # Create new conversation if no ID provided or if it's a new chat
-        if not conversation_id or conversation_id == 'null':
-            conversation_id = db.create_conversation(f"Chat {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-        else:
-            # Verify existing conversation
-            conversations = db.get_conversations()
-            if not any(str(conv['id']) == str(conversation_id) for conv in conversations):
-                return jsonify({'error': 'Invalid conversation ID'}), 400
+        return int(conversation_id)
+    except ValueError:
+        raise ChatRequestError('Invalid conversation ID')
+
+def new_conversation_title():
+    return f"Chat {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+
+def save_text_attachment(upload):
+    """Store a new text attachment; its text is released once this returns."""
+    text_file = process_text_file(upload)
+    return {
+        'id': db.save_attachment(
+            upload.sha256, 'text', text_file['content'], upload.size, text_file['token_count']
+        ),
+        'sha256': upload.sha256,
+        'type': 'text',
+        'token_count': text_file['token_count']
+    }
+
+def process_attachments(files, budget=None):
+    """Validate uploaded files and store them in the attachment store.
+
+    Files are keyed by the SHA-256 of their bytes, so re-uploading a file
+    reuses the stored (already decoded or resized) version. The type and
+    encoding are sniffed from the file's content, which must match its
+    extension. New images are handed to the image process pool together so
+    that all of a request's images are decoded in parallel.
+
+    ``budget`` is the request's UploadBudget; files not already checked
+    while they were received are charged to it.
+
+    Returns one dict per file with the stored attachment's ``id``,
+    ``sha256``, ``type``, ``filename`` and ``token_count``.
+    """
+    budget = budget or UploadBudget()
+    processed_files = []
+    new_images = []
+    for file in files:
+        if file and file.filename:
+            if not (is_image_file(file.filename) or is_text_file(file.filename)):
+                raise ChatRequestError(f'File {file.filename} is not a supported file type')
             
-            # Convert conversation_id to integer
-            conversation_id = int(conversation_id)
-        
-        # Process files
-        processed_files = []
-        for file in files:
-            if file and file.filename:
-                # Check file size
-                file.seek(0, os.SEEK_END)
-                size = file.tell()
-                file.seek(0)
-                
-                if size > MAX_FILE_SIZE:
-                    return jsonify({
-                        'error': f'File {file.filename} exceeds maximum size of 10MB'
-                    }), 400
-                
-                if is_image_file(file.filename):
-                    processed_files.append(process_image(file))
-                elif is_text_file(file.filename):
-                    processed_files.append(process_text_file(file))
-                else:
-                    return jsonify({
-                        'error': f'File {file.filename} is not a supported file type'
-                    }), 400
-
-        # Prepare message with files
-        full_message = message if message else ""
-        
-        # Add text file contents
-        for file in processed_files:
-            if file['type'] == 'text':
-                full_message += f"\nFile: {file['filename']}\n```{file['extension']}\n{file['content']}\n```\n"
+            try:
+                upload = receive_upload(file, budget)
+            except UploadTooLargeError as e:
+                raise ChatRequestError(str(e), 413)
+            
+            if is_image_file(file.filename) and upload.kind != 'image':
+                raise ChatRequestError(f'File {file.filename} is not a valid image')
+            if is_text_file(file.filename) and upload.kind != 'text':
+                raise ChatRequestError(f'File {file.filename} is not a text file')
+            
+            attachment = db.get_attachment_by_hash(upload.sha256)
+            if attachment is None and upload.kind == 'image':
+                # Keep the slot so attachments stay in upload order
+                new_images.append((len(processed_files), upload))
+            elif attachment is None:
+                attachment = save_text_attachment(upload)
+            else:
+                logger.debug(f"Reusing stored attachment {attachment['id']} for {file.filename}")
+            
+            processed_files.append(dict(attachment, filename=file.filename) if attachment else None)
+    
+    if new_images:
+        try:
+            results = process_images([upload.read() for _, upload in new_images])
+        except ImageTooLargeError as e:
+            raise ChatRequestError(str(e))
+        except Exception as e:
+            logger.error(f"Error processing images: {e}")
+            raise
+        for (index, upload), result in zip(new_images, results):
+            token_count = estimate_image_tokens(result['width'], result['height'])
+            processed_files[index] = {
+                'id': db.save_attachment(upload.sha256, 'image', result['data'], upload.size, token_count),
+                'sha256': upload.sha256,
+                'type': 'image',
+                'filename': upload.filename,
+                'token_count': token_count
+            }
+    
+    return processed_files
 
-        # Save user message
-        db.add_message(conversation_id, 'user', full_message)
-        
-        # Get conversation history
-        messages = db.get_conversation_messages(conversation_id)
-        
-        # Format messages for Claude
-        claude_messages = [
-            {'role': msg['role'], 'content': msg['content']} 
-            for msg in messages
-        ]
-        
-        # Add images as separate messages if present
-        image_files = [f for f in processed_files if f['type'] == 'image']
-        if image_files:
-            for img in image_files:
-                claude_messages.append({
-                    'role': 'user',
-                    'content': f"<image>{img['data']}</image>"
-                })
-        
-        logger.debug(f"Sending request to Claude with {len(claude_messages)} messages")
+def prepare_chat_request():
+    """Validate the chat form, save the user message and build the Claude payload.
+
+    Returns a tuple of (conversation_id, claude_messages).
+    """
+    with stage('validation'):
+        # Parsing the form receives the uploads and enforces their size limits
+        try:
+            form = request.form
+            files = request.files.getlist('attachments[]')
+        except UploadTooLargeError as e:
+            raise ChatRequestError(str(e), 413)
+        except RequestEntityTooLarge:
+            raise ChatRequestError(str(request_too_large()), 413)
+        conversation_id = parse_conversation_id(form.get('conversation_id'))
+        message = form.get('message', '')
         
-        # Get response from Claude
-        response = client.messages.create(
-            model=Config.MODEL_NAME,
-            max_tokens=Config.DEFAULT_MAX_TOKENS,
-            messages=claude_messages,
-            temperature=0.7
-        )
+        # Create new conversation if no ID provided or if it's a new chat
+        if conversation_id is None:
+            conversation_id = db.create_conversation(new_conversation_title())
+        elif not db.open_conversation(conversation_id):
+            raise ChatRequestError('Invalid conversation ID')
+    
+    with stage('files'):
+        processed_files = process_attachments(files, getattr(request, 'upload_budget', None))
+
+    # Save user message; attachments are linked by reference, not inlined
+    try:
+        with stage('db_write'):
+            db.add_message(conversation_id, 'user', message, attachments=processed_files)
+    except ConversationNotFoundError:
+        raise ChatRequestError('Invalid conversation ID')
+    
+    # Get the conversation history that fits the context window
+    with stage('history'):
+        claude_messages = build_context(conversation_id)
+    
+    return conversation_id, claude_messages
+
+def use_response_cache():
+    """Whether the response cache applies to the current request."""
+    return response_cache is not None and not cache_bypassed(
+        request.headers.get('Cache-Control'), request.form.get('cache')
+    )
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    try:
+        conversation_id, claude_messages = prepare_chat_request()
+        params = build_request_params(claude_messages)
+        use_cache = use_response_cache()
         
-        assistant_message = response.content[0].text
+        assistant_message = None
+        if use_cache:
+            with stage('response_cache'):
+                assistant_message = response_cache.get(params)
+        if assistant_message is None:
+            logger.debug(f"Sending request to Claude with {len(claude_messages)} messages")
+            
+            # Get response from Claude; includes time queued by the scheduler
+            with stage('upstream'):
+                response = scheduler.create(get_client(), params, key=conversation_id)
+            
+            assistant_message = response.content[0].text
+            record_token_usage(Config.MODEL_NAME, response.usage)
+            if use_cache:
+                response_cache.set(params, assistant_message)
         
         # Save assistant message
-        db.add_message(conversation_id, 'assistant', assistant_message)
+        with stage('db_write'):
+            db.add_message(conversation_id, 'assistant', assistant_message)
         
         return jsonify({
             'response': assistant_message,
             'conversation_id': conversation_id
         })
     
+    except ChatRequestError as e:
+        return jsonify({'error': e.message}), e.status_code
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
         error_message = format_error_message(e)
         return jsonify({'error': error_message}), 500
 
-if __name__ == '__main__':
-    # Initialize database
+def format_sse(event, data):
+    """Format a server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream Claude's response to the browser as server-sent events.
+
+    The assistant message is saved once the stream completes. If the client
+    disconnects or the upstream stream fails part-way, whatever text has been
+    received so far is saved instead.
+    """
     try:
-        db.init_db()
-        logger.info("Database initialized successfully")
+        conversation_id, claude_messages = prepare_chat_request()
+        params = build_request_params(claude_messages)
+        use_cache = use_response_cache()
+        cached_message = None
+        if use_cache:
+            with stage('response_cache'):
+                cached_message = response_cache.get(params)
+    except ChatRequestError as e:
+        return jsonify({'error': e.message}), e.status_code
     except Exception as e:
-        logger.error(f"Failed to initialize database: {e}")
-        raise
+        logger.error(f"Error in chat stream endpoint: {e}")
+        return jsonify({'error': format_error_message(e)}), 500
 
+    def save_assistant_message(chunks):
+        assistant_message = ''.join(chunks)
+        if not assistant_message:
+            return
+        try:
+            with stage('db_write'):
+                db.add_message(conversation_id, 'assistant', assistant_message)
+        except Exception as e:
+            logger.error(f"Failed to save streamed message for conversation {conversation_id}: {e}")
+
+    def generate():
+        chunks = []
+        saved = False
+        try:
+            yield format_sse('start', {'conversation_id': conversation_id})
+            
+            if cached_message is not None:
+                chunks.append(cached_message)
+                yield format_sse('delta', {'text': cached_message})
+            else:
+                logger.debug(f"Streaming request to Claude with {len(claude_messages)} messages")
+                with stage('upstream') as upstream:
+                    with scheduler.stream(get_client(), params, key=conversation_id) as stream:
+                        for text in stream.text_stream:
+                            if not chunks:
+                                observe_stage('upstream_ttft', time.perf_counter() - upstream.start)
+                            chunks.append(text)
+                            yield format_sse('delta', {'text': text})
+                        record_token_usage(Config.MODEL_NAME, stream.get_final_message().usage)
+                if use_cache:
+                    response_cache.set(params, ''.join(chunks))
+            
+            save_assistant_message(chunks)
+            saved = True
+            yield format_sse('done', {'conversation_id': conversation_id})
+        except GeneratorExit:
+            logger.info(f"Client disconnected from stream for conversation {conversation_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Error while streaming chat response: {e}")
+            yield format_sse('error', {'error': format_error_message(e)})
+        finally:
+            # Persist partial output on disconnect or upstream failure
+            if not saved:
+                save_assistant_message(chunks)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+if __name__ == '__main__':
     # Configuration for running the app
     app_config = {
         'host': '0.0.0.0',
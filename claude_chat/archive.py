@@ -0,0 +1,145 @@
+"""Compressed archive store for conversations that are no longer in use.
+
+Archiving moves a conversation's messages, their attachments and its
+summary out of the hot tables into a single compressed blob, so the
+tables, indexes and page cache used by every request only hold
+conversations in use. The conversation row stays behind with
+``is_archived`` set, keeping its id and title; opening the conversation
+again restores it (see StorageBackend.restore_conversation).
+
+Blobs are compressed with zstd when the optional ``zstandard`` package is
+installed and with zlib otherwise. The codec is stored with each blob, so
+archives stay readable whichever is available later, except that zstd
+blobs need the package to be restored. With SQLite the archive is a
+separate database file (Config.ARCHIVE_DATABASE_PATH); with PostgreSQL it
+is a table in the same database, so every node can restore from it.
+"""
+import json
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from metrics import counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+
+ARCHIVE_OPERATIONS = counter(
+    'claude_archive_operations_total',
+    'Conversations moved to or restored from the archive store.',
+    ('operation',)
+)
+
+def compress(data):
+    """Compress bytes with the best available codec; return ``(codec, blob)``."""
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return 'zlib', zlib.compress(data, ZLIB_LEVEL)
+
+def decompress(codec, blob):
+    """Reverse compress()."""
+    if codec == 'zlib':
+        return zlib.decompress(blob)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Restoring a zstd archive requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown archive codec: {codec}")
+
+def pack(payload):
+    """Serialize and compress an archived conversation; return ``(codec, blob, raw size)``."""
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    codec, blob = compress(data)
+    return codec, blob, len(data)
+
+def unpack(codec, blob):
+    """Reverse pack()."""
+    return json.loads(decompress(codec, blob))
+
+class ArchiveStore:
+    """Table of archived conversations, one compressed blob per conversation.
+
+    ``pool`` is a storage.ConnectionPool; the queries are shared by SQLite
+    and PostgreSQL, which store the blob as ``blob_type``. The methods run
+    on a connection from connection() (or, for an archive kept in the hot
+    database, one of its connections) and leave committing to the caller.
+    With ``create_table``, the table is created on first use; otherwise
+    the caller creates it with create_table(), e.g. in a schema migration.
+    """
+
+    def __init__(self, pool, blob_type='BLOB', create_table=True):
+        self.pool = pool
+        self.blob_type = blob_type
+        self._table_ready = not create_table
+        self._lock = threading.Lock()
+
+    def create_table(self, conn):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS conversation_archives (
+                conversation_id BIGINT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                data {self.blob_type} NOT NULL,
+                message_count INTEGER NOT NULL,
+                size BIGINT NOT NULL,
+                archived_at TEXT NOT NULL
+            )
+        ''')
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool, creating the table first if needed."""
+        conn = self.pool.acquire()
+        try:
+            if not self._table_ready:
+                with self._lock:
+                    if not self._table_ready:
+                        self.create_table(conn)
+                        conn.commit()
+                        self._table_ready = True
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    def put(self, conn, conversation_id, payload):
+        """Compress and store (or replace) the archive of a conversation; return its size in bytes."""
+        codec, blob, size = pack(payload)
+        conn.execute('''
+            INSERT INTO conversation_archives 
+                (conversation_id, codec, data, message_count, size, archived_at) 
+            VALUES (?, ?, ?, ?, ?, ?) 
+            ON CONFLICT (conversation_id) DO UPDATE SET 
+                codec = excluded.codec, 
+                data = excluded.data, 
+                message_count = excluded.message_count, 
+                size = excluded.size, 
+                archived_at = excluded.archived_at
+        ''', (conversation_id, codec, blob, len(payload['messages']), size, datetime.now().isoformat()))
+        return len(blob)
+
+    def get(self, conn, conversation_id):
+        """Return the archived payload of a conversation, or None."""
+        row = conn.execute(
+            'SELECT codec, data FROM conversation_archives WHERE conversation_id = ?',
+            (conversation_id,)
+        ).fetchone()
+        # psycopg2 returns bytea as a memoryview
+        return unpack(row['codec'], bytes(row['data'])) if row else None
+
+    def delete(self, conn, conversation_id):
+        conn.execute('DELETE FROM conversation_archives WHERE conversation_id = ?', (conversation_id,))
+
+    def stats(self, conn):
+        """Return the number of archived conversations and messages, and their raw and stored bytes."""
+        row = conn.execute('''
+            SELECT COUNT(*) AS conversations, 
+                   COALESCE(SUM(message_count), 0) AS messages, 
+                   COALESCE(SUM(size), 0) AS raw_bytes, 
+                   COALESCE(SUM(LENGTH(data)), 0) AS stored_bytes 
+            FROM conversation_archives
+        ''').fetchone()
+        return {key: int(value) for key, value in dict(row).items()}
@@ -0,0 +1,266 @@
+"""ASGI entry point for serving the app asynchronously.
+
+The chat endpoints run as native coroutines using ``anthropic.AsyncAnthropic``
+and the ``async_db`` facade, so a single process can hold many concurrent
+long-running generations without pinning a thread per request. Every other
+route is served by the Flask app, mounted as a WSGI fallback.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 4
+"""
+import asyncio
+import functools
+import logging
+import time
+import assets
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import FileStorage
+from app import (
+    app as flask_app,
+    ChatRequestError,
+    build_request_params,
+    format_sse,
+    new_conversation_title,
+    parse_conversation_id,
+    process_attachments,
+)
+from config import Config
+from context import build_context
+from database import async_db, ConversationNotFoundError
+from metrics import finish_request, observe_stage, record_token_usage, stage, start_request
+from response_cache import cache_bypassed, response_cache
+from scheduler import scheduler
+from uploads import UploadTooLargeError, request_too_large
+from utils import format_error_message
+
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=None)
+def get_async_client():
+    """The async Anthropic client, created on first use; retries are handled by the scheduler."""
+    import anthropic
+    return anthropic.AsyncAnthropic(api_key=Config.ANTHROPIC_API_KEY, max_retries=0)
+
+def instrumented(endpoint):
+    """Record request metrics for a route, as the Flask app's request hooks do."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            state = start_request(endpoint)
+            try:
+                response = await handler(request)
+            except BaseException:
+                finish_request(state, 500)
+                raise
+            if isinstance(response, StreamingResponse):
+                response.body_iterator = finish_after(response.body_iterator, state, response.status_code)
+            else:
+                finish_request(state, response.status_code)
+            return response
+        return wrapper
+    return decorator
+
+async def finish_after(body_iterator, state, status):
+    """Yield a streamed body, recording the request once it has been sent."""
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        finish_request(state, status)
+
+def limit_request_body(request):
+    """Wrap ``request`` so that receiving more than Config.MAX_REQUEST_SIZE fails.
+
+    Starlette spools uploads without a size limit, so the request body is
+    counted as it arrives instead.
+    """
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > Config.MAX_REQUEST_SIZE:
+                raise request_too_large()
+        return message
+    return Request(request.scope, receive)
+
+async def use_response_cache(request):
+    """Whether the response cache applies to this request."""
+    if response_cache is None:
+        return False
+    form = await request.form()
+    return not cache_bypassed(request.headers.get('cache-control'), form.get('cache'))
+
+async def cache_get(params):
+    return await run_in_threadpool(response_cache.get, params)
+
+async def cache_set(params, response):
+    await run_in_threadpool(response_cache.set, params, response)
+
+async def prepare_chat_request(request):
+    """Async counterpart of app.prepare_chat_request."""
+    with stage('validation'):
+        content_length = request.headers.get('content-length', '')
+        try:
+            if content_length.isdigit() and int(content_length) > Config.MAX_REQUEST_SIZE:
+                raise request_too_large()
+            form = await request.form()
+        except UploadTooLargeError as e:
+            raise ChatRequestError(str(e), 413)
+        conversation_id = parse_conversation_id(form.get('conversation_id'))
+        message = form.get('message', '')
+        # Wrap uploads so the Flask file helpers can be reused unchanged
+        files = [
+            FileStorage(stream=upload.file, filename=upload.filename)
+            for upload in form.getlist('attachments[]')
+            if isinstance(upload, UploadFile)
+        ]
+        
+        if conversation_id is None:
+            conversation_id = await async_db.create_conversation(new_conversation_title())
+        elif not await async_db.open_conversation(conversation_id):
+            raise ChatRequestError('Invalid conversation ID')
+    
+    with stage('files'):
+        processed_files = await run_in_threadpool(process_attachments, files)
+    
+    try:
+        with stage('db_write'):
+            await async_db.add_message(conversation_id, 'user', message, attachments=processed_files)
+    except ConversationNotFoundError:
+        raise ChatRequestError('Invalid conversation ID')
+    
+    with stage('history'):
+        claude_messages = await async_db.run(build_context, conversation_id)
+    
+    return conversation_id, claude_messages
+
+@instrumented('chat')
+async def chat(request):
+    request = limit_request_body(request)
+    try:
+        conversation_id, claude_messages = await prepare_chat_request(request)
+        params = build_request_params(claude_messages)
+        use_cache = await use_response_cache(request)
+        
+        assistant_message = None
+        if use_cache:
+            with stage('response_cache'):
+                assistant_message = await cache_get(params)
+        if assistant_message is None:
+            logger.debug(f"Sending async request to Claude with {len(claude_messages)} messages")
+            with stage('upstream'):
+                response = await scheduler.create_async(get_async_client(), params, key=conversation_id)
+            
+            assistant_message = response.content[0].text
+            record_token_usage(Config.MODEL_NAME, response.usage)
+            if use_cache:
+                await cache_set(params, assistant_message)
+        with stage('db_write'):
+            await async_db.add_message(conversation_id, 'assistant', assistant_message)
+        
+        return JSONResponse({
+            'response': assistant_message,
+            'conversation_id': conversation_id
+        })
+    except ChatRequestError as e:
+        return JSONResponse({'error': e.message}, status_code=e.status_code)
+    except Exception as e:
+        logger.error(f"Error in async chat endpoint: {e}")
+        return JSONResponse({'error': format_error_message(e)}, status_code=500)
+
+@instrumented('chat_stream')
+async def chat_stream(request):
+    request = limit_request_body(request)
+    try:
+        conversation_id, claude_messages = await prepare_chat_request(request)
+        params = build_request_params(claude_messages)
+        use_cache = await use_response_cache(request)
+        cached_message = None
+        if use_cache:
+            with stage('response_cache'):
+                cached_message = await cache_get(params)
+    except ChatRequestError as e:
+        return JSONResponse({'error': e.message}, status_code=e.status_code)
+    except Exception as e:
+        logger.error(f"Error in async chat stream endpoint: {e}")
+        return JSONResponse({'error': format_error_message(e)}, status_code=500)
+
+    async def save_assistant_message(chunks):
+        assistant_message = ''.join(chunks)
+        if not assistant_message:
+            return
+        try:
+            # Shielded so a client disconnect cannot cancel the write
+            with stage('db_write'):
+                await asyncio.shield(
+                    async_db.add_message(conversation_id, 'assistant', assistant_message)
+                )
+        except Exception as e:
+            logger.error(f"Failed to save streamed message for conversation {conversation_id}: {e}")
+
+    async def generate():
+        chunks = []
+        saved = False
+        try:
+            yield format_sse('start', {'conversation_id': conversation_id})
+            
+            if cached_message is not None:
+                chunks.append(cached_message)
+                yield format_sse('delta', {'text': cached_message})
+            else:
+                with stage('upstream') as upstream:
+                    async with scheduler.stream_async(get_async_client(), params, key=conversation_id) as stream:
+                        async for text in stream.text_stream:
+                            if not chunks:
+                                observe_stage('upstream_ttft', time.perf_counter() - upstream.start)
+                            chunks.append(text)
+                            yield format_sse('delta', {'text': text})
+                        record_token_usage(Config.MODEL_NAME, (await stream.get_final_message()).usage)
+                if use_cache:
+                    await cache_set(params, ''.join(chunks))
+            
+            await save_assistant_message(chunks)
+            saved = True
+            yield format_sse('done', {'conversation_id': conversation_id})
+        except (asyncio.CancelledError, GeneratorExit):
+            logger.info(f"Client disconnected from stream for conversation {conversation_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Error while streaming async chat response: {e}")
+            yield format_sse('error', {'error': format_error_message(e)})
+        finally:
+            # Persist partial output on disconnect or upstream failure
+            if not saved:
+                await save_assistant_message(chunks)
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+async def built_asset(request):
+    """Serve a built static asset without going through the WSGI bridge."""
+    found = assets.find_asset(request.path_params['name'], request.headers.get('accept-encoding', ''))
+    if found is None:
+        return PlainTextResponse('Not Found', status_code=404)
+    path, content_type, encoding = found
+    return FileResponse(path, media_type=content_type, headers=assets.asset_headers(encoding))
+
+app = Starlette(routes=[
+    Route('/chat', chat, methods=['POST']),
+    Route('/assets/{name:path}', built_asset),
+    Route('/chat/stream', chat_stream, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
@@ -0,0 +1,300 @@
+"""Build step for the static assets: minify, fingerprint and precompress.
+
+The CSS and JavaScript under static/ are minified and written to
+static/dist/ under names that include a hash of their content, e.g.
+``js/main.3f2a9c1d.js``, together with gzip and (when the optional
+``brotli`` package is installed) brotli copies. static/dist/manifest.json
+maps each source path to its built name. A changed file gets a new name,
+so built assets are served with an immutable, year-long Cache-Control and
+templates link to them through asset_url().
+
+The app builds on startup when the sources have changed since the last
+build; the build can also be run ahead of a deploy:
+
+    python assets.py
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# URL prefix the built assets are served under
+URL_PREFIX = '/assets/'
+
+CONTENT_TYPES = {
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+}
+
+# Precompressed variants in order of preference: (encoding, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CACHE_CONTROL = f'public, max-age={Config.ASSET_MAX_AGE}, immutable'
+
+# Characters after which a slash starts a regular expression, not a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = re.compile(r'\b(?:return|typeof|case|do|else|in|of|new|delete|void|throw|yield|await)\s*$')
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE_AROUND = re.compile(r'\s*([{};,>])\s*')
+CSS_SPACE_AFTER_COLON = re.compile(r':\s+')
+
+_manifest = None
+
+def minify_css(text):
+    """Remove comments and insignificant whitespace from a stylesheet."""
+    text = CSS_COMMENT.sub('', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = CSS_SPACE_AROUND.sub(r'\1', text)
+    # Only after a colon: before one it may be a descendant selector (``a :hover``)
+    text = CSS_SPACE_AFTER_COLON.sub(':', text)
+    return text.replace(';}', '}').strip() + '\n'
+
+def _scan_string(text, i):
+    """Return the index just past the string or template literal starting at ``i``."""
+    quote = text[i]
+    i += 1
+    while i < len(text) and text[i] != quote:
+        if text[i] == '\\':
+            i += 1
+        elif quote == '`' and text.startswith('${', i):
+            i = _scan_code(text, i + 2, closing='}')
+            continue
+        i += 1
+    return i + 1
+
+def _scan_regex(text, i):
+    """Return the index just past the regular expression literal starting at ``i``."""
+    i += 1
+    in_class = False
+    while i < len(text) and (in_class or text[i] != '/') and text[i] != '\n':
+        if text[i] == '\\':
+            i += 1
+        elif text[i] == '[':
+            in_class = True
+        elif text[i] == ']':
+            in_class = False
+        i += 1
+    return i + 1
+
+def _scan_code(text, i, closing=None, out=None):
+    """Scan code from ``i`` up to an unmatched ``closing`` brace, skipping comments.
+
+    Returns the index just past ``closing`` (or the end of the text). With
+    ``out``, appends ``(is_literal, text)`` pieces for everything but the
+    comments: strings, template literals and regular expressions as
+    literals, the code between them as it is.
+    """
+    depth = 0
+    last = ''  # Last character of code that is not whitespace
+    while i < len(text):
+        ch = text[i]
+        literal = True
+        if ch in '\'"`':
+            end = _scan_string(text, i)
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = len(text) if end < 0 else end
+            continue
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = len(text) if end < 0 else end + 2
+            # Keep statements on either side of the comment apart
+            if out is not None:
+                out.append((False, '\n'))
+            continue
+        elif ch == '/' and (not last or last in REGEX_PRECEDERS or REGEX_KEYWORDS.search(text[max(0, i - 12):i])):
+            end = _scan_regex(text, i)
+        else:
+            literal = False
+            if ch == '{':
+                depth += 1
+            elif ch == '}':
+                if closing and depth == 0:
+                    return i + 1
+                depth -= 1
+            end = i + 1
+        if out is not None:
+            out.append((literal, text[i:end]))
+        if not ch.isspace():
+            last = text[end - 1]
+        i = end
+    return i
+
+def minify_js(text):
+    """Remove comments, indentation and blank lines from a script.
+
+    Line breaks are kept, so automatic semicolon insertion works as
+    before; gzip and brotli make up most of the difference to a full
+    minifier. Strings, template literals and regular expressions are not
+    touched.
+    """
+    out = []
+    _scan_code(text, 0, out=out)
+    pieces = []
+    code = []
+    for literal, piece in out:
+        if literal:
+            pieces.append(re.sub(r'[ \t]*\n\s*', '\n', ''.join(code)))
+            pieces.append(piece)
+            code = []
+        else:
+            code.append(piece)
+    pieces.append(re.sub(r'[ \t]*\n\s*', '\n', ''.join(code)))
+    return ''.join(pieces).strip() + '\n'
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+def source_files():
+    """Yield the path of every source asset, relative to static/."""
+    for root, dirs, files in os.walk(STATIC_DIR):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != DIST_DIR)
+        for name in sorted(files):
+            if os.path.splitext(name)[1] in MINIFIERS:
+                yield os.path.relpath(os.path.join(root, name), STATIC_DIR).replace(os.sep, '/')
+
+def sources_hash():
+    """Hash of the names and content of all source assets."""
+    digest = hashlib.sha256()
+    for path in source_files():
+        digest.update(path.encode() + b'\0')
+        with open(os.path.join(STATIC_DIR, path), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _write(path, data):
+    """Write a file atomically, so concurrent builds never expose a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def build():
+    """Build every source asset into static/dist/; return the manifest.
+
+    Files from earlier builds are left in place, so pages still open in
+    a browser can load the assets they were served with.
+    """
+    global _manifest
+    files = {}
+    for path in source_files():
+        base, ext = os.path.splitext(path)
+        with open(os.path.join(STATIC_DIR, path), encoding='utf-8') as f:
+            data = MINIFIERS[ext](f.read()).encode('utf-8')
+        built = f'{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        target = os.path.join(DIST_DIR, built)
+        _write(target, data)
+        # mtime=0 makes the output depend only on the content
+        _write(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(target + '.br', brotli.compress(data, quality=11))
+        files[path] = built
+
+    manifest = {'sources': sources_hash(), 'brotli': brotli is not None, 'files': files}
+    _write(MANIFEST_PATH, json.dumps(manifest, indent=2).encode('utf-8'))
+    _manifest = manifest
+    return manifest
+
+def load_manifest():
+    """Return the manifest of the last build (cached), or None if there is none."""
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST_PATH, encoding='utf-8') as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+    return _manifest
+
+def ensure_built():
+    """Build the assets unless the last build is up to date with the sources.
+
+    A build made before the brotli package was installed is redone too.
+    """
+    manifest = load_manifest()
+    if manifest and manifest.get('sources') == sources_hash() and manifest.get('brotli') == (brotli is not None):
+        return manifest
+    try:
+        manifest = build()
+        logger.info(f"Built {len(manifest['files'])} static assets")
+        return manifest
+    except OSError as e:
+        # A read-only deploy falls back to serving the sources from /static
+        logger.error(f"Error building static assets: {e}")
+        return None
+
+def asset_url(path):
+    """URL of a static asset: its built copy if there is one, else the source."""
+    manifest = load_manifest()
+    built = manifest and manifest['files'].get(path)
+    if built:
+        return URL_PREFIX + built
+    return '/static/' + path
+
+def find_asset(name, accept_encoding=''):
+    """Locate a built asset for a request.
+
+    Returns ``(file path, content type, content encoding or None)``, picking
+    the smallest variant the client accepts, or None for names that are not
+    built assets.
+    """
+    manifest = load_manifest()
+    if not manifest or name not in manifest['files'].values():
+        return None
+    path = os.path.join(DIST_DIR, name)
+    content_type = CONTENT_TYPES[os.path.splitext(name)[1]]
+    accepted = accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.exists(path + suffix):
+            return path + suffix, content_type, encoding
+    return path, content_type, None
+
+def accepted_encodings(header):
+    """Content codings allowed by an Accept-Encoding header (q=0 excludes one)."""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        match = re.search(r'q=([0-9.]+)', params)
+        if coding and not (match and float(match.group(1)) == 0):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def asset_headers(encoding):
+    """Response headers for a built asset served with the given content coding."""
+    headers = {'Cache-Control': CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return headers
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    manifest = build()
+    for path, built in manifest['files'].items():
+        sizes = [os.path.getsize(os.path.join(STATIC_DIR, path))]
+        sizes += [
+            os.path.getsize(os.path.join(DIST_DIR, built) + suffix)
+            for suffix in ('', '.gz', '.br')
+            if os.path.exists(os.path.join(DIST_DIR, built) + suffix)
+        ]
+        print(f"{path} -> {built}: {' -> '.join(str(size) for size in sizes)} bytes")
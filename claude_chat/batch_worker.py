@@ -0,0 +1,145 @@
+"""Run bulk jobs through the Message Batches API.
+
+Requests queued with POST /batch are grouped into Message Batches of up to
+Config.BATCH_MAX_REQUESTS, polled until each batch ends, and the
+completions are written back to their conversations in one transaction per
+batch. Calls to the Batches API go through the upstream scheduler like the
+app's, so they are retried and paced by its settings. Run it once (e.g.
+from cron) or as a long-lived background process:
+
+    python batch_worker.py
+    python batch_worker.py --interval 60
+
+Only one worker should run against a database at a time.
+"""
+import argparse
+import functools
+import logging
+import time
+from config import Config
+from context import build_context, build_request_params
+from database import db
+from metrics import counter, record_token_usage
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+BATCH_REQUESTS = counter(
+    'claude_batch_requests_total',
+    'Bulk job requests finished by the batch worker, by result.',
+    ('result',)
+)
+
+# Every Batches API call shares one key, so the worker takes its turn
+# alongside conversations rather than one turn per request
+SCHEDULER_KEY = 'batch_worker'
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """The Anthropic client, created on first use; retries are handled by the scheduler."""
+    import anthropic
+    return anthropic.Client(api_key=Config.ANTHROPIC_API_KEY, max_retries=0)
+
+def batches_api(client):
+    """The Message Batches resource, which older SDKs only expose under ``beta``."""
+    batches = getattr(client.messages, 'batches', None)
+    return batches if batches is not None else client.beta.messages.batches
+
+def custom_id(request_id):
+    return f'request-{request_id}'
+
+def parse_custom_id(value):
+    return int(value.rsplit('-', 1)[1])
+
+def result_error(result):
+    """A readable message for an errored batch result."""
+    error = getattr(result, 'error', None)
+    detail = getattr(error, 'error', None)
+    return getattr(detail, 'message', None) or str(error)
+
+def submit_pending(client):
+    """Submit the oldest queued requests as one Message Batch.
+
+    Returns the number of requests submitted.
+    """
+    requests = db.get_pending_batch_requests(Config.BATCH_MAX_REQUESTS)
+    if not requests:
+        return 0
+
+    batch_requests = [
+        {
+            'custom_id': custom_id(request['id']),
+            'params': build_request_params(build_context(request['conversation_id'])),
+        }
+        for request in requests
+    ]
+    batch = scheduler.call(batches_api(client).create, requests=batch_requests, key=SCHEDULER_KEY)
+    db.mark_batch_requests_submitted([request['id'] for request in requests], batch.id)
+    logger.info(f"Submitted {len(requests)} requests as Message Batch {batch.id}")
+    return len(requests)
+
+def collect_results(client):
+    """Write back the results of every submitted batch that has ended.
+
+    Returns the number of batches completed.
+    """
+    api = batches_api(client)
+    completed = 0
+    for message_batch_id in db.get_submitted_batches():
+        batch = scheduler.call(api.retrieve, message_batch_id, key=SCHEDULER_KEY)
+        if batch.processing_status != 'ended':
+            continue
+
+        results = {}
+        # Results stream in while they are read; only opening them is retried
+        for entry in scheduler.call(api.results, message_batch_id, key=SCHEDULER_KEY):
+            result = entry.result
+            if result.type == 'succeeded':
+                message = result.message
+                results[parse_custom_id(entry.custom_id)] = {
+                    'status': 'succeeded',
+                    'content': ''.join(block.text for block in message.content if block.type == 'text'),
+                    'token_count': message.usage.output_tokens,
+                }
+                record_token_usage(message.model, message.usage)
+            elif result.type == 'errored':
+                results[parse_custom_id(entry.custom_id)] = {
+                    'status': 'errored',
+                    'error': result_error(result),
+                }
+            else:
+                # canceled or expired
+                results[parse_custom_id(entry.custom_id)] = {'status': result.type}
+
+        db.complete_batch_requests(message_batch_id, results)
+        for result in results.values():
+            BATCH_REQUESTS.inc(result=result['status'])
+        completed += 1
+    return completed
+
+def run_once(client):
+    """Submit everything queued, then collect whatever batches have ended."""
+    while submit_pending(client) == Config.BATCH_MAX_REQUESTS:
+        pass
+    return collect_results(client)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued bulk jobs through the Message Batches API.')
+    parser.add_argument(
+        '--interval', type=int, default=0,
+        help='Poll every N seconds instead of running once'
+    )
+    args = parser.parse_args()
+
+    db.init_db()
+    while True:
+        try:
+            run_once(get_client())
+        except Exception as e:
+            logger.error(f"Batch worker run failed: {e}")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Run every pass/fail check in this package, sized to finish in well under a minute.
+
+The checks run one after another, each in its own interpreter, since they
+configure the app through environment variables and module state. A
+check's output is shown only if it fails, and the exit status is non-zero
+if any check failed. Run from the claude_chat directory:
+
+    python -m benchmarks
+    python -m benchmarks scheduler storage
+    python -m benchmarks --list
+
+The checks cover the conversation list, search and metrics endpoints
+(endpoints), both storage backends (storage, which adds PostgreSQL when
+TEST_DATABASE_URL is set or pgserver is installed), archiving, built
+assets, bulk jobs, compaction, image limits, prompt caching, the upstream
+scheduler, uploads and lazy imports at startup. startup gets a loose time
+limit, so it only fails on what the import loads. Left out are the
+measurement-only benchmarks (suite, load_test, history) and search, whose
+only gate is a p99 latency target that depends on the machine.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+# Check module -> arguments that keep it small
+CHECKS = {
+    'endpoints': [],
+    'storage': [],
+    'archive': ['--conversations', '300', '--restores', '20'],
+    'assets': ['--conversations', '500', '--runs', '20'],
+    'batch': ['--requests', '100', '--batch-size', '40', '--batch-delay', '0.2', '--serial', '5'],
+    'compaction': ['--turns', '100'],
+    'images': ['--counts', '1', '--size', '1200x900', '--repeats', '1'],
+    'prompt_cache': [],
+    'scheduler': [],
+    'uploads': ['--size-mb', '4'],
+    'startup': ['--conversations', '1000', '--runs', '3', '--max-seconds', '10'],
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the pass/fail checks.')
+    parser.add_argument('checks', nargs='*', metavar='CHECK', help='Checks to run (default: all)')
+    parser.add_argument('--list', action='store_true', help='List the checks and exit')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds allowed per check')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, check_args in CHECKS.items():
+            print(' '.join(['python -m', f'benchmarks.{name}', *check_args]))
+        return
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    failed = []
+    for name in args.checks or CHECKS:
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(
+                [sys.executable, '-m', f'benchmarks.{name}', *CHECKS[name]],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=args.timeout
+            )
+            passed, output = result.returncode == 0, result.stdout
+        except subprocess.TimeoutExpired as e:
+            passed = False
+            output = (e.stdout or b'').decode(errors='replace') + f'\nTimed out after {args.timeout}s'
+        elapsed = time.perf_counter() - start
+        print(f"{name:<14} {'ok' if passed else 'FAILED'} ({elapsed:.1f}s)", flush=True)
+        if not passed:
+            failed.append(name)
+            # The end of the output holds the report and the failures
+            print('\n'.join(output.splitlines()[-40:]), file=sys.stderr)
+
+    if failed:
+        print(f"{len(failed)} check(s) failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+    print('All checks passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Measure what archiving idle conversations does to the hot database.
+
+Seeds ``--conversations`` conversations of ``--messages`` messages each
+and backdates all but ``--active`` of them, then runs the maintenance
+policy that moves idle conversations to the archive store. Reports the
+bytes the hot database uses before and after, the size of the archive,
+and the median time to restore an archived conversation by opening it.
+Also checks the archive and unarchive endpoints and that a restored
+conversation has the same history as before. Run from the claude_chat
+directory:
+
+    python -m benchmarks.archive --conversations 2000 --messages 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+WORDS = (
+    'the quarterly budget report shows spending on cloud services grew while '
+    'travel costs fell and the team plans to review vendor contracts next month'
+).split()
+
+def used_bytes(database):
+    """Bytes of the hot database's pages that hold data (free pages excluded)."""
+    with database.get_db() as conn:
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return (pages - free) * size
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure archive tiering.')
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=20, help='Messages per conversation')
+    parser.add_argument('--active', type=int, default=100, help='Conversations left active')
+    parser.add_argument('--restores', type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'archive-benchmark')
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'conversations.db')
+    os.environ['ARCHIVE_AFTER_DAYS'] = '30'
+    from app import app, db
+    from maintenance import archive_idle_conversations
+
+    db.init_db()
+    rng = random.Random(0)
+    attachment_id = db.save_attachment('c' * 64, 'text', 'Attached notes ' * 200, 3000, 600)
+    conversation_ids = []
+    for i in range(args.conversations):
+        conversation_id = db.create_conversation(f'Conversation {i}')
+        db.add_messages([
+            {
+                'conversation_id': conversation_id,
+                'role': 'user' if j % 2 == 0 else 'assistant',
+                'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 200))),
+            }
+            for j in range(args.messages)
+        ])
+        conversation_ids.append(conversation_id)
+    db.add_message(conversation_ids[0], 'user', 'See the attached notes', attachments=[
+        {'id': attachment_id, 'sha256': 'c' * 64, 'filename': 'notes.txt', 'token_count': 600}
+    ])
+    idle = conversation_ids[:-args.active] if args.active else conversation_ids
+    with db.get_db() as conn:
+        conn.executemany(
+            "UPDATE conversations SET updated_at = '2020-01-01T00:00:00' WHERE id = ?",
+            [(conversation_id,) for conversation_id in idle]
+        )
+        conn.commit()
+
+    client = app.test_client()
+    failures = []
+    histories = {
+        conversation_id: client.get(f'/conversation/{conversation_id}').get_json()
+        for conversation_id in idle[:args.restores]
+    }
+    report = {'conversations': args.conversations, 'idle': len(idle), 'hot_bytes_before': used_bytes(db)}
+
+    start = time.perf_counter()
+    archived = archive_idle_conversations()
+    report['archive_seconds'] = round(time.perf_counter() - start, 3)
+    if archived != len(idle):
+        failures.append(f'archived {archived} of {len(idle)} idle conversations')
+    db.run_maintenance()
+    report['hot_bytes_after'] = used_bytes(db)
+    report['archive'] = db.get_archive_stats()
+    report['archive_file_bytes'] = sum(
+        os.path.getsize(path) for path in (db.archive_path, db.archive_path + '-wal') if os.path.exists(path)
+    )
+    report['compression_ratio'] = round(report['archive']['raw_bytes'] / max(report['archive']['stored_bytes'], 1), 2)
+    listed = client.get('/conversations?limit=200').get_json()['conversations']
+    if len(listed) != min(args.active, 200):
+        failures.append(f'the conversation list shows {len(listed)} conversations, expected {args.active}')
+
+    # Opening an archived conversation restores it
+    timings = []
+    for conversation_id, history in histories.items():
+        start = time.perf_counter()
+        restored = client.get(f'/conversation/{conversation_id}').get_json()
+        timings.append(time.perf_counter() - start)
+        if restored != history:
+            failures.append(f'conversation {conversation_id} came back with a different history')
+    if timings:
+        report['restore_ms'] = round(statistics.median(timings) * 1000, 3)
+
+    # The endpoints
+    conversation_id = conversation_ids[-1]
+    if client.post(f'/conversation/{conversation_id}/archive').status_code != 200:
+        failures.append('POST /conversation/<id>/archive failed')
+    elif db.get_conversation_messages(conversation_id):
+        failures.append('an archived conversation still has hot messages')
+    archived_list = client.get('/conversations?archived=1&limit=1').get_json()['conversations']
+    if [conv['id'] for conv in archived_list] != [conversation_id]:
+        failures.append('GET /conversations?archived=1 does not list the archived conversation first')
+    if client.post(f'/conversation/{conversation_id}/unarchive').status_code != 200:
+        failures.append('POST /conversation/<id>/unarchive failed')
+    if len(db.get_conversation_messages(conversation_id)) != args.messages:
+        failures.append('unarchiving did not bring the messages back')
+    if client.post('/conversation/999999999/archive').status_code != 404:
+        failures.append('archiving a missing conversation is not a 404')
+    if client.get('/conversation/999999999').status_code != 404:
+        failures.append('opening a missing conversation is not a 404')
+
+    print(json.dumps(report, indent=2))
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
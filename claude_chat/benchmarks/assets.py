@@ -0,0 +1,93 @@
+"""Measure what a browser downloads to show the app shell.
+
+Builds the static assets, then compares the bytes of the page's CSS and
+JavaScript served from /static as they are with the built copies served
+from /assets with gzip and brotli, and checks that built assets are sent
+as immutable with the right Content-Encoding. Also times GET / against a
+database of ``--conversations`` conversations and counts the queries it
+runs; the shell is expected to need none, with the time the old page
+spent fetching the first sidebar page reported for comparison. Run from
+the claude_chat directory:
+
+    python -m benchmarks.assets --conversations 5000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ASSETS = ('css/style.css', 'js/main.js')
+
+def median_ms(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1000, 3)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure asset sizes and app shell latency.')
+    parser.add_argument('--conversations', type=int, default=5000)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'assets-benchmark')
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'assets.db')
+    import assets
+    from app import app, conversation_page, db
+    from config import Config
+    from metrics import REQUEST_DB_QUERIES
+
+    manifest = assets.build()
+    for i in range(args.conversations):
+        db.create_conversation(f'Conversation {i}')
+
+    client = app.test_client()
+    failures = []
+    report = {'assets': {}}
+
+    page = client.get('/')
+    for path in ASSETS:
+        url = assets.asset_url(path)
+        if f'"{url}"' not in page.get_data(as_text=True):
+            failures.append(f'{path}: the page does not link to {url}')
+        sizes = {'source': len(client.get(f'/static/{path}').data)}
+        for accept in ('identity', 'gzip', 'br'):
+            response = client.get(url, headers={'Accept-Encoding': accept})
+            encoding = response.headers.get('Content-Encoding')
+            if accept != 'identity' and encoding != accept and not (accept == 'br' and assets.brotli is None):
+                failures.append(f'{path}: Accept-Encoding {accept} was served as {encoding}')
+            if 'immutable' not in response.headers.get('Cache-Control', ''):
+                failures.append(f'{path}: built asset is not sent as immutable')
+            sizes[encoding or 'minified'] = len(response.data)
+        report['assets'][path] = {'built': manifest['files'][path], 'bytes': sizes}
+
+    report['total_bytes'] = {
+        'before': sum(entry['bytes']['source'] for entry in report['assets'].values()),
+        'after': sum(min(entry['bytes'].values()) for entry in report['assets'].values()),
+    }
+
+    etag = page.headers['ETag']
+    if client.get('/', headers={'If-None-Match': etag}).status_code != 304:
+        failures.append('GET / does not revalidate with its ETag')
+
+    queries_before = REQUEST_DB_QUERIES._values.get(('home',), [None, 0])[1]
+    report['home_ms'] = median_ms(lambda: client.get('/'), args.runs)
+    queries = REQUEST_DB_QUERIES._values.get(('home',), [None, 0])[1] - queries_before
+    report['home_db_queries'] = queries
+    if queries:
+        failures.append(f'GET / ran {queries} database queries')
+    # What the old page did before it could be sent
+    report['first_sidebar_page_ms'] = median_ms(lambda: conversation_page(Config.CONVERSATIONS_PAGE_SIZE), args.runs)
+
+    print(json.dumps(report, indent=2))
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
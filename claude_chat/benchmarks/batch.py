@@ -0,0 +1,135 @@
+"""Run bulk jobs end to end against the stub Message Batches API.
+
+Submits a job through POST /batch (new conversations and follow-ups to
+existing ones), runs the batch worker until every request has finished and
+checks that each reply was written to its conversation. For comparison it
+also times the same number of prompts sent one at a time through /chat.
+Run from the claude_chat directory:
+
+    python -m benchmarks.batch --requests 500 --batch-error-rate 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uvicorn
+from benchmarks import stub_api
+
+def main():
+    parser = argparse.ArgumentParser(description='Check bulk jobs against the stub Message Batches API.')
+    parser.add_argument('--port', type=int, default=8769)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=200, help='Requests per Message Batch')
+    parser.add_argument('--batch-delay', type=float, default=0.5)
+    parser.add_argument('--batch-error-rate', type=float, default=0.05)
+    parser.add_argument('--serial', type=int, default=20, help='Prompts timed through /chat')
+    args = parser.parse_args()
+
+    stub_api.settings.ttft = 0.05
+    stub_api.settings.tokens = 10
+    stub_api.settings.token_interval = 0.002
+    stub_api.settings.batch_delay = args.batch_delay
+    stub_api.settings.batch_error_rate = args.batch_error_rate
+    server = uvicorn.Server(uvicorn.Config(stub_api.app, port=args.port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    os.environ['ANTHROPIC_BASE_URL'] = f'http://127.0.0.1:{args.port}'
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'batch-check')
+    import anthropic
+    import batch_worker
+    from config import Config
+    from database import ConnectionPool, db
+    db_path = os.path.join(tempfile.mkdtemp(), 'batch.db')
+    db.db_path = db_path
+    db.pool = ConnectionPool(db_path)
+    db.init_db()
+    Config.BATCH_MAX_REQUESTS = args.batch_size
+
+    from app import app
+    client = app.test_client()
+    failures = []
+
+    # Half the prompts follow up on existing conversations
+    existing = [db.create_conversation(f'Existing {i}') for i in range(args.requests // 2)]
+    for conversation_id in existing:
+        db.add_message(conversation_id, 'user', f'Hello from {conversation_id}')
+        db.add_message(conversation_id, 'assistant', f'Hi {conversation_id}')
+    requests = [
+        {'conversation_id': conversation_id, 'message': f'Follow-up {conversation_id}'}
+        for conversation_id in existing
+    ] + [
+        {'message': f'Bulk prompt {i}', 'title': f'Bulk {i}'}
+        for i in range(args.requests - len(existing))
+    ]
+
+    start = time.perf_counter()
+    response = client.post('/batch', json={'requests': requests})
+    if response.status_code != 202:
+        print(response.get_data(as_text=True), file=sys.stderr)
+        sys.exit(1)
+    job_id = response.get_json()['job_id']
+
+    api_client = anthropic.Client(api_key='batch-check', max_retries=0)
+    while True:
+        batch_worker.run_once(api_client)
+        job = client.get(f'/batch/{job_id}').get_json()
+        if job['counts'].get('pending', 0) + job['counts'].get('submitted', 0) == 0:
+            break
+        time.sleep(0.1)
+    batch_seconds = time.perf_counter() - start
+
+    for entry in job['requests']:
+        messages = db.get_conversation_messages(entry['conversation_id'])
+        if entry['status'] == 'succeeded':
+            if messages[-1]['role'] != 'assistant' or messages[-2]['role'] != 'user':
+                failures.append(f"request {entry['id']}: reply missing from conversation {entry['conversation_id']}")
+        elif entry['status'] == 'errored':
+            if messages[-1]['role'] != 'user' or not entry['error']:
+                failures.append(f"request {entry['id']}: errored without an error message")
+        else:
+            failures.append(f"request {entry['id']} ended {entry['status']}")
+    if job['counts'].get('succeeded', 0) + job['counts'].get('errored', 0) != args.requests:
+        failures.append(f"counts do not add up: {job['counts']}")
+
+    # Rejected submissions
+    for body, reason in (
+        ({'requests': []}, 'empty job'),
+        ({'requests': [{'message': ''}]}, 'empty message'),
+        ({'requests': [{'conversation_id': 10 ** 9, 'message': 'x'}]}, 'unknown conversation'),
+        ({'requests': [{'conversation_id': existing[0], 'message': 'a'},
+                       {'conversation_id': existing[0], 'message': 'b'}]}, 'repeated conversation'),
+    ):
+        if client.post('/batch', json=body).status_code != 400:
+            failures.append(f'{reason} was accepted')
+
+    # The same number of prompts sent one by one, extrapolated from a sample
+    start = time.perf_counter()
+    for i in range(args.serial):
+        response = client.post('/chat', data={'message': f'Serial prompt {i}'})
+        if response.status_code != 200:
+            failures.append(f'/chat failed: {response.get_data(as_text=True)}')
+            break
+    serial_seconds = (time.perf_counter() - start) / args.serial * args.requests
+
+    server.should_exit = True
+    print(json.dumps({
+        'requests': args.requests,
+        'message_batches': -(-args.requests // args.batch_size),
+        'counts': job['counts'],
+        'batch_job_s': round(batch_seconds, 2),
+        'batch_requests_per_s': round(args.requests / batch_seconds, 1),
+        'serial_chat_s_estimate': round(serial_seconds, 2),
+        'serial_requests_per_s': round(args.requests / serial_seconds, 1),
+    }, indent=2))
+    if failures:
+        print('\n'.join(failures[:20]), file=sys.stderr)
+        sys.exit(1)
+    print('Bulk job replies were written back to every conversation')
+
+if __name__ == '__main__':
+    main()
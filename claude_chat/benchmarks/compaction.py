@@ -0,0 +1,107 @@
+"""Check that compaction keeps the per-turn context bounded.
+
+Grows a conversation turn by turn against the stub Messages API, running
+the compaction worker after each batch of turns, and records the size of
+the context sent to Claude for each turn next to the size it would have
+without compaction. Also checks that the full history is still stored and
+that the context opens with the summary. Run from the claude_chat
+directory:
+
+    python -m benchmarks.compaction --turns 400 --message-tokens 500
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uvicorn
+from benchmarks import stub_api
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that compaction bounds the context size.')
+    parser.add_argument('--port', type=int, default=8772)
+    parser.add_argument('--turns', type=int, default=400, help='User/assistant exchanges to add')
+    parser.add_argument('--message-tokens', type=int, default=500, help='Approximate tokens per message')
+    parser.add_argument('--worker-every', type=int, default=10, help='Turns between worker runs')
+    parser.add_argument('--threshold', type=int, default=20000)
+    parser.add_argument('--keep-tokens', type=int, default=4000)
+    args = parser.parse_args()
+
+    stub_api.settings.ttft = 0
+    stub_api.settings.tokens = 200
+    stub_api.settings.token_interval = 0
+    server = uvicorn.Server(uvicorn.Config(stub_api.app, port=args.port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    os.environ['ANTHROPIC_BASE_URL'] = f'http://127.0.0.1:{args.port}'
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'compaction-check')
+    import anthropic
+    import compaction_worker
+    from config import Config
+    from context import SUMMARY_HEADER, build_context
+    from database import ConnectionPool, db
+    db_path = os.path.join(tempfile.mkdtemp(), 'compaction.db')
+    db.db_path = db_path
+    db.pool = ConnectionPool(db_path)
+    db.init_db()
+    Config.COMPACTION_THRESHOLD = args.threshold
+    Config.COMPACTION_KEEP_TOKENS = args.keep_tokens
+    Config.PROMPT_CACHING = False
+
+    api_client = anthropic.Client(api_key='compaction-check', max_retries=0)
+    conversation_id = db.create_conversation('Long conversation')
+    filler = 'lorem ipsum dolor sit amet ' * (args.message_tokens // 6)
+    context_tokens = []
+    build_ms = []
+    failures = []
+    for turn in range(args.turns):
+        db.add_message(conversation_id, 'user', f'Question {turn}: {filler}')
+        start = time.perf_counter()
+        claude_messages = build_context(conversation_id)
+        build_ms.append((time.perf_counter() - start) * 1000)
+        context_tokens.append(stub_api.count_tokens(claude_messages))
+        db.add_message(conversation_id, 'assistant', f'Answer {turn}: {filler}')
+        if (turn + 1) % args.worker_every == 0:
+            compaction_worker.run_once(api_client)
+
+    summary, _ = db.get_context(conversation_id, 10 ** 9)
+    history = db.get_conversation_messages(conversation_id)
+    if len(history) != args.turns * 2:
+        failures.append(f'{len(history)} messages stored, expected {args.turns * 2}')
+    if summary is None:
+        failures.append('the conversation was never compacted')
+    else:
+        first = build_context(conversation_id)[0]
+        text = first['content'] if isinstance(first['content'], str) else first['content'][0]['text']
+        if not text.startswith(SUMMARY_HEADER):
+            failures.append('the context does not open with the summary')
+
+    # Between worker runs a conversation grows past the threshold by at
+    # most one interval of turns; allow for the stub's rougher token counts
+    bound = 2 * args.threshold
+    if max(context_tokens) > bound:
+        failures.append(f'context reached {max(context_tokens)} tokens, over {bound}')
+
+    server.should_exit = True
+    print(json.dumps({
+        'turns': args.turns,
+        'stored_messages': len(history),
+        'stored_tokens': sum(stub_api.count_tokens(message['content']) for message in history),
+        'summarized_through_message': summary and summary['through_message_id'],
+        'summary_tokens': summary and summary['token_count'],
+        'max_context_tokens': max(context_tokens),
+        'last_context_tokens': context_tokens[-1],
+        'build_context_ms_first_10': round(sum(build_ms[:10]) / 10, 2),
+        'build_context_ms_last_10': round(sum(build_ms[-10:]) / 10, 2),
+    }, indent=2))
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+    print('The context stayed bounded while the full history was kept')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Check the conversation list, search and metrics endpoints.
+
+Seeds a small database, then walks GET /conversations page by page with
+its cursor and checks that every conversation is listed once, newest
+first, with only its id, title and update time. Also checks that the ETag
+revalidates with a 304 until a new message changes the list. GET /search
+must page through every message that matches, mark the matches in
+snippets and find conversations by title. After a /chat request against
+the stub Messages API, /metrics must report that request's stage timings,
+database query count and token usage. Run from the claude_chat directory:
+
+    python -m benchmarks.endpoints --conversations 25
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uvicorn
+from benchmarks import stub_api
+
+def parse_metrics(text):
+    """Map each sample line of the Prometheus text format to its value."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+def check_conversation_list(client, db, conversation_ids, page_size):
+    failures = []
+    listed = []
+    cursor = None
+    while True:
+        query = {'limit': page_size}
+        if cursor:
+            query['cursor'] = cursor
+        page = client.get('/conversations', query_string=query).get_json()
+        listed.extend(page['conversations'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+    ids = [conv['id'] for conv in listed]
+    if sorted(ids) != sorted(conversation_ids):
+        failures.append(f'paging listed {len(ids)} conversations ({len(set(ids))} distinct), expected {len(conversation_ids)}')
+    if [(conv['updated_at'], conv['id']) for conv in listed] != \
+            sorted(((conv['updated_at'], conv['id']) for conv in listed), reverse=True):
+        failures.append('the conversation list is not ordered newest first')
+    if any(set(conv) != {'id', 'title', 'updated_at'} for conv in listed):
+        failures.append('the conversation list returns more than id, title and updated_at')
+    if client.get('/conversations?cursor=not-a-cursor').status_code != 400:
+        failures.append('an invalid cursor is not a 400')
+
+    # Revalidation: 304 until the list changes
+    response = client.get('/conversations', query_string={'limit': page_size})
+    etag = response.headers.get('ETag')
+    if not etag:
+        failures.append('GET /conversations sends no ETag')
+        return failures
+    if client.get('/conversations', headers={'If-None-Match': etag}).status_code != 304:
+        failures.append('an unchanged conversation list is not a 304')
+    oldest = conversation_ids[0]
+    db.add_message(oldest, 'user', 'Bumps the conversation to the top of the list')
+    response = client.get('/conversations', query_string={'limit': page_size}, headers={'If-None-Match': etag})
+    if response.status_code != 200 or response.headers.get('ETag') == etag:
+        failures.append('a new message does not change the conversation list ETag')
+    elif response.get_json()['conversations'][0]['id'] != oldest:
+        failures.append('the conversation with the newest message is not listed first')
+    return failures
+
+def check_search(client, expected_hits, page_size):
+    failures = []
+    hits = []
+    offset = 0
+    while offset is not None:
+        response = client.get('/search', query_string={'q': 'zebrafish', 'limit': page_size, 'offset': offset})
+        if response.status_code != 200:
+            return [f'GET /search failed with {response.status_code}']
+        page = response.get_json()
+        hits.extend(page['messages'])
+        offset = page['next_offset']
+
+    if len({hit['message_id'] for hit in hits}) != expected_hits or len(hits) != expected_hits:
+        failures.append(f'search paged through {len(hits)} hits, expected {expected_hits}')
+    if not all('<mark>' in hit['snippet'] for hit in hits):
+        failures.append('search snippets do not mark the matched term')
+    titles = client.get('/search', query_string={'q': 'quarterly'}).get_json()['conversations']
+    if [conv['title'] for conv in titles] != ['Quarterly report']:
+        failures.append(f'searching titles found {[conv["title"] for conv in titles]}')
+    empty = client.get('/search', query_string={'q': 'nonexistentword'}).get_json()
+    if empty['messages'] or empty['conversations']:
+        failures.append('a query without matches returned results')
+    return failures
+
+def check_metrics(client):
+    failures = []
+    response = client.post('/chat', data={'message': 'Hello metrics'})
+    if response.status_code != 200:
+        return [f'/chat failed: {response.get_data(as_text=True)}']
+    samples = parse_metrics(client.get('/metrics').get_data(as_text=True))
+    expected = [
+        f'claude_chat_stage_seconds_count{{endpoint="chat",stage="{stage}"}}'
+        for stage in ('validation', 'db_write', 'history', 'upstream')
+    ] + [
+        'claude_db_queries_per_request_count{endpoint="chat"}',
+        'claude_http_request_duration_seconds_count{endpoint="chat",status="200"}',
+    ]
+    for name in expected:
+        if samples.get(name, 0) < 1:
+            failures.append(f'/metrics is missing {name}')
+    if not any(name.startswith('claude_tokens_total{') and 'kind="output_tokens"' in name for name in samples):
+        failures.append('/metrics records no output tokens')
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the list, search and metrics endpoints.')
+    parser.add_argument('--conversations', type=int, default=25)
+    parser.add_argument('--page-size', type=int, default=7)
+    parser.add_argument('--port', type=int, default=8773)
+    args = parser.parse_args()
+
+    stub_api.settings.ttft = 0
+    stub_api.settings.token_interval = 0
+    server = uvicorn.Server(uvicorn.Config(stub_api.app, port=args.port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    os.environ['ANTHROPIC_BASE_URL'] = f'http://127.0.0.1:{args.port}'
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'endpoints-check')
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'conversations.db')
+    from app import app, db
+
+    conversation_ids = []
+    for i in range(args.conversations):
+        conversation_id = db.create_conversation('Quarterly report' if i == 0 else f'Conversation {i}')
+        db.add_message(conversation_id, 'user', f'Message {i} about the budget')
+        if i % 3 == 0:
+            db.add_message(conversation_id, 'assistant', f'The zebrafish study in message {i}')
+        conversation_ids.append(conversation_id)
+    expected_hits = len(range(0, args.conversations, 3))
+
+    client = app.test_client()
+    failures = check_conversation_list(client, db, conversation_ids, args.page_size)
+    failures += check_search(client, expected_hits, max(1, args.page_size // 2))
+    failures += check_metrics(client)
+
+    server.should_exit = True
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+    print('The conversation list, search and metrics endpoints behaved as expected')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Benchmark conversation history retrieval.
+
+Seeds a database, then compares the legacy content-partitioned window query
+(without indexes) against GET /conversation/<id> backed by the indexed,
+keyset-paginated query. Run from the claude_chat directory:
+
+    python -m benchmarks.history --conversations 100000 --messages 5000000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+LEGACY_QUERY = '''
+    WITH RankedMessages AS (
+        SELECT id, conversation_id, role, content, timestamp,
+            ROW_NUMBER() OVER (
+                PARTITION BY conversation_id, role, content
+                ORDER BY timestamp DESC, id DESC
+            ) as rn
+        FROM messages
+        WHERE conversation_id = ?
+    )
+    SELECT id, conversation_id, role, content, timestamp
+    FROM RankedMessages
+    WHERE rn = 1
+    ORDER BY timestamp ASC, id ASC
+'''
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(samples):
+    return {
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+    }
+
+def seed(db_path, conversations, messages, content_size, batch_size=50000):
+    """Create the legacy (index-free) schema and fill it with synthetic data."""
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_archived BOOLEAN DEFAULT 0
+        );
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+        );
+    ''')
+    conn.executemany(
+        'INSERT INTO conversations (title) VALUES (?)',
+        ((f'Conversation {i}',) for i in range(conversations))
+    )
+
+    filler = 'x' * content_size
+    rows = []
+    for i in range(messages):
+        # Interleave conversations so each one's rows are scattered across the table
+        conversation_id = i % conversations + 1
+        role = 'user' if (i // conversations) % 2 == 0 else 'assistant'
+        rows.append((conversation_id, role, f'{i} {filler}', f'2024-01-01T00:00:{i:012d}'))
+        if len(rows) >= batch_size:
+            conn.executemany(
+                'INSERT INTO messages (conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?)',
+                rows
+            )
+            rows = []
+    if rows:
+        conn.executemany(
+            'INSERT INTO messages (conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?)',
+            rows
+        )
+    conn.commit()
+    conn.close()
+
+def time_calls(fn, ids):
+    samples = []
+    for conversation_id in ids:
+        start = time.perf_counter()
+        fn(conversation_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=100000)
+    parser.add_argument('--messages', type=int, default=5000000)
+    parser.add_argument('--content-size', type=int, default=200)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=50, help='Page size for the paginated endpoint')
+    parser.add_argument('--db', help='Database path (defaults to a temporary file)')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    print(f"Seeding {args.conversations} conversations / {args.messages} messages into {db_path}")
+    start = time.perf_counter()
+    seed(db_path, args.conversations, args.messages, args.content_size)
+    print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(0)
+    ids = [rng.randint(1, args.conversations) for _ in range(args.samples)]
+
+    # Before: legacy window query against the index-free schema
+    conn = sqlite3.connect(db_path)
+    before = time_calls(lambda cid: conn.execute(LEGACY_QUERY, (cid,)).fetchall(), ids)
+    conn.close()
+
+    # After: the endpoint, once init_db() has migrated the schema and built indexes
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+    from database import ConnectionPool, db
+    db.db_path = db_path
+    db.pool = ConnectionPool(db_path)
+    start = time.perf_counter()
+    db.init_db()
+    migration_seconds = time.perf_counter() - start
+
+    from app import app
+    client = app.test_client()
+    after = time_calls(lambda cid: client.get(f'/conversation/{cid}?limit={args.limit}'), ids)
+
+    print(json.dumps({
+        'conversations': args.conversations,
+        'messages': args.messages,
+        'samples': args.samples,
+        'migration_s': round(migration_seconds, 2),
+        'before_legacy_query': summarize(before),
+        'after_endpoint': summarize(after),
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
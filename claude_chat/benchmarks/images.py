@@ -0,0 +1,157 @@
+"""Benchmark image attachment processing.
+
+Compares the legacy inline, serial pipeline against the process pool for
+requests carrying 1, 5 and 20 images, reporting per-request latency and
+peak RSS. Each scenario runs in a fresh interpreter so peak RSS is not
+shared between scenarios. Also checks that /chat and /chat/stream reject
+images over Config.MAX_IMAGE_PIXELS with a 400, including those so large
+that PIL itself refuses to open them. Run from the claude_chat directory:
+
+    python -m benchmarks.images --counts 1 5 20 --size 4000x3000
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from io import BytesIO
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+def make_jpeg(width, height, seed):
+    """Create a noisy JPEG so the encoder cannot cheat on flat colour."""
+    image = Image.effect_noise((width, height), 64 + seed % 32).convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def make_png_header(width, height):
+    """A PNG that declares the given size but holds a single row of data.
+
+    Opening an image only reads its header, so this exercises the pixel
+    limits without allocating the pixels.
+    """
+    def chunk(kind, data):
+        return len(data).to_bytes(4, 'big') + kind + data + zlib.crc32(kind + data).to_bytes(4, 'big')
+    header = width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes([8, 0, 0, 0, 0])
+    return (
+        b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+        + chunk(b'IDAT', zlib.compress(bytes(width + 1))) + chunk(b'IEND', b'')
+    )
+
+def check_pixel_limits():
+    """Post oversized images to the chat endpoints; return the failures."""
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'limits.db')
+    from app import app
+    from config import Config
+    client = app.test_client()
+    failures = []
+    # Above our limit, and above PIL's own limit of twice ours (over 100M pixels)
+    for width, height in ((8000, 7000), (12000, 9000)):
+        assert width * height > Config.MAX_IMAGE_PIXELS
+        for endpoint in ('/chat', '/chat/stream'):
+            response = client.post(endpoint, data={
+                'message': 'What is in this picture?',
+                'attachments[]': (BytesIO(make_png_header(width, height)), 'huge.png'),
+            }, content_type='multipart/form-data')
+            if response.status_code != 400:
+                failures.append(f'{endpoint}: a {width}x{height} image got {response.status_code}, expected 400')
+    return failures
+
+def legacy_process_image(file):
+    """The original request-thread implementation, kept for comparison."""
+    image = Image.open(file)
+    if image.mode in ('RGBA', 'P'):
+        image = image.convert('RGB')
+    max_dimension = 2048
+    if max(image.size) > max_dimension:
+        ratio = max_dimension / max(image.size)
+        new_size = tuple(int(dim * ratio) for dim in image.size)
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=85, optimize=True)
+    return {'type': 'image', 'data': base64.b64encode(buffer.getvalue()).decode('utf-8')}
+
+def peak_rss_mb():
+    """Peak RSS of this process plus its largest terminated child, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round((own + children) / 1024, 1)
+
+def run_scenario(mode, count, width, height, repeats):
+    images = [make_jpeg(width, height, i) for i in range(count)]
+    files = lambda: [FileStorage(stream=BytesIO(data), filename=f'{i}.jpg') for i, data in enumerate(images)]
+
+    if mode == 'pool':
+        # Attachments are stored and deleted again, so keep away from conversations.db
+        os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'images.db')
+        import image_processing
+        from app import db, process_attachments
+        from uploads import UploadBudget
+        # Spawn the workers before timing, as a long-running server would have
+        image_processing.process_images(images[:1])
+
+        def run():
+            # Measure processing, not the per-message size limit or reuse of stored images
+            process_attachments(files(), UploadBudget(float('inf')))
+            with db.get_db() as conn:
+                conn.execute('DELETE FROM attachments')
+                conn.commit()
+    else:
+        run = lambda: [legacy_process_image(f) for f in files()]
+
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+
+    if mode == 'pool':
+        image_processing.get_executor().shutdown()
+
+    return {
+        'mode': mode,
+        'images': count,
+        'latency_ms': round(min(samples) * 1000, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark image processing.')
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--size', default='4000x3000')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--scenario', nargs=2, metavar=('MODE', 'COUNT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split('x'))
+
+    if args.scenario:
+        mode, count = args.scenario[0], int(args.scenario[1])
+        print(json.dumps(run_scenario(mode, count, width, height, args.repeats)))
+        return
+
+    env = dict(os.environ, ANTHROPIC_API_KEY=os.getenv('ANTHROPIC_API_KEY', 'benchmark'))
+    results = []
+    for count in args.counts:
+        for mode in ('legacy', 'pool'):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.images', '--size', args.size,
+                 '--repeats', str(args.repeats), '--scenario', mode, str(count)],
+                capture_output=True, text=True, env=env, check=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+            print(json.dumps(results[-1]), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+    failures = check_pixel_limits()
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Concurrent load test for /chat against the stub Messages API.
+
+Starts the stub API and the app under test as subprocesses (each with a
+throwaway working directory, so conversations.db is not touched), then
+fires batches of concurrent /chat requests and reports throughput and
+latency per concurrency level. Run from the claude_chat directory:
+
+    python -m benchmarks.load_test --server asgi --concurrency 1 10 50 100 200
+    python -m benchmarks.load_test --server flask --concurrency 1 10 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks.history import summarize
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def start_process(args, env=None, cwd=None):
+    return subprocess.Popen(
+        args, env=env, cwd=cwd,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def wait_for_port(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+def start_servers(args):
+    stub = start_process([
+        sys.executable, '-m', 'benchmarks.stub_api',
+        '--port', str(args.stub_port),
+        '--ttft', str(args.ttft),
+        '--tokens', str(args.tokens),
+        '--token-interval', str(args.token_interval),
+    ], cwd=APP_DIR)
+
+    env = dict(os.environ)
+    env.update({
+        'ANTHROPIC_API_KEY': 'load-test',
+        'ANTHROPIC_BASE_URL': f'http://127.0.0.1:{args.stub_port}',
+        'PYTHONPATH': APP_DIR,
+    })
+    workdir = tempfile.mkdtemp()
+    if args.server == 'asgi':
+        command = [
+            sys.executable, '-m', 'uvicorn', 'asgi:app',
+            '--port', str(args.app_port), '--log-level', 'warning',
+        ]
+    else:
+        command = [
+            sys.executable, '-c',
+            f'from app import app; app.run(port={args.app_port}, threaded=True)',
+        ]
+    server = start_process(command, env=env, cwd=workdir)
+
+    wait_for_port(f'http://127.0.0.1:{args.stub_port}/')
+    wait_for_port(f'http://127.0.0.1:{args.app_port}/conversations')
+    return [stub, server]
+
+async def run_level(client, url, concurrency, requests_per_worker):
+    latencies = []
+    errors = 0
+
+    async def worker(worker_id):
+        nonlocal errors
+        for i in range(requests_per_worker):
+            start = time.perf_counter()
+            response = await client.post(url, data={'message': f'load test {worker_id}-{i}'})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        **summarize(latencies),
+    }
+
+async def run(args):
+    url = f'http://127.0.0.1:{args.app_port}/chat'
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 10)
+    results = []
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        for concurrency in args.concurrency:
+            results.append(await run_level(client, url, concurrency, args.requests_per_worker))
+            print(json.dumps(results[-1]), file=sys.stderr)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test /chat against the stub API.')
+    parser.add_argument('--server', choices=['asgi', 'flask'], default='asgi')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100, 200])
+    parser.add_argument('--requests-per-worker', type=int, default=3)
+    parser.add_argument('--ttft', type=float, default=0.5)
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--token-interval', type=float, default=0.01)
+    parser.add_argument('--stub-port', type=int, default=8765)
+    parser.add_argument('--app-port', type=int, default=8766)
+    args = parser.parse_args()
+
+    processes = start_servers(args)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    print(json.dumps({'server': args.server, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Check that prompt-cache breakpoints stay stable across turns.
+
+Runs a multi-turn conversation (with a large attached file on the first
+turn) through /chat against the stub Messages API, which simulates prompt
+caching. Fails if the prefix up to the previous turn's final breakpoint
+changes between requests, or if follow-up turns stop reading from the
+cache. Run from the claude_chat directory:
+
+    python -m benchmarks.prompt_cache --turns 6
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uvicorn
+
+def breakpoint_positions(messages):
+    """Return (message index, block index) for every cache_control block."""
+    positions = []
+    for i, message in enumerate(messages):
+        if isinstance(message['content'], list):
+            for j, block in enumerate(message['content']):
+                if 'cache_control' in block:
+                    positions.append((i, j))
+    return positions
+
+def strip_cache_control(messages):
+    """Normalize messages to block lists without cache_control, as the API sees them."""
+    stripped = []
+    for message in messages:
+        content = message['content']
+        if isinstance(content, str):
+            content = [{'type': 'text', 'text': content}]
+        content = [{k: v for k, v in block.items() if k != 'cache_control'} for block in content]
+        stripped.append({'role': message['role'], 'content': content})
+    return stripped
+
+def main():
+    parser = argparse.ArgumentParser(description='Check prompt-cache breakpoint stability.')
+    parser.add_argument('--turns', type=int, default=6)
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--file-kb', type=int, default=64)
+    args = parser.parse_args()
+
+    from benchmarks import stub_api
+    stub_api.settings.ttft = 0
+    stub_api.settings.token_interval = 0
+    server = uvicorn.Server(uvicorn.Config(stub_api.app, port=args.port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    os.environ['ANTHROPIC_BASE_URL'] = f'http://127.0.0.1:{args.port}'
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'prompt-cache-check')
+    os.chdir(tempfile.mkdtemp())
+
+    import app as app_module
+    requests = []
+    create = app_module.get_client().messages.create
+
+    def recording_create(**kwargs):
+        requests.append(kwargs['messages'])
+        return create(**kwargs)
+    app_module.get_client().messages.create = recording_create
+
+    client = app_module.app.test_client()
+    attachment = ('x = 1\n' * (args.file_kb * 1024 // 6)).encode()
+    response = client.post('/chat', data={
+        'message': 'Please review this file.',
+        'attachments[]': [(io.BytesIO(attachment), 'big.py')],
+    }).get_json()
+    conversation_id = response['conversation_id']
+    for turn in range(1, args.turns):
+        client.post('/chat', data={
+            'message': f'Follow-up question {turn}',
+            'conversation_id': conversation_id,
+        })
+
+    failures = []
+    report = []
+    for turn, messages in enumerate(requests):
+        positions = breakpoint_positions(messages)
+        report.append({'turn': turn, 'messages': len(messages), 'breakpoints': positions})
+        if turn == 0:
+            continue
+        previous = requests[turn - 1]
+        previous_final = max(i for i, _ in breakpoint_positions(previous))
+        # The previous request's prompt must be an exact prefix of this one
+        if strip_cache_control(messages[:previous_final + 1]) != strip_cache_control(previous[:previous_final + 1]):
+            failures.append(f'turn {turn}: prefix changed before previous breakpoint')
+        if previous_final not in [i for i, _ in positions]:
+            failures.append(f'turn {turn}: no breakpoint on the previous final message')
+
+    usage = app_module.registry.render()
+    for row in report:
+        print(json.dumps(row))
+    print(''.join(line + '\n' for line in usage.splitlines() if line.startswith('claude_tokens_total')))
+
+    from metrics import TOKENS
+    read = TOKENS.value(model=app_module.Config.MODEL_NAME, kind='cache_read_input_tokens')
+    if args.turns > 1 and not read:
+        failures.append('no cache reads recorded')
+
+    server.should_exit = True
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+    print('Prompt-cache breakpoints are stable across turns')
+
+if __name__ == '__main__':
+    main()
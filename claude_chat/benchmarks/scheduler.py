@@ -0,0 +1,248 @@
+"""Exercise the upstream scheduler against the stub Messages API.
+
+The stub fails a share of requests with 429/529 responses, chosen by a
+seeded generator. The check fails unless every request eventually succeeds,
+no more than the concurrency limit is ever in flight, ``retry-after`` is
+honoured and the request-rate bucket paces requests. Fairness is checked on
+the scheduler's semaphore alone: every request joins the queue while no
+slot is free, so the order in which the slots are then granted must be
+exactly round-robin, whatever the timing. Run from the claude_chat
+directory:
+
+    python -m benchmarks.scheduler --error-rate 0.3 --concurrency 4 --seed 0
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import anthropic
+import uvicorn
+from benchmarks import stub_api
+from scheduler import FairSemaphore, TokenBucket, UPSTREAM_RETRIES, UpstreamScheduler
+
+def request_params(text):
+    return {
+        'model': 'stub',
+        'max_tokens': 64,
+        'messages': [{'role': 'user', 'content': text}],
+    }
+
+def workload(heavy, light):
+    """A busy conversation queues ``heavy`` requests ahead of ``light`` one-off conversations."""
+    return ['heavy'] * heavy + [f'light-{i}' for i in range(light)]
+
+class RecordingSemaphore(FairSemaphore):
+    """FairSemaphore that records which key each slot went to, in order."""
+
+    def __init__(self, limit):
+        super().__init__(limit)
+        self.grants = []
+
+    def _granted(self, key):
+        self.grants.append(key)
+
+def round_robin_order(heavy, light):
+    """The grants expected when every request is queued before any slot is free.
+
+    The busy conversation joined first, so it gets the first slot, then each
+    light conversation gets one before the busy one is served again.
+    Served first-come first-served, its whole backlog would go first.
+    """
+    return ['heavy'] + [f'light-{i}' for i in range(light)] + ['heavy'] * (heavy - 1)
+
+def grant_order_sync(keys, concurrency):
+    """Queue a thread per key on a semaphore with no free slots, then open ``concurrency``.
+
+    Each thread joins the queue before the next starts and gives its slot
+    back as soon as it has it, so the grants depend only on the queues.
+    """
+    slots = RecordingSemaphore(0)
+
+    def take(key):
+        slots.acquire(key)
+        slots.release()
+
+    threads = []
+    for key in keys:
+        thread = threading.Thread(target=take, args=(key,))
+        thread.start()
+        threads.append(thread)
+        while slots.waiting() < len(threads):
+            time.sleep(0.001)
+    for _ in range(concurrency):
+        slots.release()
+    for thread in threads:
+        thread.join()
+    return slots.grants
+
+async def grant_order_async(keys, concurrency):
+    """Async counterpart of grant_order_sync(), with a task per key."""
+    slots = RecordingSemaphore(0)
+
+    async def take(key):
+        await slots.acquire_async(key)
+        slots.release()
+
+    tasks = []
+    for key in keys:
+        tasks.append(asyncio.create_task(take(key)))
+        while slots.waiting() < len(tasks):
+            await asyncio.sleep(0)
+    for _ in range(concurrency):
+        slots.release()
+    await asyncio.gather(*tasks)
+    return slots.grants
+
+def run_sync(scheduler, client, keys):
+    start = time.perf_counter()
+    finished = []
+
+    def send(key):
+        scheduler.create(client, request_params(key), key=key)
+        finished.append((key, time.perf_counter() - start))
+
+    with ThreadPoolExecutor(max_workers=len(keys)) as pool:
+        for future in [pool.submit(send, key) for key in keys]:
+            future.result()
+    return finished
+
+async def run_async(scheduler, client, keys):
+    start = time.perf_counter()
+    finished = []
+
+    async def send(index, key):
+        # Alternate plain and streamed requests
+        if index % 2:
+            await scheduler.create_async(client, request_params(key), key=key)
+        else:
+            async with scheduler.stream_async(client, request_params(key), key=key) as stream:
+                async for _ in stream.text_stream:
+                    pass
+        finished.append((key, time.perf_counter() - start))
+
+    tasks = []
+    for index, key in enumerate(keys):
+        tasks.append(asyncio.create_task(send(index, key)))
+        await asyncio.sleep(0)  # Keep submission order deterministic
+    await asyncio.gather(*tasks)
+    return finished
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the upstream scheduler against injected errors.')
+    parser.add_argument('--port', type=int, default=8768)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--error-rate', type=float, default=0.3)
+    parser.add_argument('--heavy', type=int, default=16)
+    parser.add_argument('--light', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the injected errors')
+    args = parser.parse_args()
+
+    stub_api.settings.ttft = 0.05
+    stub_api.settings.tokens = 10
+    stub_api.settings.token_interval = 0.005
+    server = uvicorn.Server(uvicorn.Config(stub_api.app, port=args.port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    client = anthropic.Anthropic(api_key='scheduler-check', base_url=base_url, max_retries=0)
+    async_client = anthropic.AsyncAnthropic(api_key='scheduler-check', base_url=base_url, max_retries=0)
+
+    def new_scheduler(**overrides):
+        settings = dict(
+            max_concurrency=args.concurrency, requests_per_minute=0,
+            input_tokens_per_minute=0, output_tokens_per_minute=0,
+            max_retries=10, backoff_base=0.02, backoff_max=0.5,
+        )
+        settings.update(overrides)
+        return UpstreamScheduler(**settings)
+
+    failures = []
+    report = {}
+    keys = workload(args.heavy, args.light)
+
+    # Sync and async callers under injected 429/529 errors
+    stub_api.settings.error_rate = args.error_rate
+    for mode in ('sync', 'async'):
+        stub_api.stats = stub_api.StubStats()
+        stub_api.rng.seed(args.seed)
+        scheduler = new_scheduler()
+        if mode == 'sync':
+            finished = run_sync(scheduler, client, keys)
+        else:
+            finished = asyncio.run(run_async(scheduler, async_client, keys))
+        stats = stub_api.stats
+        result = {
+            'requests': len(keys),
+            'completed': len(finished),
+            'upstream_attempts': stats.requests,
+            'injected_errors': stats.errors,
+            'max_in_flight': stats.max_in_flight,
+            # Completion times vary from run to run; reported, not checked
+            'heavy_mean_s': round(statistics.mean(t for key, t in finished if key == 'heavy'), 3),
+            'light_mean_s': round(statistics.mean(t for key, t in finished if key != 'heavy'), 3),
+        }
+        report[mode] = result
+        if result['completed'] != len(keys):
+            failures.append(f'{mode}: {len(keys) - len(finished)} requests failed')
+        if stats.max_in_flight > args.concurrency:
+            failures.append(f'{mode}: {stats.max_in_flight} requests in flight, limit {args.concurrency}')
+    if args.error_rate and not sum(value for _, _, value in UPSTREAM_RETRIES.samples()):
+        failures.append('no retries recorded')
+
+    # Slots go round-robin to the conversations waiting for them
+    expected = round_robin_order(args.heavy, args.light)
+    for mode, grants in (
+        ('sync', grant_order_sync(keys, args.concurrency)),
+        ('async', asyncio.run(grant_order_async(keys, args.concurrency))),
+    ):
+        report[mode]['round_robin'] = grants == expected
+        if grants != expected:
+            failures.append(f'{mode}: slots were granted {grants}, expected {expected}')
+
+    # Retry-after is honoured, and retries give up after max_retries
+    stub_api.settings.error_rate = 1.0
+    stub_api.settings.retry_after = 0.2
+    stub_api.stats = stub_api.StubStats()
+    start = time.perf_counter()
+    try:
+        new_scheduler(max_retries=2).create(client, request_params('always fails'))
+        failures.append('request succeeded despite every attempt failing')
+    except anthropic.APIStatusError as e:
+        elapsed = time.perf_counter() - start
+        report['retry_after'] = {
+            'final_status': e.status_code,
+            'attempts': stub_api.stats.requests,
+            'elapsed_s': round(elapsed, 3),
+        }
+        if stub_api.stats.requests != 3:
+            failures.append(f'expected 3 attempts, saw {stub_api.stats.requests}')
+        if elapsed < 0.4:
+            failures.append(f'retry-after ignored: gave up after {elapsed:.2f}s')
+
+    # The request bucket paces requests (10/s with no burst allowance)
+    stub_api.settings.error_rate = 0.0
+    stub_api.settings.retry_after = None
+    paced = new_scheduler()
+    paced.requests = TokenBucket(600, capacity=1)
+    start = time.perf_counter()
+    run_sync(paced, client, ['paced'] * 20)
+    elapsed = time.perf_counter() - start
+    report['rate_limit'] = {'requests': 20, 'requests_per_second': 10, 'elapsed_s': round(elapsed, 3)}
+    if elapsed < 1.8:
+        failures.append(f'request bucket did not pace requests: 20 took {elapsed:.2f}s')
+
+    server.should_exit = True
+    print(json.dumps(report, indent=2))
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+    print('Scheduler retried, limited and shared capacity as expected')
+
+if __name__ == '__main__':
+    main()
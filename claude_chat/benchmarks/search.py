@@ -0,0 +1,154 @@
+"""Benchmark full-text search.
+
+Seeds a database with messages drawn from a Zipf-distributed vocabulary,
+lets init_db() build the FTS5 indexes, then times GET /search for common,
+mid-frequency and rare terms, two-word queries and prefixes. The target is
+a p99 under 50ms. Run from the claude_chat directory:
+
+    python -m benchmarks.search --conversations 20000 --messages 2000000
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from benchmarks.history import summarize
+
+TARGET_P99_MS = 50
+
+def make_vocabulary(size):
+    """Distinct pronounceable words, most frequent first."""
+    syllables = [c + v for c in 'bdfgklmnprstvz' for v in 'aeiou']
+    words = []
+    for length in itertools.count(2):
+        for parts in itertools.product(syllables, repeat=length):
+            words.append(''.join(parts))
+            if len(words) == size:
+                return words
+
+def seed(db_path, conversations, messages, words_per_message, vocabulary, rng, batch_size=20000):
+    """Create the base schema and fill it with Zipf-distributed text."""
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_archived BOOLEAN DEFAULT 0
+        );
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+        );
+    ''')
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+    def text(length):
+        return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=length))
+
+    conn.executemany(
+        'INSERT INTO conversations (title) VALUES (?)',
+        ((text(4),) for _ in range(conversations))
+    )
+    rows = []
+    for i in range(messages):
+        conversation_id = i % conversations + 1
+        role = 'user' if (i // conversations) % 2 == 0 else 'assistant'
+        length = max(1, int(rng.expovariate(1 / words_per_message)))
+        rows.append((conversation_id, role, text(length), f'2024-01-01T00:00:{i:012d}'))
+        if len(rows) >= batch_size:
+            conn.executemany(
+                'INSERT INTO messages (conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?)',
+                rows
+            )
+            rows = []
+    if rows:
+        conn.executemany(
+            'INSERT INTO messages (conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?)',
+            rows
+        )
+    conn.commit()
+    conn.close()
+
+def make_queries(vocabulary, rng, samples):
+    """Queries by kind, drawn from different parts of the frequency distribution."""
+    def word(low, high):
+        return vocabulary[rng.randrange(low, min(high, len(vocabulary)))]
+
+    size = len(vocabulary)
+    return {
+        'common': [word(0, 10) for _ in range(samples)],
+        'mid': [word(100, 1000) for _ in range(samples)],
+        'rare': [word(size // 2, size) for _ in range(samples)],
+        'two_words': [f'{word(0, 1000)} {word(100, 5000)}' for _ in range(samples)],
+        'prefix': [word(100, 1000)[:3] for _ in range(samples)],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=20000)
+    parser.add_argument('--messages', type=int, default=2000000)
+    parser.add_argument('--words-per-message', type=int, default=60)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--samples', type=int, default=200, help='Queries per kind')
+    parser.add_argument('--db', help='Database path (defaults to a temporary file)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(args.vocabulary)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'search.db')
+    print(f"Seeding {args.conversations} conversations / {args.messages} messages into {db_path}")
+    start = time.perf_counter()
+    seed(db_path, args.conversations, args.messages, args.words_per_message, vocabulary, rng)
+    print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+    from database import ConnectionPool, db
+    db.db_path = db_path
+    db.pool = ConnectionPool(db_path)
+    start = time.perf_counter()
+    db.init_db()
+    index_seconds = time.perf_counter() - start
+    db.run_maintenance()
+
+    from app import app
+    client = app.test_client()
+    results = {}
+    all_samples = []
+    for kind, queries in make_queries(vocabulary, rng, args.samples).items():
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            response = client.get('/search', query_string={'q': query})
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        results[kind] = summarize(samples)
+        all_samples.extend(samples)
+    overall = summarize(all_samples)
+
+    print(json.dumps({
+        'conversations': args.conversations,
+        'messages': args.messages,
+        'database_mb': round(os.path.getsize(db_path) / 1024 / 1024, 1),
+        'index_build_s': round(index_seconds, 2),
+        'endpoint': results,
+        'overall': overall,
+        'target_p99_ms': TARGET_P99_MS,
+    }, indent=2))
+    if overall['p99_ms'] > TARGET_P99_MS:
+        print(f"p99 {overall['p99_ms']}ms exceeds the {TARGET_P99_MS}ms target", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
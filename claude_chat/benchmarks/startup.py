@@ -0,0 +1,93 @@
+"""Measure how long a worker takes to import the app.
+
+Seeds a database of ``--conversations`` conversations, then starts fresh
+interpreters that import the app module (``app`` for the Flask server,
+``asgi`` for uvicorn) against it and reports the median import time. The
+first start applies the schema migrations; later ones should only read
+the schema version, so their time must not grow with the database. The
+check fails if the median is above ``--max-seconds`` or if PIL, tiktoken
+or anthropic were loaded during the import. Run from the claude_chat
+directory:
+
+    python -m benchmarks.startup --conversations 20000 --max-seconds 1.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Prints the import time and the heavy modules that were actually loaded
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [
+    name for name in ('PIL', 'tiktoken', 'anthropic')
+    if name in sys.modules and type(sys.modules[name]).__name__ != '_LazyModule'
+]
+print(json.dumps({{'seconds': elapsed, 'loaded': loaded}}))
+'''
+
+def start_worker(module, env):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module)],
+        env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold start time of the app.')
+    parser.add_argument('--module', default='app', choices=('app', 'asgi'))
+    parser.add_argument('--conversations', type=int, default=20000)
+    parser.add_argument('--messages', type=int, default=5, help='Messages per conversation')
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--max-seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('ANTHROPIC_API_KEY', 'startup-check')
+    env['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'startup.db')
+    # Seed through the storage API without importing the app here
+    os.environ.update(env)
+    from database import Database
+    database = Database(env['DATABASE_PATH'])
+    database.init_db()
+    for i in range(args.conversations):
+        conversation_id = database.create_conversation(f'Conversation {i}')
+        database.add_messages([
+            {'conversation_id': conversation_id, 'role': 'user', 'content': f'Message {j} of {i}', 'token_count': 4}
+            for j in range(args.messages)
+        ])
+    # Start again without migrations applied, as an existing database would be
+    with database.get_db() as conn:
+        conn.execute('DROP TABLE schema_migrations')
+        conn.commit()
+
+    first = start_worker(args.module, env)
+    runs = [start_worker(args.module, env) for _ in range(args.runs)]
+    median = statistics.median(run['seconds'] for run in runs)
+    report = {
+        'module': args.module,
+        'conversations': args.conversations,
+        'messages': args.conversations * args.messages,
+        'first_start_s': round(first['seconds'], 3),
+        'median_start_s': round(median, 3),
+        'loaded': sorted({name for run in runs for name in run['loaded']}),
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if median > args.max_seconds:
+        failures.append(f'median start of {median:.3f}s is above the {args.max_seconds}s target')
+    if report['loaded']:
+        failures.append(f"importing {args.module} loaded {', '.join(report['loaded'])}")
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
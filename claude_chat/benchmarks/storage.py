@@ -0,0 +1,256 @@
+"""Run the same checks against every storage backend.
+
+Exercises each StorageBackend method against a temporary SQLite database
+and, when one is available, a PostgreSQL database, and checks that both
+backends give the same results. PostgreSQL is taken from ``--postgres-url``
+or the TEST_DATABASE_URL environment variable; failing that, a throwaway
+server is started with the ``pgserver`` package if it is installed. The
+database must be empty or disposable: its tables are dropped first. Also
+times concurrent writes through each backend's connection pool. Run from
+the claude_chat directory:
+
+    python -m benchmarks.storage
+    python -m benchmarks.storage --postgres-url postgresql://localhost/claude_chat_test
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('ANTHROPIC_API_KEY', 'storage-check')
+
+TABLES = (
+    'message_attachments', 'conversation_summaries', 'batch_requests', 'batch_jobs',
+    'attachments', 'messages', 'conversations', 'conversation_list_version', 'schema_migrations',
+    'conversation_archives',
+)
+
+def postgres_url(explicit):
+    """Return a PostgreSQL URL to test against, or None."""
+    url = explicit or os.getenv('TEST_DATABASE_URL')
+    if url:
+        return url
+    try:
+        import pgserver
+    except ImportError:
+        return None
+    server = pgserver.get_server(tempfile.mkdtemp(), cleanup_mode='stop')
+    # Keep the server running until the process exits
+    postgres_url.server = server
+    return server.get_uri()
+
+def reset_postgres(database):
+    with database.get_db() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {', '.join(TABLES)} CASCADE")
+        conn.commit()
+
+def exercise(database):
+    """Call every backend method; return the results that should match across backends."""
+    from storage import ConversationNotFoundError
+    results = {}
+    database.init_db()
+
+    first = database.create_conversation('Quarterly planning notes')
+    second = database.create_conversation('Recipes to try')
+    version = database.get_conversation_list_version()
+    database.add_message(first, 'user', 'What changed in the café budget?')
+    database.add_message(first, 'assistant', 'The café budget grew by 10% this quarter.')
+    database.add_message(first, 'assistant', 'The café budget grew by 10% this quarter.')
+    results['list_version_changed'] = database.get_conversation_list_version() != version
+    try:
+        database.add_message(10 ** 9, 'user', 'missing')
+        results['missing_conversation'] = 'accepted'
+    except ConversationNotFoundError:
+        results['missing_conversation'] = 'rejected'
+
+    text_id = database.save_attachment('a' * 64, 'text', 'naïve → UTF-8 bytes'.encode(), 24, 6)
+    results['attachment_reused'] = database.save_attachment('a' * 64, 'text', b'other', 5, 1) == text_id
+    image_id = database.save_attachment('b' * 64, 'image', 'aGVsbG8=', 5, 3)
+    database.add_message(second, 'user', 'Here are two files', attachments=[
+        {'id': text_id, 'sha256': 'a' * 64, 'filename': 'notes.txt', 'token_count': 6},
+        {'id': image_id, 'sha256': 'b' * 64, 'filename': 'photo.jpg', 'token_count': 3},
+    ])
+    results['attachment'] = {
+        key: value for key, value in database.get_attachment(text_id).items() if key not in ('id', 'created_at')
+    }
+    results['attachment_by_hash'] = database.get_attachment_by_hash('b' * 64)['type']
+
+    added = database.add_messages([
+        {'conversation_id': second, 'role': 'assistant', 'content': 'Thanks, reading them now.'},
+        {'conversation_id': 10 ** 9, 'role': 'user', 'content': 'skipped'},
+    ])
+    results['bulk_added'] = [message_id is not None for message_id in added]
+
+    def strip(messages):
+        return [
+            {
+                'role': message['role'],
+                'content': message['content'],
+                'attachments': [
+                    {key: value for key, value in attachment.items() if key != 'id'}
+                    for attachment in message['attachments']
+                ],
+            }
+            for message in messages
+        ]
+
+    results['history'] = strip(database.get_conversation_messages(second))
+    results['history_page'] = strip(database.get_conversation_messages(first, limit=1))
+    summary, context = database.get_context(second, 10 ** 6)
+    results['context'] = strip(context)
+
+    # Compaction
+    messages = database.get_conversation_messages(first)
+    results['compaction_candidates'] = first in database.get_compaction_candidates(5)
+    summary, to_compact = database.get_messages_to_compact(first, 1, 10 ** 6)
+    results['to_compact'] = len(to_compact)
+    results['summary_saved'] = database.save_summary(first, messages[0]['id'], 'They asked about the budget.', 7)
+    results['older_summary_saved'] = database.save_summary(first, messages[0]['id'] - 1, 'Older.', 2)
+    summary, context = database.get_context(first, 10 ** 6)
+    results['compacted_context'] = (summary['content'], strip(context))
+
+    # Listing, renaming and paging
+    database.update_conversation_title(second, 'Recipes worth trying')
+    conversations = database.get_conversations(limit=1)
+    rest = database.get_conversations(after=(conversations[0]['updated_at'], conversations[0]['id']))
+    results['conversation_pages'] = [conv['title'] for conv in conversations + rest]
+    results['conversation'] = database.get_conversation(second)['title']
+    results['exists'] = [database.conversation_exists(first), database.conversation_exists(10 ** 9)]
+
+    # Search
+    results['search_messages'] = [
+        (hit['role'], hit['title'], hit['snippet'].count('\x02'))
+        for hit in database.search_messages('café budg')
+    ]
+    results['search_conversations'] = [hit['title'] for hit in database.search_conversations('recipes')]
+    results['search_nothing'] = database.search_messages('   ')
+
+    # Bulk jobs
+    job_id, requests = database.create_batch_job([
+        {'conversation_id': first, 'message': 'Summarize the budget'},
+        {'title': 'New bulk conversation', 'message': 'Hello from a bulk job'},
+    ])
+    pending = database.get_pending_batch_requests(10)
+    database.mark_batch_requests_submitted([request['id'] for request in pending], 'msgbatch_1')
+    results['submitted_batches'] = database.get_submitted_batches()
+    database.complete_batch_requests('msgbatch_1', {
+        requests[0]['id']: {'status': 'succeeded', 'content': 'Budget summary', 'token_count': 3},
+        requests[1]['id']: {'status': 'errored', 'error': 'overloaded'},
+    })
+    job = database.get_batch_job(job_id)
+    results['batch_job'] = (job['counts'], [(request['status'], request['error']) for request in job['requests']])
+    try:
+        database.create_batch_job([{'conversation_id': 10 ** 9, 'message': 'x'}])
+        results['batch_missing_conversation'] = 'accepted'
+    except ConversationNotFoundError:
+        results['batch_missing_conversation'] = 'rejected'
+
+    # Archiving
+    history = strip(database.get_conversation_messages(second))
+    results['archived'] = database.archive_conversation(second)
+    results['archived_hidden'] = [
+        second in [conv['id'] for conv in database.get_conversations()],
+        second in [conv['id'] for conv in database.get_conversations(archived=True)],
+        database.get_conversation_messages(second),
+        database.search_messages('reading them'),
+    ]
+    results['archive_stats'] = {
+        key: value for key, value in database.get_archive_stats().items() if key in ('conversations', 'messages')
+    }
+    database.add_message(second, 'user', 'Back again')
+    results['restored_history'] = strip(database.get_conversation_messages(second)) == history + [
+        {'role': 'user', 'content': 'Back again', 'attachments': []}
+    ]
+    results['restored_search'] = len(database.search_messages('reading them'))
+    database.archive_conversation(second)
+    results['reopened'] = database.restore_conversation(second)
+    results['archive_missing_conversation'] = database.restore_conversation(10 ** 9)
+    database.create_batch_job([{'conversation_id': first, 'message': 'One more thing'}])
+    results['archive_busy'] = database.archive_conversation(first)
+
+    # Deleting and maintenance
+    results['deleted'] = database.delete_conversation(second)
+    results['deleted_history'] = database.get_conversation_messages(second)
+    results['deleted_exists'] = database.conversation_exists(second)
+    database.run_maintenance()
+    results['after_maintenance'] = [conv['title'] for conv in database.get_conversations()]
+    return results
+
+def time_writes(database, threads, messages):
+    """Add messages to separate conversations from several threads; return messages per second."""
+    conversation_ids = [database.create_conversation(f'Load {i}') for i in range(threads)]
+
+    def write(conversation_id):
+        for i in range(messages):
+            database.add_message(conversation_id, 'user', f'Message {i} in {conversation_id}')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(write, conversation_ids))
+    return round(threads * messages / (time.perf_counter() - start), 1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the storage backends against each other.')
+    parser.add_argument('--postgres-url')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=200, help='Messages written per thread')
+    args = parser.parse_args()
+
+    from database import Database
+    backends = {'sqlite': Database(os.path.join(tempfile.mkdtemp(), 'storage.db'))}
+    url = postgres_url(args.postgres_url)
+    if url:
+        from postgres_database import PostgresDatabase
+        backends['postgresql'] = PostgresDatabase(url)
+        reset_postgres(backends['postgresql'])
+    else:
+        print('No PostgreSQL database available; checking SQLite only', file=sys.stderr)
+
+    results = {}
+    report = {}
+    for name, database in backends.items():
+        results[name] = exercise(database)
+        report[name] = {'concurrent_writes_per_s': time_writes(database, args.threads, args.messages)}
+
+    failures = []
+    expected = results['sqlite']
+    checks = {
+        'list_version_changed': True,
+        'missing_conversation': 'rejected',
+        'attachment_reused': True,
+        'bulk_added': [True, False],
+        'compaction_candidates': True,
+        'summary_saved': True,
+        'older_summary_saved': False,
+        'batch_missing_conversation': 'rejected',
+        'archived': True,
+        'archived_hidden': [False, True, [], []],
+        'archive_stats': {'conversations': 1, 'messages': 2},
+        'restored_history': True,
+        'restored_search': 1,
+        'reopened': True,
+        'archive_missing_conversation': False,
+        'archive_busy': False,
+        'deleted': True,
+        'deleted_history': [],
+        'deleted_exists': False,
+    }
+    for key, value in checks.items():
+        if expected[key] != value:
+            failures.append(f'sqlite: {key} is {expected[key]!r}, expected {value!r}')
+    for name, result in results.items():
+        for key, value in expected.items():
+            if result[key] != value:
+                failures.append(f'{name}: {key} is {result[key]!r}, sqlite gave {value!r}')
+
+    print(json.dumps(report, indent=2))
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+    print(f"{' and '.join(backends)} passed the storage checks")
+
+if __name__ == '__main__':
+    main()
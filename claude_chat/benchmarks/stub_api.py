@@ -0,0 +1,310 @@
+"""Local stand-in for the Anthropic Messages API.
+
+Implements ``POST /v1/messages`` (plain and ``stream: true``) with
+configurable latency so the app can be load-tested without calling the
+real API, plus the Message Batches endpoints; a batch ends ``batch_delay``
+seconds after it is created. Prompt caching is simulated: the prefix up to each
+``cache_control`` breakpoint is remembered, and later requests that
+repeat a remembered prefix report it as ``cache_read_input_tokens``.
+A fraction of requests can be failed with 429/529 responses (optionally
+carrying ``retry-after``) to exercise the upstream scheduler; which ones
+fail is drawn from ``rng``, seeded with ``--seed``. Point the app
+at it with ``ANTHROPIC_BASE_URL``:
+
+    python -m benchmarks.stub_api --port 8765 --ttft 0.5 --tokens 50 --token-interval 0.01
+    python -m benchmarks.stub_api --error-rate 0.2 --error-status 429 529 --retry-after 1 --seed 0
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 uvicorn asgi:app
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+class StubSettings:
+    ttft = 0.5  # Seconds before the first token
+    tokens = 50  # Output tokens per response
+    token_interval = 0.01  # Seconds between streamed tokens
+    error_rate = 0.0  # Fraction of requests answered with an error
+    error_statuses = (429, 529)
+    retry_after = None  # Seconds sent in retry-after on injected errors
+    batch_delay = 1.0  # Seconds before a Message Batch ends
+    batch_error_rate = 0.0  # Fraction of batch requests that end errored
+
+settings = StubSettings()
+
+class StubStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+stats = StubStats()
+
+# Decides which requests get injected errors; seed it for repeatable runs
+rng = random.Random()
+
+ERROR_TYPES = {
+    429: 'rate_limit_error',
+    500: 'api_error',
+    529: 'overloaded_error',
+}
+
+def injected_error():
+    """Return an error response for this request, or None to serve it."""
+    if not settings.error_rate or rng.random() >= settings.error_rate:
+        return None
+    stats.errors += 1
+    status = rng.choice(settings.error_statuses)
+    headers = {}
+    if settings.retry_after is not None:
+        headers['retry-after'] = str(settings.retry_after)
+    error_type = ERROR_TYPES.get(status, 'api_error')
+    return JSONResponse({
+        'type': 'error',
+        'error': {'type': error_type, 'message': f'Injected {error_type}'},
+    }, status_code=status, headers=headers)
+
+# Hashes of prompt prefixes written to the simulated prompt cache
+prompt_cache = set()
+
+def count_tokens(value):
+    """Rough token count, four characters per token."""
+    return len(json.dumps(value)) // 4 + 1
+
+def cache_usage(body):
+    """Simulate prompt caching for a request and return its input usage.
+
+    Each breakpoint's prefix is hashed over all blocks up to and including
+    the breakpoint. The longest prefix already in the cache is read; the
+    remainder up to the last breakpoint is written.
+    """
+    blocks = []
+    for message in body.get('messages', []):
+        content = message['content']
+        if isinstance(content, str):
+            content = [{'type': 'text', 'text': content}]
+        for block in content:
+            blocks.append((message['role'], block))
+
+    def strip(block):
+        return {key: value for key, value in block.items() if key != 'cache_control'}
+
+    read_tokens = 0
+    written_tokens = 0
+    digest = hashlib.sha256()
+    prefix_tokens = 0
+    for role, block in blocks:
+        digest.update(json.dumps([role, strip(block)], sort_keys=True).encode())
+        prefix_tokens += count_tokens(strip(block))
+        if 'cache_control' in block:
+            key = digest.hexdigest()
+            if key in prompt_cache:
+                read_tokens = prefix_tokens
+            else:
+                prompt_cache.add(key)
+            written_tokens = prefix_tokens
+
+    total_tokens = sum(count_tokens(strip(block)) for _, block in blocks)
+    creation_tokens = max(0, written_tokens - read_tokens)
+    return {
+        'input_tokens': total_tokens - read_tokens - creation_tokens,
+        'cache_creation_input_tokens': creation_tokens,
+        'cache_read_input_tokens': read_tokens,
+    }
+
+def message_payload(body, text, output_tokens):
+    return {
+        'id': f'msg_{uuid.uuid4().hex}',
+        'type': 'message',
+        'role': 'assistant',
+        'model': body.get('model', 'stub'),
+        'content': [{'type': 'text', 'text': text}],
+        'stop_reason': 'end_turn',
+        'stop_sequence': None,
+        'usage': {
+            **cache_usage(body),
+            'output_tokens': output_tokens,
+        },
+    }
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def messages(request: Request):
+    body = await request.json()
+    stats.requests += 1
+    error = injected_error()
+    if error is not None:
+        return error
+    # Vary the reply so the app's duplicate-message check never drops it
+    words = [f'{uuid.uuid4().hex[:8]} '] + [f'token{i} ' for i in range(1, settings.tokens)]
+
+    if not body.get('stream'):
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            await asyncio.sleep(settings.ttft + settings.token_interval * settings.tokens)
+        finally:
+            stats.in_flight -= 1
+        return JSONResponse(message_payload(body, ''.join(words), settings.tokens))
+
+    async def generate():
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            async for frame in stream_frames():
+                yield frame
+        finally:
+            stats.in_flight -= 1
+
+    async def stream_frames():
+        message = message_payload(body, '', 0)
+        message['content'] = []
+        message['stop_reason'] = None
+        await asyncio.sleep(settings.ttft)
+        yield sse('message_start', {'type': 'message_start', 'message': message})
+        yield sse('content_block_start', {
+            'type': 'content_block_start', 'index': 0,
+            'content_block': {'type': 'text', 'text': ''},
+        })
+        for word in words:
+            yield sse('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0,
+                'delta': {'type': 'text_delta', 'text': word},
+            })
+            await asyncio.sleep(settings.token_interval)
+        yield sse('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        yield sse('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': settings.tokens},
+        })
+        yield sse('message_stop', {'type': 'message_stop'})
+
+    return StreamingResponse(generate(), media_type='text/event-stream')
+
+# Message Batches by id: {'created': monotonic time, 'requests': [...]}
+batches = {}
+
+def timestamp(seconds_from_now=0):
+    moment = datetime.now(timezone.utc) + timedelta(seconds=seconds_from_now)
+    return moment.isoformat().replace('+00:00', 'Z')
+
+def batch_payload(request, batch_id):
+    batch = batches[batch_id]
+    ended = time.monotonic() - batch['created'] >= settings.batch_delay
+    count = len(batch['requests'])
+    errored = sum(1 for entry in batch['requests'] if entry['errored'])
+    return {
+        'id': batch_id,
+        'type': 'message_batch',
+        'processing_status': 'ended' if ended else 'in_progress',
+        'request_counts': {
+            'processing': 0 if ended else count,
+            'succeeded': count - errored if ended else 0,
+            'errored': errored if ended else 0,
+            'canceled': 0,
+            'expired': 0,
+        },
+        'created_at': batch['created_at'],
+        'expires_at': batch['expires_at'],
+        'ended_at': timestamp() if ended else None,
+        'archived_at': None,
+        'cancel_initiated_at': None,
+        'results_url': str(request.url_for('batch_results', batch_id=batch_id)) if ended else None,
+    }
+
+async def create_batch(request: Request):
+    body = await request.json()
+    stats.requests += 1
+    batch_id = f'msgbatch_{uuid.uuid4().hex}'
+    batches[batch_id] = {
+        'created': time.monotonic(),
+        'created_at': timestamp(),
+        'expires_at': timestamp(24 * 3600),
+        'requests': [
+            {
+                'custom_id': entry['custom_id'],
+                'params': entry['params'],
+                'errored': rng.random() < settings.batch_error_rate,
+            }
+            for entry in body['requests']
+        ],
+    }
+    return JSONResponse(batch_payload(request, batch_id))
+
+async def retrieve_batch(request: Request):
+    batch_id = request.path_params['batch_id']
+    if batch_id not in batches:
+        return JSONResponse({
+            'type': 'error',
+            'error': {'type': 'not_found_error', 'message': f'No batch {batch_id}'},
+        }, status_code=404)
+    return JSONResponse(batch_payload(request, batch_id))
+
+async def batch_results(request: Request):
+    batch_id = request.path_params['batch_id']
+    lines = []
+    for entry in batches[batch_id]['requests']:
+        if entry['errored']:
+            result = {
+                'type': 'errored',
+                'error': {
+                    'type': 'error',
+                    'error': {'type': 'invalid_request_error', 'message': 'Injected batch error'},
+                },
+            }
+        else:
+            words = [f'{uuid.uuid4().hex[:8]} '] + [f'token{i} ' for i in range(1, settings.tokens)]
+            result = {
+                'type': 'succeeded',
+                'message': message_payload(entry['params'], ''.join(words), settings.tokens),
+            }
+        lines.append(json.dumps({'custom_id': entry['custom_id'], 'result': result}))
+    return Response('\n'.join(lines) + '\n', media_type='application/binary')
+
+app = Starlette(routes=[
+    Route('/v1/messages', messages, methods=['POST']),
+    Route('/v1/messages/batches', create_batch, methods=['POST']),
+    Route('/v1/messages/batches/{batch_id}', retrieve_batch, methods=['GET']),
+    Route('/v1/messages/batches/{batch_id}/results', batch_results, methods=['GET'], name='batch_results'),
+])
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the stub Messages API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=settings.ttft)
+    parser.add_argument('--tokens', type=int, default=settings.tokens)
+    parser.add_argument('--token-interval', type=float, default=settings.token_interval)
+    parser.add_argument('--error-rate', type=float, default=settings.error_rate)
+    parser.add_argument('--error-status', type=int, nargs='+', default=list(settings.error_statuses))
+    parser.add_argument('--retry-after', type=float, default=None)
+    parser.add_argument('--batch-delay', type=float, default=settings.batch_delay)
+    parser.add_argument('--batch-error-rate', type=float, default=settings.batch_error_rate)
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the injected errors')
+    args = parser.parse_args()
+
+    settings.ttft = args.ttft
+    settings.tokens = args.tokens
+    settings.token_interval = args.token_interval
+    settings.error_rate = args.error_rate
+    settings.error_statuses = tuple(args.error_status)
+    settings.retry_after = args.retry_after
+    settings.batch_delay = args.batch_delay
+    settings.batch_error_rate = args.batch_error_rate
+    rng.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""Benchmark suite for the HTTP endpoints and the hot Database/utility paths.
+
+Runs the Flask app in-process against the stub Messages API (see
+stub_api.py for latency, streaming and error injection), seeds one
+database per ``--sizes`` entry (``CONVERSATIONSxMESSAGES`` per
+conversation) and reports throughput and p50/p95/p99 latency for each
+endpoint, plus micro-benchmarks for get_conversation_messages,
+add_message, process_image and truncate_messages_to_token_limit.
+
+Results are written as JSON so runs can be compared across commits; the
+compare mode exits non-zero when a p50 or p99 regresses by more than
+``--threshold``. Run from the claude_chat directory:
+
+    python -m benchmarks.suite --sizes 100x10 1000x50 --output base.json
+    python -m benchmarks.suite --error-rate 0.05 --concurrency 8 --output head.json
+    python -m benchmarks.suite --compare base.json head.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import uvicorn
+from werkzeug.datastructures import FileStorage
+from benchmarks import stub_api
+from benchmarks.history import summarize
+from benchmarks.images import make_jpeg
+from benchmarks.search import make_vocabulary
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_size(value):
+    """Parse ``CONVERSATIONSxMESSAGES`` into a pair of ints."""
+    try:
+        conversations, messages = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected CONVERSATIONSxMESSAGES, got {value!r}')
+    return conversations, messages
+
+def git_revision():
+    """The current commit, marked dirty if the tree has local changes; None outside git."""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=APP_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{revision}-dirty' if dirty else revision
+
+def start_stub(args):
+    stub_api.settings.ttft = args.ttft
+    stub_api.settings.tokens = args.tokens
+    stub_api.settings.token_interval = args.token_interval
+    stub_api.settings.error_rate = args.error_rate
+    server = uvicorn.Server(uvicorn.Config(stub_api.app, port=args.stub_port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def open_database(db, db_path):
+    """Point the shared Database at a fresh file and create the schema."""
+    from database import ConnectionPool
+    db.db_path = db_path
+    db.pool = ConnectionPool(db_path)
+    with db._conversation_cache_lock:
+        db._conversation_cache.clear()
+    db.init_db()
+
+def seed(db, conversations, per_conversation, words_per_message, vocabulary, rng, batch_size=5000):
+    """Fill the database through the app's own write path."""
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    conversation_ids = [db.create_conversation(f'Benchmark {i}') for i in range(conversations)]
+    pending = []
+    for turn in range(per_conversation):
+        role = 'user' if turn % 2 == 0 else 'assistant'
+        for conversation_id in conversation_ids:
+            words = rng.choices(vocabulary, cum_weights=cum_weights, k=words_per_message)
+            # A unique prefix keeps the duplicate-content check from dropping rows
+            content = f'{conversation_id}.{turn} ' + ' '.join(words)
+            pending.append({'conversation_id': conversation_id, 'role': role, 'content': content})
+            if len(pending) >= batch_size:
+                db.add_messages(pending)
+                pending = []
+    if pending:
+        db.add_messages(pending)
+    return conversation_ids
+
+def measure(call, inputs, concurrency=1):
+    """Time ``call`` over ``inputs``; a call fails by returning False or raising."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run(value):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = call(value) is not False
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            errors += not ok
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run, inputs))
+    else:
+        for value in inputs:
+            run(value)
+    elapsed = time.perf_counter() - start
+    return {
+        'calls': len(latencies),
+        'errors': errors,
+        'throughput_per_s': round(len(latencies) / elapsed, 2),
+        **summarize(latencies),
+    }
+
+def bench_endpoints(app, conversation_ids, vocabulary, rng, args):
+    local = threading.local()
+
+    def client():
+        # Test clients keep cookies and state, so give each thread its own
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return local.client
+
+    def ok(response):
+        response.get_data()
+        response.close()
+        return response.status_code == 200
+
+    def chat(path):
+        def call(conversation_id):
+            return ok(client().post(path, data={
+                'conversation_id': str(conversation_id),
+                'message': f'benchmark {rng.random()}',
+            }))
+        return call
+
+    def sample_ids(count):
+        return [rng.choice(conversation_ids) for _ in range(count)]
+
+    samples = args.samples
+    queries = [rng.choice(vocabulary[:1000]) for _ in range(samples)]
+    return {
+        'GET /': measure(lambda _: ok(client().get('/')), range(samples), args.concurrency),
+        'GET /conversations': measure(
+            lambda _: ok(client().get('/conversations')), range(samples), args.concurrency
+        ),
+        'GET /conversation/<id>': measure(
+            lambda cid: ok(client().get(f'/conversation/{cid}?limit=50')),
+            sample_ids(samples), args.concurrency
+        ),
+        'GET /search': measure(
+            lambda q: ok(client().get('/search', query_string={'q': q})), queries, args.concurrency
+        ),
+        'POST /chat': measure(chat('/chat'), sample_ids(args.chat_samples), args.concurrency),
+        'POST /chat/stream': measure(chat('/chat/stream'), sample_ids(args.chat_samples), args.concurrency),
+    }
+
+def bench_database(db, conversation_ids, rng, args):
+    from utils import estimate_tokens, truncate_messages_to_token_limit
+
+    def sample_ids(count):
+        return [rng.choice(conversation_ids) for _ in range(count)]
+
+    histories = [db.get_conversation_messages(cid) for cid in sample_ids(args.samples)]
+    # Half of each history's tokens, so truncation always has work to do
+    budgets = [
+        max(1, sum(estimate_tokens(message['content']) for message in history) // 2)
+        for history in histories
+    ]
+    return {
+        'get_conversation_messages': measure(db.get_conversation_messages, sample_ids(args.samples)),
+        'add_message': measure(
+            lambda cid: db.add_message(cid, 'user', f'micro {rng.random()}'), sample_ids(args.samples)
+        ),
+        'truncate_messages_to_token_limit': measure(
+            lambda pair: truncate_messages_to_token_limit(*pair), list(zip(histories, budgets))
+        ),
+    }
+
+def bench_process_image(args):
+    from app import process_image
+    width, height = parse_size(args.image_size)
+    images = [make_jpeg(width, height, seed) for seed in range(args.image_samples)]
+    return {
+        'size': args.image_size,
+        **measure(lambda data: process_image(FileStorage(stream=BytesIO(data), filename='bench.jpg')), images),
+    }
+
+def run(args):
+    stub = start_stub(args)
+    os.environ['ANTHROPIC_BASE_URL'] = f'http://127.0.0.1:{args.stub_port}'
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    from database import db
+    # Importing the app runs init_db(); keep that away from conversations.db
+    open_database(db, os.path.join(workdir, 'bootstrap.db'))
+    from app import app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary)
+    sizes = {}
+    for label in args.sizes:
+        conversations, per_conversation = parse_size(label)
+        db_path = os.path.join(workdir, f'{label}.db')
+        print(f'Seeding {label} into {db_path}', file=sys.stderr)
+        open_database(db, db_path)
+        start = time.perf_counter()
+        conversation_ids = seed(db, conversations, per_conversation, args.words_per_message, vocabulary, rng)
+        seed_seconds = time.perf_counter() - start
+        db.run_maintenance()
+
+        sizes[label] = {
+            'conversations': conversations,
+            'messages': conversations * per_conversation,
+            'seed_s': round(seed_seconds, 2),
+            'database_mb': round(os.path.getsize(db_path) / 1024 / 1024, 2),
+            'endpoints': bench_endpoints(app, conversation_ids, vocabulary, rng, args),
+            'database': bench_database(db, conversation_ids, rng, args),
+        }
+        print(json.dumps({label: sizes[label]['endpoints']}), file=sys.stderr)
+
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'concurrency': args.concurrency,
+            'samples': args.samples,
+            'chat_samples': args.chat_samples,
+            'seed': args.seed,
+        },
+        'stub': {
+            'ttft_s': args.ttft,
+            'tokens': args.tokens,
+            'token_interval_s': args.token_interval,
+            'error_rate': args.error_rate,
+            'upstream_attempts': stub_api.stats.requests,
+            'injected_errors': stub_api.stats.errors,
+        },
+        'sizes': sizes,
+        'process_image': bench_process_image(args),
+    }
+    stub.should_exit = True
+    return results
+
+def flatten(results):
+    """Map ``size/group/name`` to the latency summary of every benchmark in a result file."""
+    flat = {}
+    for label, size in results['sizes'].items():
+        for group in ('endpoints', 'database'):
+            for name, summary in size[group].items():
+                flat[f'{label}/{group}/{name}'] = summary
+    flat['process_image'] = results['process_image']
+    return flat
+
+def compare(base_path, head_path, threshold):
+    """Print p50/p99 changes between two result files; return the regressed benchmarks."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+    print(f"{base.get('revision')} -> {head.get('revision')}")
+    base_flat, head_flat = flatten(base), flatten(head)
+    regressions = []
+    for name in sorted(base_flat.keys() & head_flat.keys()):
+        changes = []
+        for key in ('p50_ms', 'p99_ms'):
+            before, after = base_flat[name][key], head_flat[name][key]
+            ratio = after / before if before else 1.0
+            changes.append(f'{key} {before:.3f} -> {after:.3f} ({ratio:.2f}x)')
+            if ratio > threshold:
+                regressions.append(f'{name} {key}')
+        print(f'{name}: ' + ', '.join(changes))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark endpoints and hot paths against the stub API.')
+    parser.add_argument('--sizes', nargs='+', default=['100x10', '1000x50'],
+                        help='Databases to seed, as CONVERSATIONSxMESSAGES per conversation')
+    parser.add_argument('--samples', type=int, default=200, help='Calls per read benchmark')
+    parser.add_argument('--chat-samples', type=int, default=50, help='Calls per chat endpoint')
+    parser.add_argument('--concurrency', type=int, default=1, help='Threads issuing endpoint requests')
+    parser.add_argument('--words-per-message', type=int, default=40)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--image-size', default='4000x3000')
+    parser.add_argument('--image-samples', type=int, default=5)
+    parser.add_argument('--ttft', type=float, default=0.05)
+    parser.add_argument('--tokens', type=int, default=20)
+    parser.add_argument('--token-interval', type=float, default=0.001)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--stub-port', type=int, default=8770)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Also write the results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'),
+                        help='Compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Ratio above which --compare reports a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.threshold)
+        if regressions:
+            print('Regressed: ' + ', '.join(regressions), file=sys.stderr)
+            sys.exit(1)
+        return
+
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Measure memory used to receive and store attachments.
+
+Parses a multipart request carrying text attachments through the Flask
+app's upload path and stores them, recording the peak Python heap
+allocated on the way, next to the legacy pipeline that read each file
+whole, read it again to decode it and kept every decoded file until the
+message was saved. The peak of a whole /chat request is reported too. Its
+body is built before measuring, and the stub Messages API runs in its own
+process, so only the app's allocations count. That peak cannot stay near
+one file. The upstream request carries every attachment's text as one
+Python string, which takes two bytes per character for text like the
+test files' that is not all Latin-1. The SDK then JSON-encodes the
+request, which briefly holds the text twice more as a string plus its
+UTF-8 body. Two 9MB files peak around 6.7 times their size.
+
+The check fails if ingestion peaks above ``--max-ratio`` times the largest
+attachment, if the whole request peaks above ``--max-chat-ratio`` times
+the attachments' total size, if the size limits are not enforced over
+/chat, or if a text file that starts with "BM" is taken for a BMP. Run
+from the claude_chat directory:
+
+    python -m benchmarks.uploads --files 2 --size-mb 9
+"""
+import argparse
+import atexit
+import hashlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import EnvironBuilder
+
+MB = 1024 * 1024
+
+def make_text(size, seed):
+    line = f'{seed} the quick brown fox jumps over the lazy dog, café ✓\n'.encode()
+    return (line * (size // len(line) + 1))[:size]
+
+def legacy_process(files):
+    """The original pipeline: measure by seeking, read whole, then read again to decode."""
+    contents = []
+    for file in files:
+        file.seek(0, os.SEEK_END)
+        file.seek(0)
+        data = file.read()
+        file.seek(0)
+        hashlib.sha256(data).hexdigest()
+        contents.append(file.read().decode('utf-8', errors='ignore'))
+    return contents
+
+def start_stub(port):
+    """Run the stub Messages API in a child process and wait until it accepts connections."""
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.stub_api',
+        '--port', str(port), '--ttft', '0', '--token-interval', '0',
+    ])
+    atexit.register(process.terminate)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError('The stub Messages API did not start')
+            time.sleep(0.1)
+
+def peak_during(fn):
+    """Peak heap allocated above the starting point while ``fn`` runs, in MB."""
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    return round((peak - start) / MB, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure memory used by attachment uploads.')
+    parser.add_argument('--files', type=int, default=2)
+    parser.add_argument('--size-mb', type=float, default=9)
+    parser.add_argument('--max-ratio', type=float, default=1.5)
+    parser.add_argument('--max-chat-ratio', type=float, default=7.5)
+    parser.add_argument('--port', type=int, default=8771)
+    args = parser.parse_args()
+
+    start_stub(args.port)
+    os.environ['ANTHROPIC_BASE_URL'] = f'http://127.0.0.1:{args.port}'
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'uploads-check')
+
+    from config import Config
+    from database import ConnectionPool, db
+    db_path = os.path.join(tempfile.mkdtemp(), 'uploads.db')
+    db.db_path = db_path
+    db.pool = ConnectionPool(db_path)
+    from flask import request
+    from app import app, process_attachments
+    from utils import estimate_tokens
+    client = app.test_client()
+    failures = []
+
+    size = int(args.size_mb * MB)
+    payloads = [make_text(size, seed) for seed in range(args.files)]
+
+    def form(files, message='memory check'):
+        return {
+            'message': message,
+            'attachments[]': [(io.BytesIO(body), name) for name, body in files],
+        }
+
+    def post(files):
+        return client.post('/chat', data=form(files), content_type='multipart/form-data')
+
+    def ingest(context):
+        with context:
+            process_attachments(request.files.getlist('attachments[]'), request.upload_budget)
+
+    # Build the request up front so only parsing and storing it is measured
+    context = app.test_request_context(
+        '/chat', method='POST', content_type='multipart/form-data',
+        data=form([(f'{i}.txt', body) for i, body in enumerate(payloads)])
+    )
+    # Load the tokenizer now rather than while measuring the first file,
+    # and the SDK, which the first /chat request imports
+    estimate_tokens('warm up')
+    client.post('/chat', data={'message': 'warm up'})
+    tracemalloc.start()
+    ingest_peak = peak_during(lambda: ingest(context))
+    legacy_peak = peak_during(lambda: legacy_process([
+        FileStorage(stream=io.BytesIO(body), filename=f'{i}.txt') for i, body in enumerate(payloads)
+    ]))
+    # Build the /chat body up front too, with new content so the
+    # attachments are stored rather than reused
+    environ = EnvironBuilder(
+        path='/chat', method='POST',
+        data=form([(f'{i}.txt', bytes([65 + i]) + body[1:]) for i, body in enumerate(payloads)])
+    ).get_environ()
+    chat_body = environ['wsgi.input'].read()
+    chat_content_type = environ['CONTENT_TYPE']
+    response = None
+
+    def chat():
+        nonlocal response
+        response = client.post(
+            '/chat', input_stream=io.BytesIO(chat_body),
+            content_type=chat_content_type, content_length=len(chat_body)
+        )
+
+    chat_peak = peak_during(chat)
+    tracemalloc.stop()
+    if response.status_code != 200:
+        failures.append(f'/chat failed: {response.get_json()}')
+
+    # The limits are enforced while the body is received
+    limits = {}
+    too_big = post([('big.txt', b'a' * (Config.MAX_FILE_SIZE + 1))])
+    limits['file_over_limit'] = too_big.status_code
+    share = Config.MAX_UPLOAD_SIZE // 3 + 1024
+    over_budget = post([(f'{i}.txt', bytes([97 + i]) * share) for i in range(3)])
+    limits['budget_exceeded'] = over_budget.status_code
+    for name, status in limits.items():
+        if status != 413:
+            failures.append(f'{name}: expected 413, got {status}')
+
+    # Text that happens to start like a BMP is still text
+    csv = post([('measurements.csv', b'BMI,height,weight\n22.1,180,72\n' * 4)])
+    if csv.status_code != 200:
+        failures.append(f'a CSV starting with "BM" was rejected: {csv.get_json()}')
+
+    largest_mb = size / MB
+    total_mb = largest_mb * args.files
+    report = {
+        'files': args.files,
+        'file_mb': args.size_mb,
+        'ingest_peak_mb': ingest_peak,
+        'legacy_ingest_peak_mb': legacy_peak,
+        'ingest_peak_ratio': round(ingest_peak / largest_mb, 2),
+        'chat_request_peak_mb': chat_peak,
+        'chat_request_peak_ratio': round(chat_peak / total_mb, 2),
+        'limits': limits,
+    }
+    print(json.dumps(report, indent=2))
+    if report['ingest_peak_ratio'] > args.max_ratio:
+        failures.append(f"ingestion peaked at {ingest_peak}MB, over {args.max_ratio}x the largest file")
+    if report['chat_request_peak_ratio'] > args.max_chat_ratio:
+        failures.append(f"/chat peaked at {chat_peak}MB, over {args.max_chat_ratio}x the attachments")
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+    print('Uploads stayed within the memory and size limits')
+
+if __name__ == '__main__':
+    main()
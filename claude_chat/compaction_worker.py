@@ -0,0 +1,125 @@
+"""Compact long conversations into stored summaries.
+
+Conversations with more than Config.COMPACTION_THRESHOLD tokens of messages
+not yet covered by a summary have their older turns summarized by Claude.
+The summary is stored and replaces those turns when the conversation's
+context is built (see context.build_context), so the input sent on each
+turn stays bounded. The newest Config.COMPACTION_KEEP_TOKENS are never
+summarized, and the messages themselves are kept in full. Run it once
+(e.g. from cron) or as a long-lived background process:
+
+    python compaction_worker.py
+    python compaction_worker.py --interval 300
+
+Only one worker should run against a database at a time.
+"""
+import argparse
+import functools
+import logging
+import time
+from config import Config
+from context import format_messages, summary_message
+from database import db
+from metrics import counter, record_token_usage
+from scheduler import scheduler
+from utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+COMPACTIONS = counter(
+    'claude_compactions_total',
+    'Conversation compactions run by the compaction worker, by result.',
+    ('result',)
+)
+
+SUMMARY_PROMPT = (
+    "You are compacting a long conversation between a user and an assistant so "
+    "that it can continue within a limited context. The assistant will only see "
+    "your summary in place of the messages above, followed by the most recent "
+    "turns."
+)
+
+SUMMARY_INSTRUCTION = (
+    "Summarize the conversation so far, including any earlier summary it starts "
+    "with. Keep the user's goals, preferences and constraints, decisions that "
+    "were made, facts, names and numbers that may be referred to again, the "
+    "content of attached files that matters, and any open questions or "
+    "unfinished tasks. Write it in the third person, without a preamble."
+)
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """The Anthropic client, created on first use; retries are handled by the scheduler."""
+    import anthropic
+    return anthropic.Client(api_key=Config.ANTHROPIC_API_KEY, max_retries=0)
+
+def compact_conversation(client, conversation_id):
+    """Summarize the older turns of a conversation; return True if a summary was saved."""
+    summary, messages = db.get_messages_to_compact(
+        conversation_id, Config.COMPACTION_KEEP_TOKENS, Config.COMPACTION_INPUT_TOKENS
+    )
+    if not messages:
+        return False
+    through_message_id = messages[-1]['id']
+    
+    if summary is not None:
+        messages.insert(0, summary_message(summary))
+    messages.append({'role': 'user', 'content': SUMMARY_INSTRUCTION, 'attachments': []})
+    claude_messages, _ = format_messages(messages)
+    # The Messages API requires the first turn to come from the user
+    if claude_messages[0]['role'] != 'user':
+        claude_messages.insert(0, {'role': 'user', 'content': '(conversation continues)'})
+    
+    params = {
+        'model': Config.MODEL_NAME,
+        'max_tokens': Config.COMPACTION_MAX_TOKENS,
+        'system': SUMMARY_PROMPT,
+        'messages': claude_messages,
+    }
+    response = scheduler.create(client, params, key=conversation_id)
+    record_token_usage(response.model, response.usage)
+    content = ''.join(block.text for block in response.content if block.type == 'text').strip()
+    if not content:
+        raise ValueError('Claude returned an empty summary')
+    
+    token_count = estimate_tokens(summary_message({'content': content})['content'])
+    return db.save_summary(conversation_id, through_message_id, content, token_count)
+
+def run_once(client):
+    """Compact every conversation over the threshold once.
+
+    Returns the number of conversations compacted.
+    """
+    compacted = 0
+    for conversation_id in db.get_compaction_candidates(Config.COMPACTION_THRESHOLD):
+        try:
+            saved = compact_conversation(client, conversation_id)
+        except Exception as e:
+            logger.error(f"Failed to compact conversation {conversation_id}: {e}")
+            COMPACTIONS.inc(result='error')
+            continue
+        if saved:
+            COMPACTIONS.inc(result='compacted')
+            compacted += 1
+    return compacted
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the older turns of long conversations.')
+    parser.add_argument(
+        '--interval', type=int, default=0,
+        help='Poll every N seconds instead of running once'
+    )
+    args = parser.parse_args()
+
+    db.init_db()
+    while True:
+        try:
+            run_once(get_client())
+        except Exception as e:
+            logger.error(f"Compaction worker run failed: {e}")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""Assemble the message history sent to Claude for a conversation."""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from config import Config
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Opens the turn that stands in for a compacted conversation's older messages
+SUMMARY_HEADER = 'Summary of the earlier part of this conversation:'
+
+def text_attachment_parts(filename, content):
+    """Render a text attachment the way it is presented to Claude, as pieces to join.
+
+    ``content`` is passed through as is, so it is only copied by the final join.
+    """
+    extension = os.path.splitext(filename)[1].lower()[1:]
+    return (f"\nFile: {filename}\n```{extension}\n", content, "\n```\n")
+
+# LRU of attachment id -> image content block, holding successful reads only
+_image_blocks = OrderedDict()
+_image_blocks_bytes = 0  # Total length of the cached base64 data
+_image_blocks_lock = threading.Lock()
+
+def get_image_block(attachment_id):
+    """Return the image content block for a stored image attachment, or None.
+
+    Attachments are content-addressed and never modified, so the block is
+    cached by id and follow-up turns skip both the database read and any
+    re-encoding. Only found attachments are cached, so one that is
+    missing now is looked up again on the next turn. The cache holds at
+    most Config.IMAGE_BLOCK_CACHE_BYTES of base64 data, evicting the least
+    recently used blocks first. The returned dict is shared; callers must
+    copy it before modifying it.
+    """
+    global _image_blocks_bytes
+    with _image_blocks_lock:
+        block = _image_blocks.get(attachment_id)
+        if block is not None:
+            _image_blocks.move_to_end(attachment_id)
+            return block
+    
+    attachment = db.get_attachment(attachment_id)
+    if attachment is None:
+        return None
+    block = {
+        'type': 'image',
+        'source': {
+            'type': 'base64',
+            'media_type': 'image/jpeg',
+            'data': attachment['content']
+        }
+    }
+    size = len(block['source']['data'])
+    if size > Config.IMAGE_BLOCK_CACHE_BYTES:
+        return block
+    with _image_blocks_lock:
+        previous = _image_blocks.pop(attachment_id, None)
+        if previous is not None:
+            _image_blocks_bytes -= len(previous['source']['data'])
+        _image_blocks[attachment_id] = block
+        _image_blocks_bytes += size
+        while _image_blocks_bytes > Config.IMAGE_BLOCK_CACHE_BYTES:
+            _, evicted = _image_blocks.popitem(last=False)
+            _image_blocks_bytes -= len(evicted['source']['data'])
+    return block
+
+def format_message_content(message):
+    """Build a stored message's content for Claude.
+
+    Text attachments are expanded into the message text. If the message has
+    images, the content becomes a list of content blocks with the images
+    first, followed by the text.
+    """
+    parts = [message['content']]
+    images = []
+    for attachment in message.get('attachments', []):
+        if attachment['type'] == 'text':
+            parts.extend(text_attachment_parts(attachment['filename'], attachment['content']))
+        elif attachment['type'] == 'image':
+            block = get_image_block(attachment['id'])
+            if block is not None:
+                images.append(block)
+    text = ''.join(parts)
+    
+    if not images:
+        return text
+    
+    blocks = list(images)
+    if text:
+        blocks.append({'type': 'text', 'text': text})
+    return blocks
+
+def as_blocks(content):
+    """Normalize message content to a list of content blocks."""
+    if isinstance(content, list):
+        return content
+    return [{'type': 'text', 'text': content}] if content else []
+
+def add_cache_control(message):
+    """Mark the final content block of a message as a prompt-cache breakpoint."""
+    blocks = as_blocks(message['content'])
+    if not blocks:
+        return
+    # Copy the block: image blocks are shared through get_image_block's cache
+    blocks[-1] = dict(blocks[-1], cache_control={'type': 'ephemeral'})
+    message['content'] = blocks
+
+def apply_cache_breakpoints(claude_messages, attachment_turns):
+    """Place prompt-cache breakpoints so the conversation prefix is reused.
+
+    Breakpoints go on, in priority order:
+
+    1. the final message, so this turn's full prompt is written to the cache;
+    2. the previous user turn, which is where the previous request put
+       its final breakpoint, so this request reads that cache entry;
+    3. the oldest turns that carry attachments, which are large and never
+       move once written.
+
+    The placement only depends on positions that do not change as new
+    turns are appended, so the prefix up to each breakpoint is identical
+    from one turn to the next.
+    """
+    if not claude_messages:
+        return claude_messages
+    
+    last = len(claude_messages) - 1
+    breakpoints = [last]
+    previous_user_turns = [
+        i for i, msg in enumerate(claude_messages[:last]) if msg['role'] == 'user'
+    ]
+    if previous_user_turns:
+        breakpoints.append(previous_user_turns[-1])
+    for i in sorted(attachment_turns):
+        if len(breakpoints) >= Config.MAX_CACHE_BREAKPOINTS:
+            break
+        if i not in breakpoints:
+            breakpoints.append(i)
+    
+    for i in breakpoints:
+        add_cache_control(claude_messages[i])
+    return claude_messages
+
+def get_context_budget():
+    """Input tokens available for history.
+
+    The response budget is reserved, and Config.CONTEXT_MARGIN of the window
+    is left free because the stored token counts are only estimates.
+    """
+    return int(Config.MAX_TOKENS * (1 - Config.CONTEXT_MARGIN)) - Config.DEFAULT_MAX_TOKENS
+
+def summary_message(summary):
+    """Present a stored conversation summary as a user turn."""
+    return {
+        'role': 'user',
+        'content': f"{SUMMARY_HEADER}\n\n{summary['content']}",
+        'attachments': []
+    }
+
+def format_messages(messages):
+    """Format stored messages for Claude.
+
+    Adjacent messages from the same role are merged so roles strictly
+    alternate. Returns the Claude messages and the indexes of those that
+    carry attachments.
+    """
+    claude_messages = []
+    attachment_turns = set()
+    for msg in messages:
+        if claude_messages and claude_messages[-1]['role'] == msg['role']:
+            previous = claude_messages[-1]
+            previous['content'] = as_blocks(previous['content']) + as_blocks(format_message_content(msg))
+        else:
+            claude_messages.append({'role': msg['role'], 'content': format_message_content(msg)})
+        if msg.get('attachments'):
+            attachment_turns.add(len(claude_messages) - 1)
+    return claude_messages, attachment_turns
+
+def build_context(conversation_id):
+    """Return the newest messages that fit the context budget, formatted for Claude.
+
+    Token counts are stored per message at insert time, so no message is
+    re-tokenized here. Once a conversation has been compacted (see
+    compaction_worker.py), its summary opens the context in place of the
+    messages it covers. Otherwise leading assistant turns left over from
+    truncation are dropped because the Messages API requires the first
+    turn to come from the user.
+    """
+    summary, messages = db.get_context(conversation_id, get_context_budget())
+    
+    if summary is not None:
+        messages.insert(0, summary_message(summary))
+    while messages and messages[0]['role'] != 'user':
+        messages.pop(0)
+    
+    total_tokens = sum(msg.get('token_count') or 0 for msg in messages)
+    if summary is not None:
+        total_tokens += summary['token_count']
+    logger.debug(
+        f"Built context for conversation {conversation_id}: "
+        f"{len(messages)} messages, ~{total_tokens} tokens"
+    )
+    
+    claude_messages, attachment_turns = format_messages(messages)
+    if Config.PROMPT_CACHING:
+        apply_cache_breakpoints(claude_messages, attachment_turns)
+    return claude_messages
+
+def build_request_params(claude_messages):
+    """Messages API parameters for a chat turn."""
+    return {
+        'model': Config.MODEL_NAME,
+        'max_tokens': Config.DEFAULT_MAX_TOKENS,
+        'messages': claude_messages,
+        'temperature': 0.7
+    }
@@ -1,215 +1,1014 @@
 import sqlite3
+import asyncio
+import contextvars
+import functools
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from contextlib import contextmanager
+import storage
+from archive import ARCHIVE_OPERATIONS, ArchiveStore
+from config import Config
+from metrics import count_db_query
+from storage import ConversationNotFoundError, StorageBackend, content_hash
+from utils import estimate_tokens
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-class Database:
-    def __init__(self):
-        self.db_path = 'conversations.db'
+# Markers wrapped around matched terms in search snippets
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
 
-    @contextmanager
-    def get_db(self):
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            yield conn
-        except Exception as e:
-            logger.error(f"Database connection error: {e}")
-            raise
-        finally:
-            if conn:
-                conn.close()
+# Shorter prefixes match too many terms to expand cheaply. Prefixes of the
+# indexed lengths are read from a single doclist instead of being expanded
+# term by term; longer ones are selective enough to expand.
+MIN_PREFIX_LENGTH = 3
+PREFIX_INDEX_LENGTHS = (3, 4, 5)
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def match_query(text):
+    """Turn free text into an FTS5 MATCH expression.
+
+    Every word is quoted so user input cannot inject FTS5 syntax, and the
+    last word is a prefix match to support search-as-you-type once it is
+    long enough to be selective. Returns None if the text contains no words.
+    """
+    words = text.split()
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    if len(words[-1]) >= MIN_PREFIX_LENGTH:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+class CountingCursor(sqlite3.Cursor):
+    """Cursor that counts its statements against the current request."""
+
+    def execute(self, *args):
+        count_db_query()
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        count_db_query()
+        return super().executemany(*args)
+
+class CountingConnection(sqlite3.Connection):
+    """Connection that counts statements, including those run through its cursors."""
+
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        count_db_query()
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        count_db_query()
+        return super().executemany(*args)
+
+    def executescript(self, *args):
+        count_db_query()
+        return super().executescript(*args)
+
+class ConnectionPool(storage.ConnectionPool):
+    """Pool of SQLite connections.
+
+    Each connection is configured once with WAL journaling and the tuning
+    pragmas from ``Config``.
+    """
+
+    error = sqlite3.Error
+
+    def __init__(self, db_path, max_size=None, timeout=None):
+        self.db_path = db_path
+        super().__init__(max_size, timeout)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=Config.DB_CACHED_STATEMENTS,
+            factory=CountingConnection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size={int(Config.DB_CACHE_SIZE)}')
+        conn.execute(f'PRAGMA mmap_size={int(Config.DB_MMAP_SIZE)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        logger.debug(f"Opened pooled connection to {self.db_path}")
+        return conn
+
+    def _timeout_error(self):
+        return sqlite3.OperationalError("Timed out waiting for a database connection")
+
+class Database(StorageBackend):
+    """SQLite storage backend.
+
+    Queries are written in SQL that PostgresDatabase can share; those that
+    depend on SQLite (FTS5, triggers, pragmas) are overridden there.
+    """
+
+    # SQL for the time one day ago, comparable with the timestamp columns
+    ONE_DAY_AGO = "datetime('now', '-1 day')"
+
+    # Schema migrations, by method name. The version of a migration is its
+    # position in this list, counting from 1, and databases record the
+    # versions they have applied, so only ever append to it.
+    MIGRATIONS = (
+        'create_tables',
+        'migrate_content_hash',
+        'migrate_token_count',
+        'create_indexes',
+        'create_list_version',
+        'create_search_index',
+        # Databases from before the migrations may hold orphaned rows
+        'delete_orphaned_rows',
+    )
+
+    def __init__(self, db_path=None, archive_path=None):
+        super().__init__()
+        self.db_path = db_path or Config.DATABASE_PATH
+        self.pool = ConnectionPool(self.db_path)
+        # Archived conversations live in their own file, out of the hot database's cache
+        self.archive_path = (
+            archive_path or Config.ARCHIVE_DATABASE_PATH
+            or os.path.splitext(self.db_path)[0] + '.archive.db'
+        )
+        self.archive = ArchiveStore(ConnectionPool(self.archive_path, max_size=2))
+
+    def _insert(self, c, statement, params=(), ignore_conflicts=False):
+        """Run ``INSERT <statement>`` on cursor ``c`` and return the new row's id.
+
+        With ignore_conflicts, a row that violates a unique constraint is
+        skipped and None is returned.
+        """
+        c.execute(f"INSERT {'OR IGNORE ' if ignore_conflicts else ''}{statement}", params)
+        return c.lastrowid if c.rowcount else None
 
     def cleanup_database(self):
         """Clean up any orphaned messages and fix conversation relationships."""
         try:
             with self.get_db() as conn:
-                c = conn.cursor()
-                
-                # Delete messages that don't have a valid conversation
-                c.execute('''
-                    DELETE FROM messages 
-                    WHERE conversation_id NOT IN (
-                        SELECT id FROM conversations
-                    )
-                ''')
-                
-                # Delete duplicate messages within the same conversation
-                c.execute('''
-                    DELETE FROM messages 
-                    WHERE id NOT IN (
-                        SELECT MIN(id)
-                        FROM messages
-                        GROUP BY conversation_id, role, content, timestamp
-                    )
-                ''')
-                
+                self.delete_orphaned_rows(conn)
                 conn.commit()
                 logger.info("Database cleanup completed")
         except Exception as e:
             logger.error(f"Failed to cleanup database: {e}")
             raise
 
+    def delete_orphaned_rows(self, conn):
+        """Delete messages and summaries whose conversation no longer exists."""
+        conn.execute('''
+            DELETE FROM messages 
+            WHERE conversation_id NOT IN (
+                SELECT id FROM conversations
+            )
+        ''')
+        conn.execute('''
+            DELETE FROM conversation_summaries 
+            WHERE conversation_id NOT IN (
+                SELECT id FROM conversations
+            )
+        ''')
+
     def init_db(self):
+        """Bring the schema up to date.
+
+        Applies the MIGRATIONS that schema_migrations does not list yet,
+        each in its own transaction together with the row recording it,
+        so each one runs once per database even when several processes
+        start at the same time. Against an up-to-date database this only
+        reads the schema version.
+        """
         try:
             with self.get_db() as conn:
-                c = conn.cursor()
-                
-                # Create conversations table
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS conversations (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        title TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        is_archived BOOLEAN DEFAULT 0
-                    )
-                ''')
-                
-                # Create messages table
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS messages (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        conversation_id INTEGER,
-                        role TEXT NOT NULL,
-                        content TEXT NOT NULL,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
-                    )
-                ''')
-                
-                conn.commit()
+                if self.get_schema_version(conn) >= len(self.MIGRATIONS):
+                    return
+                for version, name in enumerate(self.MIGRATIONS, 1):
+                    self._begin_migration(conn)
+                    try:
+                        # Another process may have applied it while we waited
+                        if self.get_schema_version(conn) < version:
+                            logger.info(f"Applying schema migration {version}: {name}")
+                            getattr(self, name)(conn)
+                            conn.execute(
+                                'INSERT INTO schema_migrations (version, name) VALUES (?, ?)',
+                                (version, name)
+                            )
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
                 logger.info("Database initialized successfully")
-                self.cleanup_database()
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
             raise
 
-    def get_conversations(self):
-        """Retrieve all active conversations."""
+    def _begin_migration(self, conn):
+        """Start a transaction that holds the schema lock, and create schema_migrations."""
+        # Takes the write lock now, so concurrent processes migrate one at a time
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    def _table_exists(self, conn, name):
+        return conn.execute('''
+            SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?
+        ''', (name,)).fetchone() is not None
+
+    def get_schema_version(self, conn):
+        """Return the number of migrations applied to the database."""
+        if not self._table_exists(conn, 'schema_migrations'):
+            return 0
+        row = conn.execute('SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations').fetchone()
+        return row['version']
+
+    def create_tables(self, conn):
+        """Create the tables, for new databases and those from before the migrations."""
+        c = conn.cursor()
+        
+        # Create conversations table
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_archived BOOLEAN DEFAULT 0
+            )
+        ''')
+        
+        # Create messages table
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id INTEGER,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                content_hash TEXT,
+                token_count INTEGER,
+                FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            )
+        ''')
+        
+        # Content-addressed attachment store, shared across conversations
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS attachments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sha256 TEXT NOT NULL UNIQUE,
+                type TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                token_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Attachments referenced by each message, in upload order
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS message_attachments (
+                message_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                attachment_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                PRIMARY KEY (message_id, position),
+                FOREIGN KEY (message_id) REFERENCES messages (id),
+                FOREIGN KEY (attachment_id) REFERENCES attachments (id)
+            )
+        ''')
+        
+        # Bulk jobs submitted through POST /batch
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # One row per prompt in a job; status moves from pending to
+        # submitted (with the Message Batch id) to a final result
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS batch_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER NOT NULL,
+                conversation_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                message_batch_id TEXT,
+                message_id INTEGER,
+                error TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (job_id) REFERENCES batch_jobs (id),
+                FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            )
+        ''')
+        
+        # Latest summary of each compacted conversation, covering
+        # every message up to through_message_id
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                conversation_id INTEGER PRIMARY KEY,
+                through_message_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                token_count INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            )
+        ''')
+
+    def migrate_content_hash(self, conn):
+        """Add and backfill messages.content_hash, then enforce uniqueness.
+
+        Databases created before write-time deduplication have no
+        content_hash column and may contain duplicate rows. Those are
+        collapsed to the earliest copy before the unique index is built.
+        """
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(messages)')]
+        
+        if 'content_hash' not in columns:
+            logger.info("Migrating messages table: adding content_hash column")
+            conn.execute('ALTER TABLE messages ADD COLUMN content_hash TEXT')
+        
+        conn.create_function('content_hash', 1, content_hash, deterministic=True)
+        conn.execute('''
+            UPDATE messages 
+            SET content_hash = content_hash(content) 
+            WHERE content_hash IS NULL
+        ''')
+        
+        index = conn.execute('''
+            SELECT name FROM sqlite_master 
+            WHERE type = 'index' AND name = 'idx_messages_dedup'
+        ''').fetchone()
+        if not index:
+            conn.execute('''
+                DELETE FROM messages 
+                WHERE id NOT IN (
+                    SELECT MIN(id)
+                    FROM messages
+                    GROUP BY conversation_id, role, content_hash
+                )
+            ''')
+            conn.execute('''
+                CREATE UNIQUE INDEX idx_messages_dedup 
+                ON messages (conversation_id, role, content_hash)
+            ''')
+
+    def migrate_token_count(self, conn):
+        """Add messages.token_count and backfill it for existing messages."""
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(messages)')]
+        
+        if 'token_count' not in columns:
+            logger.info("Migrating messages table: adding token_count column")
+            conn.execute('ALTER TABLE messages ADD COLUMN token_count INTEGER')
+        
+        conn.create_function('estimate_tokens', 1, estimate_tokens, deterministic=True)
+        conn.execute('''
+            UPDATE messages 
+            SET token_count = estimate_tokens(content) 
+            WHERE token_count IS NULL
+        ''')
+
+    def create_indexes(self, conn):
+        """Create the indexes used by history and conversation list queries.
+
+        Uses IF NOT EXISTS so it doubles as the migration for databases
+        created before the indexes were added.
+        """
+        # Covers history paging by id and lets context selection sum token
+        # counts without touching message content
+        conn.execute('DROP INDEX IF EXISTS idx_messages_conversation')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_context 
+            ON messages (conversation_id, id, token_count)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_conversations_updated 
+            ON conversations (is_archived, updated_at DESC)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_message_attachments_attachment 
+            ON message_attachments (attachment_id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_batch_requests_status 
+            ON batch_requests (status, message_batch_id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_batch_requests_job 
+            ON batch_requests (job_id)
+        ''')
+
+    def create_list_version(self, conn):
+        """Maintain a version number that changes whenever the conversation list does.
+
+        Triggers bump it on any insert, delete, rename, archive or
+        updated_at change, so it is shared by every process using the
+        database and serves as the ETag for GET /conversations.
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_list_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('INSERT OR IGNORE INTO conversation_list_version (id, version) VALUES (1, 0)')
+        for name, event in (
+            ('conversations_list_insert', 'INSERT'),
+            ('conversations_list_delete', 'DELETE'),
+            ('conversations_list_update', 'UPDATE OF title, updated_at, is_archived'),
+        ):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {name} 
+                AFTER {event} ON conversations 
+                BEGIN
+                    UPDATE conversation_list_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+    def create_search_index(self, conn):
+        """Create the FTS5 indexes over message content and conversation titles.
+
+        Both are external-content tables kept in sync by triggers, so the
+        text is stored only once. Indexes created for an existing database
+        are rebuilt from it in the same transaction.
+        """
+        for table, source, column in (
+            ('messages_fts', 'messages', 'content'),
+            ('conversations_fts', 'conversations', 'title'),
+        ):
+            if self._table_exists(conn, table):
+                continue
+            logger.info(f"Building full-text index {table}")
+            conn.execute(f'''
+                CREATE VIRTUAL TABLE {table} USING fts5(
+                    {column}, 
+                    content='{source}', 
+                    content_rowid='id', 
+                    tokenize='unicode61 remove_diacritics 2', 
+                    prefix='{' '.join(map(str, PREFIX_INDEX_LENGTHS))}'
+                )
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_insert 
+                AFTER INSERT ON {source} 
+                BEGIN
+                    INSERT INTO {table} (rowid, {column}) VALUES (new.id, new.{column});
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_delete 
+                AFTER DELETE ON {source} 
+                BEGIN
+                    INSERT INTO {table} ({table}, rowid, {column}) 
+                    VALUES ('delete', old.id, old.{column});
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_update 
+                AFTER UPDATE OF {column} ON {source} 
+                BEGIN
+                    INSERT INTO {table} ({table}, rowid, {column}) 
+                    VALUES ('delete', old.id, old.{column});
+                    INSERT INTO {table} (rowid, {column}) VALUES (new.id, new.{column});
+                END
+            ''')
+            conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+    def get_conversations(self, limit=None, after=None, archived=False):
+        """Retrieve active conversations, most recently updated first.
+
+        Only id, title and updated_at are returned. Pass ``limit`` to fetch
+        one page and ``after`` (the ``(updated_at, id)`` of the last
+        conversation already seen) to fetch the next. With ``archived``,
+        the archived conversations are listed instead.
+        """
         try:
             with self.get_db() as conn:
-                conversations = conn.execute('''
-                    SELECT * FROM conversations 
-                    WHERE NOT is_archived 
-                    ORDER BY updated_at DESC
-                ''').fetchall()
+                query = '''
+                    SELECT id, title, updated_at FROM conversations 
+                    WHERE is_archived = ?
+                '''
+                params = [1 if archived else 0]
+                if after is not None:
+                    query += ' AND (updated_at, id) < (?, ?)'
+                    params.extend(after)
+                query += ' ORDER BY updated_at DESC, id DESC'
+                if limit is not None:
+                    query += ' LIMIT ?'
+                    params.append(limit)
+                conversations = conn.execute(query, params).fetchall()
                 return [dict(conv) for conv in conversations]
         except Exception as e:
             logger.error(f"Failed to get conversations: {e}")
             return []
 
-    def get_conversation_messages(self, conversation_id):
-        """Retrieve all messages for a specific conversation."""
+    def get_conversation_list_version(self):
+        """Return the version number of the conversation list (see create_list_version)."""
+        with self.get_db() as conn:
+            row = conn.execute('SELECT version FROM conversation_list_version WHERE id = 1').fetchone()
+            return row['version'] if row else 0
+
+    def search_messages(self, text, limit=20, offset=0):
+        """Full-text search over message content, best matches first.
+
+        Only the newest Config.SEARCH_CANDIDATES matches are ranked, so the
+        cost of a query is bounded however common its terms are; selective
+        queries rank every match. Candidates are scored with the BM25
+        term-frequency and length terms. FTS5's bm25() is not used because
+        its IDF weights scan every match of every term, which grows with
+        the database.
+
+        Returns dicts with the message and conversation ids, role, timestamp,
+        conversation title and a snippet in which matched terms are wrapped
+        in SNIPPET_START / SNIPPET_END.
+        """
+        query = match_query(text)
+        if query is None:
+            return []
+        with self.get_db() as conn:
+            # FTS5 walks matches newest first and stops at the candidate
+            # limit. Each matched token gets a one-character marker from
+            # highlight(), so the length difference is the term frequency;
+            # stored token counts give the document lengths.
+            hits = conn.execute('''
+                WITH candidates AS (
+                    SELECT rowid AS id, 
+                           length(highlight(messages_fts, 0, ?, '')) - length(content) AS tf 
+                    FROM messages_fts 
+                    WHERE messages_fts MATCH ? 
+                    ORDER BY rowid DESC 
+                    LIMIT ?
+                ), 
+                lengths AS (
+                    SELECT c.id, c.tf, 
+                           MAX(m.token_count, 1) AS dl, 
+                           MAX(AVG(m.token_count) OVER (), 1) AS avgdl 
+                    FROM candidates c 
+                    CROSS JOIN messages m ON m.id = c.id
+                )
+                SELECT id, tf * (? + 1) / (tf + ? * (1 - ? + ? * dl / avgdl)) AS score 
+                FROM lengths 
+                ORDER BY score DESC, id DESC 
+                LIMIT ? OFFSET ?
+            ''', (
+                SNIPPET_START, query, Config.SEARCH_CANDIDATES,
+                BM25_K1, BM25_K1, BM25_B, BM25_B, limit, offset
+            )).fetchall()
+            if not hits:
+                return []
+            
+            ids = [hit['id'] for hit in hits]
+            placeholders = ','.join('?' * len(ids))
+            snippets = dict(conn.execute(f'''
+                SELECT rowid, snippet(messages_fts, 0, ?, ?, '…', 16) 
+                FROM messages_fts 
+                WHERE messages_fts MATCH ? AND rowid IN ({placeholders})
+            ''', [SNIPPET_START, SNIPPET_END, query, *ids]).fetchall())
+            # CROSS JOIN keeps the id lookups first; otherwise the is_archived
+            # filter can lead the planner to scan every conversation
+            rows = {row['id']: row for row in conn.execute(f'''
+                SELECT m.id, m.conversation_id, m.role, m.timestamp, c.title 
+                FROM messages m 
+                CROSS JOIN conversations c ON c.id = m.conversation_id 
+                WHERE m.id IN ({placeholders}) AND c.is_archived = 0
+            ''', ids)}
+        
+        results = []
+        for hit in hits:
+            row = rows.get(hit['id'])
+            if row is None:
+                continue
+            results.append({
+                'message_id': row['id'],
+                'conversation_id': row['conversation_id'],
+                'title': row['title'],
+                'role': row['role'],
+                'timestamp': row['timestamp'],
+                'snippet': snippets.get(hit['id'], ''),
+            })
+        return results
+
+    def search_conversations(self, text, limit=5):
+        """Full-text search over conversation titles, best matches first.
+
+        Like search_messages, only the newest Config.SEARCH_CANDIDATES
+        matches are ranked.
+        """
+        query = match_query(text)
+        if query is None:
+            return []
+        with self.get_db() as conn:
+            rows = conn.execute('''
+                SELECT c.id, c.title, c.updated_at, hits.snippet 
+                FROM (
+                    SELECT rowid AS id, bm25(conversations_fts) AS score, 
+                           highlight(conversations_fts, 0, ?, ?) AS snippet 
+                    FROM conversations_fts 
+                    WHERE conversations_fts MATCH ? 
+                    ORDER BY rowid DESC 
+                    LIMIT ?
+                ) AS hits 
+                CROSS JOIN conversations c ON c.id = hits.id 
+                WHERE c.is_archived = 0 
+                ORDER BY hits.score 
+                LIMIT ?
+            ''', (SNIPPET_START, SNIPPET_END, query, Config.SEARCH_CANDIDATES, limit)).fetchall()
+            return [dict(row) for row in rows]
+
+    def get_conversation_messages(self, conversation_id, before_id=None, limit=None):
+        """Retrieve messages for a specific conversation, oldest first.
+
+        Pass ``limit`` to fetch only the newest page of messages and
+        ``before_id`` (the smallest id already seen) to page backwards.
+        """
         try:
             with self.get_db() as conn:
-                # Use a subquery to get only the latest version of each message
+                query = '''
+                    SELECT id, conversation_id, role, content, timestamp
+                    FROM messages
+                    WHERE conversation_id = ?
+                '''
+                params = [conversation_id]
+                
+                if before_id is not None:
+                    query += ' AND id < ?'
+                    params.append(before_id)
+                
+                if limit is None:
+                    messages = conn.execute(query + ' ORDER BY id ASC', params).fetchall()
+                else:
+                    # Walk the (conversation_id, id) index backwards, then restore chronological order
+                    params.append(limit)
+                    messages = conn.execute(query + ' ORDER BY id DESC LIMIT ?', params).fetchall()
+                    messages.reverse()
+                
+                messages = [dict(msg) for msg in messages]
+                self._attach_metadata(conn, messages)
+                return messages
+        except Exception as e:
+            logger.error(f"Failed to get conversation messages: {e}")
+            return []
+
+    def get_context(self, conversation_id, max_tokens):
+        """Return a conversation's summary and the newest messages that fit in max_tokens.
+
+        ``summary`` is the conversation's latest summary (see save_summary)
+        or None. Only messages after the ones it covers are candidates, and
+        its own token count is taken out of the budget. The running total
+        is computed over the covering (conversation_id, id, token_count)
+        index, so only the selected rows' content is read. The newest
+        message is always included, even if it alone exceeds the budget.
+        """
+        try:
+            with self.get_db() as conn:
+                summary = self._get_summary(conn, conversation_id)
+                after_id = 0
+                if summary is not None:
+                    after_id = summary['through_message_id']
+                    max_tokens -= summary['token_count']
+                
                 messages = conn.execute('''
-                    WITH RankedMessages AS (
+                    WITH context AS (
                         SELECT 
                             id,
-                            conversation_id,
-                            role,
-                            content,
-                            timestamp,
-                            ROW_NUMBER() OVER (
-                                PARTITION BY conversation_id, role, content 
-                                ORDER BY timestamp DESC, id DESC
-                            ) as rn
+                            SUM(token_count) OVER (ORDER BY id DESC) AS running_tokens,
+                            ROW_NUMBER() OVER (ORDER BY id DESC) AS rn
                         FROM messages
-                        WHERE conversation_id = ?
+                        WHERE conversation_id = ? AND id > ?
                     )
-                    SELECT 
-                        id,
-                        conversation_id,
-                        role,
-                        content,
-                        timestamp
-                    FROM RankedMessages
-                    WHERE rn = 1
-                    ORDER BY timestamp ASC, id ASC
-                ''', (conversation_id,)).fetchall()
-                
-                return [dict(msg) for msg in messages]
+                    SELECT m.id, m.conversation_id, m.role, m.content, m.timestamp, m.token_count
+                    FROM context
+                    JOIN messages m ON m.id = context.id
+                    WHERE context.running_tokens <= ? OR context.rn = 1
+                    ORDER BY m.id ASC
+                ''', (conversation_id, after_id, max_tokens)).fetchall()
+                
+                messages = [dict(msg) for msg in messages]
+                self._attach_metadata(conn, messages, include_content=True)
+                return summary, messages
         except Exception as e:
-            logger.error(f"Failed to get conversation messages: {e}")
-            return []
+            logger.error(f"Failed to get context messages: {e}")
+            raise
+
+    def _get_summary(self, conn, conversation_id):
+        summary = conn.execute('''
+            SELECT conversation_id, through_message_id, content, token_count, created_at 
+            FROM conversation_summaries 
+            WHERE conversation_id = ?
+        ''', (conversation_id,)).fetchone()
+        return dict(summary) if summary else None
+
+    def get_compaction_candidates(self, min_tokens, limit=100):
+        """Return ids of conversations with more than min_tokens of unsummarized messages.
+
+        Only messages after those covered by a conversation's summary are
+        counted. Archived conversations are skipped; the most recently
+        updated come first.
+        """
+        try:
+            with self.get_db() as conn:
+                rows = conn.execute('''
+                    SELECT c.id 
+                    FROM conversations c 
+                    LEFT JOIN conversation_summaries s ON s.conversation_id = c.id 
+                    JOIN messages m ON m.conversation_id = c.id 
+                        AND m.id > COALESCE(s.through_message_id, 0) 
+                    WHERE c.is_archived = 0 
+                    GROUP BY c.id 
+                    HAVING SUM(m.token_count) > ? 
+                    ORDER BY c.updated_at DESC 
+                    LIMIT ?
+                ''', (min_tokens, limit)).fetchall()
+                return [row['id'] for row in rows]
+        except Exception as e:
+            logger.error(f"Failed to get compaction candidates: {e}")
+            raise
+
+    def get_messages_to_compact(self, conversation_id, keep_tokens, max_tokens):
+        """Return a conversation's summary and the oldest messages it does not cover yet.
+
+        The newest messages, up to keep_tokens, are left out so recent turns
+        always reach Claude verbatim, and at most max_tokens (less the
+        summary's own tokens) are returned so the summarization request
+        stays within the context window. The oldest candidate is always
+        included. Text attachment content is loaded with the messages.
+        """
+        try:
+            with self.get_db() as conn:
+                summary = self._get_summary(conn, conversation_id)
+                after_id = 0
+                if summary is not None:
+                    after_id = summary['through_message_id']
+                    max_tokens -= summary['token_count']
+                
+                messages = conn.execute('''
+                    WITH pending AS (
+                        SELECT 
+                            id,
+                            SUM(token_count) OVER (ORDER BY id DESC) AS newer_tokens,
+                            SUM(token_count) OVER (ORDER BY id ASC) AS older_tokens,
+                            ROW_NUMBER() OVER (ORDER BY id ASC) AS rn
+                        FROM messages
+                        WHERE conversation_id = ? AND id > ?
+                    )
+                    SELECT m.id, m.conversation_id, m.role, m.content, m.timestamp, m.token_count
+                    FROM pending
+                    JOIN messages m ON m.id = pending.id
+                    WHERE pending.newer_tokens > ? AND (pending.older_tokens <= ? OR pending.rn = 1)
+                    ORDER BY m.id ASC
+                ''', (conversation_id, after_id, keep_tokens, max_tokens)).fetchall()
+                
+                messages = [dict(msg) for msg in messages]
+                self._attach_metadata(conn, messages, include_content=True)
+                return summary, messages
+        except Exception as e:
+            logger.error(f"Failed to get messages to compact for conversation {conversation_id}: {e}")
+            raise
+
+    def save_summary(self, conversation_id, through_message_id, content, token_count):
+        """Store a summary covering a conversation's messages up to through_message_id.
+
+        It replaces the conversation's previous summary unless that one
+        already covers more messages. The messages themselves are kept.
+        Returns True if the summary was stored.
+        """
+        try:
+            with self.get_db() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    INSERT INTO conversation_summaries 
+                        (conversation_id, through_message_id, content, token_count) 
+                    SELECT ?, ?, ?, ? 
+                    WHERE EXISTS (SELECT 1 FROM conversations WHERE id = ? AND is_archived = 0) 
+                    ON CONFLICT (conversation_id) DO UPDATE SET 
+                        through_message_id = excluded.through_message_id, 
+                        content = excluded.content, 
+                        token_count = excluded.token_count, 
+                        created_at = excluded.created_at 
+                    WHERE excluded.through_message_id > conversation_summaries.through_message_id
+                ''', (conversation_id, through_message_id, content, token_count, conversation_id))
+                conn.commit()
+                if c.rowcount:
+                    logger.info(f"Compacted conversation {conversation_id} through message {through_message_id}")
+                return c.rowcount > 0
+        except Exception as e:
+            logger.error(f"Failed to save summary for conversation {conversation_id}: {e}")
+            raise
+
+    def _attach_metadata(self, conn, messages, include_content=False):
+        """Set messages[i]['attachments'] from message_attachments in one query.
+
+        Text attachment content is only loaded when include_content is True,
+        so history reads stay proportional to message text. Image content is
+        never loaded here; see context.get_image_block.
+        """
+        for msg in messages:
+            msg['attachments'] = []
+        if not messages:
+            return messages
+        
+        by_id = {msg['id']: msg for msg in messages}
+        content_column = (
+            ", CASE WHEN a.type = 'text' THEN a.content END AS content"
+            if include_content else ''
+        )
+        # Chunk to stay under SQLite's bound-parameter limit
+        ids = list(by_id)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f'''
+                SELECT ma.message_id, ma.filename, a.id, a.sha256, a.type, a.size, a.token_count{content_column}
+                FROM message_attachments ma
+                JOIN attachments a ON a.id = ma.attachment_id
+                WHERE ma.message_id IN ({placeholders})
+                ORDER BY ma.message_id, ma.position
+            ''', chunk).fetchall()
+            for row in rows:
+                attachment = dict(row)
+                by_id[attachment.pop('message_id')]['attachments'].append(attachment)
+        return messages
+
+    def get_attachment(self, attachment_id):
+        """Retrieve a stored attachment, including its content, by id."""
+        try:
+            with self.get_db() as conn:
+                row = conn.execute(
+                    'SELECT * FROM attachments WHERE id = ?',
+                    (attachment_id,)
+                ).fetchone()
+                return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Failed to get attachment {attachment_id}: {e}")
+            raise
+
+    def get_attachment_by_hash(self, sha256):
+        """Retrieve a stored attachment's metadata (not its content) by the SHA-256 of its uploaded bytes."""
+        try:
+            with self.get_db() as conn:
+                row = conn.execute(
+                    'SELECT id, sha256, type, size, token_count FROM attachments WHERE sha256 = ?',
+                    (sha256,)
+                ).fetchone()
+                return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Failed to get attachment by hash: {e}")
+            raise
+
+    def save_attachment(self, sha256, type, content, size, token_count=0):
+        """Store an attachment unless one with the same hash exists; return its id.
+
+        ``content`` may be a string or UTF-8 encoded bytes, which are stored
+        as text without being decoded into a Python string first.
+        """
+        try:
+            with self.get_db() as conn:
+                conn.execute('''
+                    INSERT OR IGNORE INTO attachments (sha256, type, content, size, token_count)
+                    VALUES (?, ?, CAST(? AS TEXT), ?, ?)
+                ''', (sha256, type, content, size, token_count))
+                conn.commit()
+                return conn.execute(
+                    'SELECT id FROM attachments WHERE sha256 = ?',
+                    (sha256,)
+                ).fetchone()['id']
+        except Exception as e:
+            logger.error(f"Failed to save attachment: {e}")
+            raise
+
+    def get_conversation(self, conversation_id):
+        """Retrieve a single conversation by primary key, or None."""
+        try:
+            with self.get_db() as conn:
+                conv = conn.execute(
+                    'SELECT * FROM conversations WHERE id = ?',
+                    (conversation_id,)
+                ).fetchone()
+                return dict(conv) if conv else None
+        except Exception as e:
+            logger.error(f"Failed to get conversation {conversation_id}: {e}")
+            raise
 
     def create_conversation(self, title):
         try:
             with self.get_db() as conn:
                 c = conn.cursor()
-                c.execute(
-                    'INSERT INTO conversations (title) VALUES (?)',
+                conversation_id = self._insert(
+                    c, 'INTO conversations (title) VALUES (?)',
                     (title,)
                 )
-                conversation_id = c.lastrowid
                 conn.commit()
+                self._cache_conversation(conversation_id, True)
                 logger.info(f"Created new conversation with ID: {conversation_id}")
                 return conversation_id
         except Exception as e:
             logger.error(f"Failed to create conversation: {e}")
             raise
 
-    def add_message(self, conversation_id, role, content):
-        """Add a message to a specific conversation."""
+    def add_message(self, conversation_id, role, content, token_count=None, attachments=()):
+        """Add a message to a specific conversation.
+
+        ``attachments`` is a list of dicts with ``id``, ``sha256``,
+        ``filename`` and ``token_count`` for files already saved with
+        save_attachment; they are linked to the message, not copied into it.
+
+        The existence check, the insert and the conversation timestamp bump
+        run in a single transaction. An archived conversation is restored
+        first. Raises ConversationNotFoundError if the conversation does not
+        exist.
+        """
+        if token_count is None:
+            token_count = estimate_tokens(content)
+            token_count += sum(attachment['token_count'] for attachment in attachments)
+        message_hash = content_hash(content, [attachment['sha256'] for attachment in attachments])
+        
         try:
             with self.get_db() as conn:
-                # First verify the conversation exists
-                conv = conn.execute(
-                    'SELECT id FROM conversations WHERE id = ?', 
-                    (conversation_id,)
-                ).fetchone()
-                
-                if not conv:
-                    raise Exception(f"Conversation {conversation_id} does not exist")
-
                 current_time = datetime.now().isoformat()
+                c = conn.cursor()
                 
-                # Check for duplicate messages in this conversation
-                existing = conn.execute('''
-                    SELECT id FROM messages 
-                    WHERE conversation_id = ? AND role = ? AND content = ?
-                    ORDER BY timestamp DESC LIMIT 1
-                ''', (conversation_id, role, content)).fetchone()
+                # Touching the conversation first verifies it exists and opens the transaction
+                c.execute('''
+                    UPDATE conversations 
+                    SET updated_at = ? 
+                    WHERE id = ? AND is_archived = 0
+                ''', (current_time, conversation_id))
                 
-                if not existing:
-                    c = conn.cursor()
-                    c.execute('''
-                        INSERT INTO messages (conversation_id, role, content, timestamp)
+                if not c.rowcount:
+                    conn.rollback()
+                    self.invalidate_conversation(conversation_id)
+                    raise ConversationNotFoundError(f"Conversation {conversation_id} does not exist")
+                
+                # Duplicates are rejected by the unique (conversation_id, role, content_hash) index
+                message_id = self._insert(c, '''
+                    INTO messages 
+                        (conversation_id, role, content, timestamp, content_hash, token_count)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (conversation_id, role, content, current_time, message_hash, token_count), ignore_conflicts=True)
+                
+                if message_id:
+                    c.executemany('''
+                        INSERT INTO message_attachments (message_id, position, attachment_id, filename)
                         VALUES (?, ?, ?, ?)
-                    ''', (conversation_id, role, content, current_time))
-                    
-                    # Update conversation timestamp
-                    c.execute('''
-                        UPDATE conversations 
-                        SET updated_at = ? 
-                        WHERE id = ?
-                    ''', (current_time, conversation_id))
-                    
+                    ''', [
+                        (message_id, position, attachment['id'], attachment['filename'])
+                        for position, attachment in enumerate(attachments)
+                    ])
                     conn.commit()
                     logger.info(f"Added message to conversation {conversation_id}")
                 else:
+                    # Leave updated_at untouched for skipped duplicates
+                    conn.rollback()
                     logger.info(f"Skipped duplicate message in conversation {conversation_id}")
                     
+        except ConversationNotFoundError:
+            # It may have been archived since the caller checked: restore it and try again
+            if self.restore_conversation(conversation_id):
+                return self.add_message(conversation_id, role, content, token_count, attachments)
+            raise
         except Exception as e:
             logger.error(f"Failed to add message: {e}")
             raise
 
     def delete_conversation(self, conversation_id):
-        """Delete a conversation and its messages."""
+        """Delete a conversation and its messages, including any archived copy."""
         try:
             with self.get_db() as conn:
                 c = conn.cursor()
-                # First delete all messages associated with the conversation
+                archived = c.execute(
+                    'SELECT is_archived FROM conversations WHERE id = ?',
+                    (conversation_id,)
+                ).fetchone()
+                # First delete all messages (and their attachment links) in the conversation
+                c.execute('''
+                    DELETE FROM message_attachments 
+                    WHERE message_id IN (
+                        SELECT id FROM messages WHERE conversation_id = ?
+                    )
+                ''', (conversation_id,))
                 c.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+                c.execute('DELETE FROM conversation_summaries WHERE conversation_id = ?', (conversation_id,))
                 # Then delete the conversation itself
                 c.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,))
                 conn.commit()
+                if archived and archived['is_archived']:
+                    with self._archive_db(conn) as archive_conn:
+                        self.archive.delete(archive_conn, conversation_id)
+                        archive_conn.commit()
+                self.invalidate_conversation(conversation_id)
                 logger.info(f"Deleted conversation {conversation_id} and its messages")
                 return True
         except Exception as e:
@@ -231,18 +1030,464 @@ class Database:
             logger.error(f"Failed to update conversation title: {e}")
             raise
 
+    def _lock_conversation(self, conn, conversation_id):
+        """Start a transaction that keeps other writers off a conversation; return its row or None."""
+        # SQLite has a single writer, so taking the write lock now is enough
+        conn.execute('BEGIN IMMEDIATE')
+        return conn.execute(
+            'SELECT is_archived FROM conversations WHERE id = ?',
+            (conversation_id,)
+        ).fetchone()
+
+    def _archive_db(self, conn):
+        """Connection to the archive store for a transaction on ``conn``.
+
+        The SQLite archive is a separate database file, so it has its own
+        connections and is committed separately.
+        """
+        return self.archive.connection()
+
+    def _export_conversation(self, conn, conversation_id):
+        """Read a conversation's messages, their attachments and its summary for the archive."""
+        messages = [dict(row) for row in conn.execute('''
+            SELECT id, role, content, timestamp, content_hash, token_count 
+            FROM messages 
+            WHERE conversation_id = ? 
+            ORDER BY id
+        ''', (conversation_id,))]
+        links = []
+        attachments = {}
+        for row in conn.execute('''
+            SELECT ma.message_id, ma.position, ma.filename, 
+                   a.sha256, a.type, a.content, a.size, a.token_count 
+            FROM messages m 
+            JOIN message_attachments ma ON ma.message_id = m.id 
+            JOIN attachments a ON a.id = ma.attachment_id 
+            WHERE m.conversation_id = ? 
+            ORDER BY ma.message_id, ma.position
+        ''', (conversation_id,)):
+            links.append({key: row[key] for key in ('message_id', 'position', 'filename', 'sha256')})
+            # Attachments are stored by value: once no hot message links
+            # them, cleanup_attachments deletes the hot copy
+            attachments[row['sha256']] = {key: row[key] for key in ('type', 'content', 'size', 'token_count')}
+        return {
+            'messages': messages,
+            'links': links,
+            'attachments': attachments,
+            'summary': self._get_summary(conn, conversation_id),
+        }
+
+    def _import_conversation(self, c, conversation_id, payload):
+        """Write an archived conversation back into the hot tables, keeping the message ids."""
+        attachment_ids = {}
+        for sha256, attachment in payload['attachments'].items():
+            attachment_ids[sha256] = self._insert(c, '''
+                INTO attachments (sha256, type, content, size, token_count) 
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                sha256, attachment['type'], attachment['content'], attachment['size'], attachment['token_count']
+            ), ignore_conflicts=True) or c.execute(
+                'SELECT id FROM attachments WHERE sha256 = ?',
+                (sha256,)
+            ).fetchone()['id']
+        
+        c.executemany('''
+            INSERT INTO messages 
+                (id, conversation_id, role, content, timestamp, content_hash, token_count) 
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (
+                message['id'], conversation_id, message['role'], message['content'],
+                message['timestamp'], message['content_hash'], message['token_count']
+            )
+            for message in payload['messages']
+        ])
+        c.executemany('''
+            INSERT INTO message_attachments (message_id, position, attachment_id, filename) 
+            VALUES (?, ?, ?, ?)
+        ''', [
+            (link['message_id'], link['position'], attachment_ids[link['sha256']], link['filename'])
+            for link in payload['links']
+        ])
+        summary = payload['summary']
+        if summary:
+            c.execute('''
+                INSERT INTO conversation_summaries 
+                    (conversation_id, through_message_id, content, token_count, created_at) 
+                VALUES (?, ?, ?, ?, ?) 
+                ON CONFLICT (conversation_id) DO NOTHING
+            ''', (
+                conversation_id, summary['through_message_id'], summary['content'],
+                summary['token_count'], summary['created_at']
+            ))
+
+    def archive_conversation(self, conversation_id):
+        """Move a conversation's messages, attachments and summary to the archive store.
+
+        The conversation is locked against writers while it is copied.
+        The archive is committed before the hot rows are deleted, so a
+        crash in between leaves the conversation active with a stale copy
+        that the next archive replaces. Conversations with unfinished bulk
+        requests are left active, as the batch worker will write to them.
+        Returns True if the conversation is archived, False if it has
+        unfinished bulk requests; raises ConversationNotFoundError if it
+        does not exist.
+        """
+        try:
+            with self.get_db() as conn:
+                conversation = self._lock_conversation(conn, conversation_id)
+                if conversation is None:
+                    conn.rollback()
+                    raise ConversationNotFoundError(f"Conversation {conversation_id} does not exist")
+                if conversation['is_archived']:
+                    conn.rollback()
+                    return True
+                busy = conn.execute('''
+                    SELECT 1 FROM batch_requests 
+                    WHERE conversation_id = ? AND status IN ('pending', 'submitted')
+                ''', (conversation_id,)).fetchone()
+                if busy:
+                    conn.rollback()
+                    return False
+                
+                payload = self._export_conversation(conn, conversation_id)
+                with self._archive_db(conn) as archive_conn:
+                    stored = self.archive.put(archive_conn, conversation_id, payload)
+                    c = conn.cursor()
+                    c.execute('''
+                        DELETE FROM message_attachments 
+                        WHERE message_id IN (
+                            SELECT id FROM messages WHERE conversation_id = ?
+                        )
+                    ''', (conversation_id,))
+                    c.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+                    c.execute('DELETE FROM conversation_summaries WHERE conversation_id = ?', (conversation_id,))
+                    c.execute('UPDATE conversations SET is_archived = 1 WHERE id = ?', (conversation_id,))
+                    archive_conn.commit()
+                    conn.commit()
+            self.invalidate_conversation(conversation_id)
+            ARCHIVE_OPERATIONS.inc(operation='archive')
+            logger.info(
+                f"Archived conversation {conversation_id}: "
+                f"{len(payload['messages'])} messages in {stored} bytes"
+            )
+            return True
+        except ConversationNotFoundError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to archive conversation {conversation_id}: {e}")
+            raise
+
+    def restore_conversation(self, conversation_id):
+        """Move an archived conversation back into the hot tables.
+
+        Messages keep their ids, so links to them and the summary stay
+        valid. The hot rows are committed before the archived copy is
+        deleted. Returns True if the conversation exists and is active
+        (whether or not it was archived), False if it does not exist.
+        """
+        conversation = self.get_conversation(conversation_id)
+        if conversation is None or not conversation['is_archived']:
+            self._cache_conversation(conversation_id, conversation is not None)
+            return conversation is not None
+        
+        try:
+            with self.get_db() as conn:
+                # Another request may have restored it while we waited for the lock
+                conversation = self._lock_conversation(conn, conversation_id)
+                if conversation is None or not conversation['is_archived']:
+                    conn.rollback()
+                    return conversation is not None
+                
+                with self._archive_db(conn) as archive_conn:
+                    payload = self.archive.get(archive_conn, conversation_id)
+                    if payload is None:
+                        raise LookupError(f"No archived copy of conversation {conversation_id}")
+                    c = conn.cursor()
+                    self._import_conversation(c, conversation_id, payload)
+                    c.execute('UPDATE conversations SET is_archived = 0 WHERE id = ?', (conversation_id,))
+                    self.archive.delete(archive_conn, conversation_id)
+                    conn.commit()
+                    archive_conn.commit()
+            self._cache_conversation(conversation_id, True)
+            ARCHIVE_OPERATIONS.inc(operation='restore')
+            logger.info(f"Restored conversation {conversation_id} with {len(payload['messages'])} messages")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to restore conversation {conversation_id}: {e}")
+            raise
+
+    def get_archive_candidates(self, idle_since, limit=100):
+        """Return ids of active conversations not updated since ``idle_since``, least recent first.
+
+        ``idle_since`` is an ISO 8601 timestamp. Conversations with
+        unfinished bulk requests are skipped.
+        """
+        try:
+            with self.get_db() as conn:
+                rows = conn.execute('''
+                    SELECT c.id 
+                    FROM conversations c 
+                    WHERE c.is_archived = 0 AND c.updated_at < ? 
+                    AND NOT EXISTS (
+                        SELECT 1 FROM batch_requests b 
+                        WHERE b.conversation_id = c.id AND b.status IN ('pending', 'submitted')
+                    ) 
+                    ORDER BY c.updated_at 
+                    LIMIT ?
+                ''', (idle_since, limit)).fetchall()
+                return [row['id'] for row in rows]
+        except Exception as e:
+            logger.error(f"Failed to get archive candidates: {e}")
+            raise
+
+    def get_archive_stats(self):
+        """Return the number of archived conversations and messages, and their raw and stored bytes."""
+        with self.get_db() as conn, self._archive_db(conn) as archive_conn:
+            return self.archive.stats(archive_conn)
+
+    def _insert_messages(self, c, messages, current_time):
+        """Insert messages inside the caller's transaction.
+
+        ``messages`` are dicts with ``conversation_id``, ``role``,
+        ``content`` and optionally ``token_count``. Messages for missing
+        conversations and duplicates are skipped, and only conversations
+        that received a message have updated_at bumped. Returns the new
+        message ids, with None for skipped messages.
+        """
+        message_ids = []
+        touched = set()
+        for message in messages:
+            content = message['content']
+            token_count = message.get('token_count')
+            if token_count is None:
+                token_count = estimate_tokens(content)
+            message_id = self._insert(c, '''
+                INTO messages 
+                    (conversation_id, role, content, timestamp, content_hash, token_count)
+                SELECT ?, ?, ?, ?, ?, ? 
+                WHERE EXISTS (SELECT 1 FROM conversations WHERE id = ? AND is_archived = 0)
+            ''', (
+                message['conversation_id'], message['role'], content, current_time,
+                content_hash(content), token_count, message['conversation_id']
+            ), ignore_conflicts=True)
+            message_ids.append(message_id)
+            if message_id:
+                touched.add(message['conversation_id'])
+        c.executemany(
+            'UPDATE conversations SET updated_at = ? WHERE id = ?',
+            [(current_time, conversation_id) for conversation_id in touched]
+        )
+        return message_ids
+
+    def add_messages(self, messages):
+        """Add many text messages in a single transaction.
+
+        See _insert_messages for the format. Unlike add_message, messages
+        for conversations that no longer exist are skipped rather than
+        raising. Returns the new message ids, with None for skipped ones.
+        """
+        try:
+            with self.get_db() as conn:
+                c = conn.cursor()
+                message_ids = self._insert_messages(c, messages, datetime.now().isoformat())
+                conn.commit()
+                logger.info(f"Added {sum(1 for m in message_ids if m)} of {len(message_ids)} messages in bulk")
+                return message_ids
+        except Exception as e:
+            logger.error(f"Failed to add messages: {e}")
+            raise
+
+    def create_batch_job(self, requests):
+        """Queue a bulk job of prompts for the batch worker.
+
+        ``requests`` are dicts with ``message`` and either an existing
+        ``conversation_id`` or a ``title`` for a new conversation. The
+        conversations, user messages and queued requests are written in one
+        transaction. Returns the job id and, per request, its id and
+        conversation id. Raises ConversationNotFoundError if a given
+        conversation does not exist.
+        """
+        try:
+            with self.get_db() as conn:
+                current_time = datetime.now().isoformat()
+                c = conn.cursor()
+                job_id = self._insert(c, 'INTO batch_jobs DEFAULT VALUES')
+                
+                conversation_ids = []
+                for request in requests:
+                    conversation_id = request.get('conversation_id')
+                    if conversation_id is None:
+                        conversation_id = self._insert(
+                            c, 'INTO conversations (title, updated_at) VALUES (?, ?)',
+                            (request['title'], current_time)
+                        )
+                    else:
+                        exists = c.execute(
+                            'SELECT 1 FROM conversations WHERE id = ? AND is_archived = 0',
+                            (conversation_id,)
+                        ).fetchone()
+                        if not exists:
+                            conn.rollback()
+                            raise ConversationNotFoundError(f"Conversation {conversation_id} does not exist")
+                    conversation_ids.append(conversation_id)
+                
+                self._insert_messages(c, [
+                    {'conversation_id': conversation_id, 'role': 'user', 'content': request['message']}
+                    for conversation_id, request in zip(conversation_ids, requests)
+                ], current_time)
+                
+                request_ids = []
+                for conversation_id in conversation_ids:
+                    request_ids.append(self._insert(
+                        c, 'INTO batch_requests (job_id, conversation_id, updated_at) VALUES (?, ?, ?)',
+                        (job_id, conversation_id, current_time)
+                    ))
+                conn.commit()
+                
+                for conversation_id in conversation_ids:
+                    self._cache_conversation(conversation_id, True)
+                logger.info(f"Queued batch job {job_id} with {len(requests)} requests")
+                return job_id, [
+                    {'id': request_id, 'conversation_id': conversation_id}
+                    for request_id, conversation_id in zip(request_ids, conversation_ids)
+                ]
+        except ConversationNotFoundError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to create batch job: {e}")
+            raise
+
+    def get_batch_job(self, job_id):
+        """Return a job's requests and a count per status, or None if it does not exist."""
+        try:
+            with self.get_db() as conn:
+                job = conn.execute('SELECT id, created_at FROM batch_jobs WHERE id = ?', (job_id,)).fetchone()
+                if job is None:
+                    return None
+                requests = conn.execute('''
+                    SELECT id, conversation_id, status, message_id, error, updated_at 
+                    FROM batch_requests 
+                    WHERE job_id = ? 
+                    ORDER BY id
+                ''', (job_id,)).fetchall()
+                counts = {}
+                for request in requests:
+                    counts[request['status']] = counts.get(request['status'], 0) + 1
+                return {
+                    **dict(job),
+                    'counts': counts,
+                    'requests': [dict(request) for request in requests]
+                }
+        except Exception as e:
+            logger.error(f"Failed to get batch job {job_id}: {e}")
+            raise
+
+    def get_pending_batch_requests(self, limit):
+        """Return up to ``limit`` queued requests that have not been submitted yet, oldest first."""
+        with self.get_db() as conn:
+            rows = conn.execute('''
+                SELECT id, conversation_id FROM batch_requests 
+                WHERE status = 'pending' 
+                ORDER BY id 
+                LIMIT ?
+            ''', (limit,)).fetchall()
+            return [dict(row) for row in rows]
+
+    def mark_batch_requests_submitted(self, request_ids, message_batch_id):
+        with self.get_db() as conn:
+            conn.executemany('''
+                UPDATE batch_requests 
+                SET status = 'submitted', message_batch_id = ?, updated_at = ? 
+                WHERE id = ? AND status = 'pending'
+            ''', [(message_batch_id, datetime.now().isoformat(), request_id) for request_id in request_ids])
+            conn.commit()
+
+    def get_submitted_batches(self):
+        """Return the ids of Message Batches that still have unfinished requests."""
+        with self.get_db() as conn:
+            rows = conn.execute('''
+                SELECT DISTINCT message_batch_id FROM batch_requests 
+                WHERE status = 'submitted'
+            ''').fetchall()
+            return [row['message_batch_id'] for row in rows]
+
+    def complete_batch_requests(self, message_batch_id, results):
+        """Write back the results of a finished Message Batch in one transaction.
+
+        ``results`` maps request ids to dicts with ``status`` and either
+        ``content`` (and optionally ``token_count``) for a succeeded request
+        or ``error``. Succeeded requests get their assistant message added to
+        the conversation. Requests of the batch missing from ``results`` are
+        marked expired. Returns the number of messages added.
+        """
+        try:
+            with self.get_db() as conn:
+                current_time = datetime.now().isoformat()
+                c = conn.cursor()
+                requests = c.execute('''
+                    SELECT id, conversation_id FROM batch_requests 
+                    WHERE message_batch_id = ? AND status = 'submitted'
+                ''', (message_batch_id,)).fetchall()
+                
+                succeeded = [
+                    request for request in requests
+                    if results.get(request['id'], {}).get('status') == 'succeeded'
+                ]
+                message_ids = self._insert_messages(c, [
+                    {
+                        'conversation_id': request['conversation_id'],
+                        'role': 'assistant',
+                        'content': results[request['id']]['content'],
+                        'token_count': results[request['id']].get('token_count'),
+                    }
+                    for request in succeeded
+                ], current_time)
+                message_ids = dict(zip((request['id'] for request in succeeded), message_ids))
+                
+                updates = []
+                for request in requests:
+                    result = results.get(request['id'], {'status': 'expired', 'error': 'No result returned'})
+                    updates.append((
+                        result['status'], message_ids.get(request['id']),
+                        result.get('error'), current_time, request['id']
+                    ))
+                c.executemany('''
+                    UPDATE batch_requests 
+                    SET status = ?, message_id = ?, error = ?, updated_at = ? 
+                    WHERE id = ?
+                ''', updates)
+                conn.commit()
+                added = sum(1 for message_id in message_ids.values() if message_id)
+                logger.info(f"Completed {len(requests)} requests from batch {message_batch_id}, added {added} messages")
+                return added
+        except Exception as e:
+            logger.error(f"Failed to complete batch {message_batch_id}: {e}")
+            raise
+
     def cleanup_duplicate_messages(self):
-        """Remove duplicate messages from the database."""
+        """Backfill missing content hashes and remove any duplicate messages.
+
+        Duplicates are prevented at write time, so this is only needed as an
+        offline maintenance job (see maintenance.py) for rows written
+        outside of add_message. It must not be called on the request path.
+        """
         try:
             with self.get_db() as conn:
+                conn.create_function('content_hash', 1, content_hash, deterministic=True)
                 c = conn.cursor()
-                # Delete duplicate messages keeping only the latest version
+                c.execute('''
+                    UPDATE messages 
+                    SET content_hash = content_hash(content) 
+                    WHERE content_hash IS NULL
+                ''')
+                # Keep the earliest copy of each message
                 c.execute('''
                     DELETE FROM messages 
                     WHERE id NOT IN (
-                        SELECT MAX(id)
+                        SELECT MIN(id)
                         FROM messages
-                        GROUP BY conversation_id, role, content, timestamp
+                        GROUP BY conversation_id, role, content_hash
                     )
                 ''')
                 conn.commit()
@@ -250,4 +1495,91 @@ class Database:
         except Exception as e:
             logger.error(f"Failed to cleanup duplicate messages: {e}")
 
-db = Database()
\ No newline at end of file
+    def cleanup_attachments(self):
+        """Delete attachment links to missing messages and unreferenced attachments.
+
+        Attachments are saved before the message that references them, so
+        only those older than a day are considered orphaned.
+        """
+        try:
+            with self.get_db() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    DELETE FROM message_attachments 
+                    WHERE message_id NOT IN (SELECT id FROM messages)
+                ''')
+                c.execute(f'''
+                    DELETE FROM attachments 
+                    WHERE created_at < {self.ONE_DAY_AGO}
+                    AND NOT EXISTS (
+                        SELECT 1 FROM message_attachments ma 
+                        WHERE ma.attachment_id = attachments.id
+                    )
+                ''')
+                conn.commit()
+                logger.info("Cleaned up orphaned attachments")
+        except Exception as e:
+            logger.error(f"Failed to cleanup attachments: {e}")
+
+    def run_maintenance(self):
+        """Run the offline maintenance tasks and let SQLite refresh its statistics."""
+        self.cleanup_database()
+        self.cleanup_duplicate_messages()
+        self.cleanup_attachments()
+        with self.get_db() as conn:
+            # Merge the full-text index segments to keep searches fast
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+            conn.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('optimize')")
+            conn.commit()
+            conn.execute('PRAGMA optimize')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        logger.info("Database maintenance completed")
+
+def create_database(url=None):
+    """Open the storage backend for ``url`` (default Config.DATABASE_URL).
+
+    A ``postgresql://`` URL selects PostgresDatabase; otherwise the SQLite
+    database at Config.DATABASE_PATH is used.
+    """
+    url = url or Config.DATABASE_URL
+    if url and url.startswith(('postgres://', 'postgresql://')):
+        from postgres_database import PostgresDatabase
+        return PostgresDatabase(url)
+    return Database(Config.DATABASE_PATH)
+
+db = create_database()
+
+class AsyncDatabase:
+    """Asyncio facade over a Database.
+
+    Every Database method is exposed as a coroutine that runs on a dedicated
+    thread pool sized to the connection pool, so the event loop never
+    blocks on the database and at most one thread waits per pooled connection.
+    """
+
+    def __init__(self, database, max_workers=None):
+        self.database = database
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or database.pool.max_size,
+            thread_name_prefix='db'
+        )
+
+    async def run(self, fn, *args, **kwargs):
+        """Run an arbitrary blocking callable that uses the database."""
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the caller's context so queries count against its request
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, fn, *args, **kwargs)
+        )
+
+    def __getattr__(self, name):
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
+
+async_db = AsyncDatabase(db)
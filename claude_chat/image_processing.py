@@ -0,0 +1,106 @@
+"""Image attachment processing on a bounded process pool.
+
+Decoding and resizing large images holds the GIL for hundreds of
+milliseconds, so it runs in worker processes instead of on the request
+thread. All images in a request are processed in parallel.
+"""
+import base64
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image exceeds Config.MAX_IMAGE_PIXELS."""
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Return the shared process pool, creating it on first use.
+
+    Workers are spawned rather than forked because the web server is
+    multi-threaded.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=Config.IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+@functools.lru_cache(maxsize=None)
+def load_pil():
+    """Import and configure PIL on first use, normally in an image worker process."""
+    from PIL import Image
+    # Let PIL reject anything more than twice our own limit outright
+    Image.MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
+    return Image
+
+def process_image_bytes(data, max_dimension=None):
+    """Decode, downscale and re-encode an image as base64 JPEG.
+
+    Only the header is read before the pixel limit is checked, so oversized
+    images are rejected without being decoded. JPEGs are decoded at a
+    reduced scale via draft(), and other formats are shrunk by an integer
+    factor with reduce() before the final LANCZOS resize.
+    """
+    max_dimension = max_dimension or Config.MAX_IMAGE_DIMENSION
+    Image = load_pil()
+    try:
+        image = Image.open(BytesIO(data))
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        # PIL refuses images over twice MAX_IMAGE_PIXELS (or warns, which
+        # a warnings filter may turn into an error) before we see the size
+        raise ImageTooLargeError(
+            f"Image is too large; the maximum is {Config.MAX_IMAGE_PIXELS} pixels"
+        ) from e
+    
+    width, height = image.size
+    if width * height > Config.MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(
+            f"Image is {width}x{height} pixels; the maximum is {Config.MAX_IMAGE_PIXELS} pixels"
+        )
+    
+    if max(image.size) > max_dimension:
+        ratio = max_dimension / max(image.size)
+        target_size = tuple(max(1, int(dim * ratio)) for dim in image.size)
+        
+        # JPEG: decode at the smallest DCT scale that is still >= the target
+        image.draft('RGB', target_size)
+        
+        # Other formats: cheap integer downscale while staying >= 2x the target
+        factor = min(dim // target for dim, target in zip(image.size, target_size)) // 2
+        if factor > 1:
+            image = image.reduce(factor)
+        
+        image = image.resize(target_size, Image.Resampling.LANCZOS)
+    
+    # Convert to RGB if necessary
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=85, optimize=True)
+    
+    return {
+        'type': 'image',
+        'media_type': 'image/jpeg',
+        'width': image.width,
+        'height': image.height,
+        'data': base64.b64encode(buffer.getvalue()).decode('utf-8')
+    }
+
+def process_images(images):
+    """Process a list of raw image bytes in parallel, preserving order."""
+    if not images:
+        return []
+    executor = get_executor()
+    return list(executor.map(process_image_bytes, images))
@@ -0,0 +1,66 @@
+"""Offline database maintenance.
+
+Archives conversations idle for longer than Config.ARCHIVE_AFTER_DAYS
+(see archive.py), then runs the storage backend's maintenance tasks. Run
+once (e.g. from cron) or as a long-lived background process:
+
+    python maintenance.py
+    python maintenance.py --interval 3600
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+from config import Config
+from database import db
+from storage import ConversationNotFoundError
+
+logger = logging.getLogger(__name__)
+
+def archive_idle_conversations(idle_days=None):
+    """Archive every conversation not updated for ``idle_days``; return how many were archived."""
+    idle_days = Config.ARCHIVE_AFTER_DAYS if idle_days is None else idle_days
+    if idle_days <= 0:
+        return 0
+    idle_since = (datetime.now() - timedelta(days=idle_days)).isoformat()
+    archived = 0
+    while True:
+        candidates = db.get_archive_candidates(idle_since, Config.ARCHIVE_BATCH_SIZE)
+        progress = 0
+        for conversation_id in candidates:
+            try:
+                progress += db.archive_conversation(conversation_id)
+            except ConversationNotFoundError:
+                pass  # Deleted since the query
+        archived += progress
+        # Conversations that could not be archived come back in the next query
+        if len(candidates) < Config.ARCHIVE_BATCH_SIZE or not progress:
+            break
+    if archived:
+        logger.info(f"Archived {archived} conversations idle for more than {idle_days} days")
+    return archived
+
+def main():
+    parser = argparse.ArgumentParser(description='Run database maintenance tasks.')
+    parser.add_argument(
+        '--interval', type=int, default=0,
+        help='Repeat every N seconds instead of running once'
+    )
+    args = parser.parse_args()
+
+    db.init_db()
+    while True:
+        try:
+            archive_idle_conversations()
+        except Exception as e:
+            logger.error(f"Archiving idle conversations failed: {e}")
+        try:
+            db.run_maintenance()
+        except Exception as e:
+            logger.error(f"Database maintenance failed: {e}")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
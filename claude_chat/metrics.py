@@ -0,0 +1,220 @@
+"""In-process metrics exposed in the Prometheus text format at /metrics.
+
+Metrics are per process; when running several workers, scrape each one
+or aggregate downstream. Recording is a dict lookup and an addition under
+a lock, and the text format is only built when /metrics is scraped, so the
+instrumentation is cheap enough to leave on in production.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+class Counter:
+    """A monotonically increasing value, optionally split by labels."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+class Histogram:
+    """Observations counted into cumulative buckets, optionally split by labels."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets or LATENCY_BUCKETS))
+        # Per label set: [count per bucket (the last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': format_bound(bound)}, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Render every registered metric in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = (f'{key}="{escape_label_value(value)}"' for key, value in labels.items())
+    return '{' + ','.join(pairs) + '}'
+
+registry = Registry()
+
+# Seconds; spans fast SQLite calls up to long generations
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def counter(name, documentation, labelnames=()):
+    return registry.register(Counter(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=None):
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+TOKENS = counter(
+    'claude_tokens_total',
+    'Tokens reported in Messages API usage, by kind.',
+    ('model', 'kind')
+)
+
+def record_token_usage(model, usage):
+    """Count the tokens from a Messages API ``usage`` object, including prompt-cache usage."""
+    if usage is None:
+        return
+    for kind in ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens'):
+        amount = getattr(usage, kind, None) or 0
+        if amount:
+            TOKENS.inc(amount, model=model, kind=kind)
+
+REQUEST_SECONDS = histogram(
+    'claude_http_request_duration_seconds',
+    'Time to serve a request, including the whole body of streamed responses.',
+    ('endpoint', 'status')
+)
+
+REQUEST_DB_QUERIES = histogram(
+    'claude_db_queries_per_request',
+    'SQLite statements executed while serving a request.',
+    ('endpoint',),
+    buckets=QUERY_COUNT_BUCKETS
+)
+
+STAGE_SECONDS = histogram(
+    'claude_chat_stage_seconds',
+    'Time spent in each stage of a chat request.',
+    ('endpoint', 'stage')
+)
+
+class RequestMetrics:
+    """Measurements for the request being served."""
+
+    __slots__ = ('endpoint', 'start', 'db_queries')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.db_queries = 0
+
+# Set for the duration of a request; shared with the threads it hands work to
+# as long as they run in a copy of the request's context
+current_request = contextvars.ContextVar('current_request', default=None)
+
+def start_request(endpoint):
+    """Start measuring a request served by ``endpoint``."""
+    state = RequestMetrics(endpoint)
+    current_request.set(state)
+    return state
+
+def finish_request(state, status):
+    """Record a request started with start_request."""
+    REQUEST_SECONDS.observe(time.perf_counter() - state.start, endpoint=state.endpoint, status=status)
+    REQUEST_DB_QUERIES.observe(state.db_queries, endpoint=state.endpoint)
+    if current_request.get() is state:
+        current_request.set(None)
+
+def count_db_query():
+    """Count a SQLite statement against the current request, if any."""
+    state = current_request.get()
+    if state is not None:
+        state.db_queries += 1
+
+def observe_stage(name, seconds):
+    state = current_request.get()
+    STAGE_SECONDS.observe(seconds, endpoint=state.endpoint if state else '', stage=name)
+
+class stage:
+    """Time a block as one stage of the current request.
+
+        with stage('history'):
+            claude_messages = build_context(conversation_id)
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe_stage(self.name, time.perf_counter() - self.start)
@@ -0,0 +1,468 @@
+"""PostgreSQL storage backend.
+
+Lets several web nodes share one database: set Config.DATABASE_URL to a
+``postgresql://`` URL. Requires psycopg2 (``pip install psycopg2-binary``).
+
+PostgresDatabase reuses Database's queries, which are written in SQL that
+both databases accept, through a connection wrapper that gives psycopg2
+the parts of the sqlite3 interface they use. The schema, full-text search,
+the conversation list version and maintenance are specific to PostgreSQL.
+Archived conversations are kept in a table of the same database rather
+than a separate file, so that every node can restore them.
+Timestamps are stored as ISO 8601 text, as in SQLite, so both backends
+return the same values and compare them the same way.
+"""
+import contextlib
+import functools
+import logging
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import storage
+from archive import ArchiveStore
+from config import Config
+from database import Database, MIN_PREFIX_LENGTH, SNIPPET_END, SNIPPET_START
+from metrics import count_db_query
+from storage import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Same text as SQLite's CURRENT_TIMESTAMP
+NOW = "to_char(CURRENT_TIMESTAMP AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+# Rows of the conversation list version counter; writers update the row
+# of their backend process, so concurrent writers rarely wait on each other
+LIST_VERSION_SHARDS = 16
+
+# Serializes schema migrations across nodes starting at the same time
+SCHEMA_LOCK_ID = 7210315
+
+TEXT_SEARCH_CONFIG = 'simple'
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    """Convert a query from sqlite3's ``?`` placeholders to psycopg2's ``%s``.
+
+    Queries must not contain ``?`` other than as placeholders.
+    """
+    return sql.replace('%', '%%').replace('?', '%s')
+
+def ts_query(text):
+    """Turn free text into a to_tsquery() expression.
+
+    Like database.match_query, every word is quoted so user input cannot
+    inject query syntax, all words must match and the last one is a prefix
+    match once it is long enough. Returns None if the text contains no words.
+    """
+    words = text.split()
+    if not words:
+        return None
+    terms = ["'" + word.replace('\\', '\\\\').replace("'", "''") + "'" for word in words]
+    if len(words[-1]) >= MIN_PREFIX_LENGTH:
+        terms[-1] += ':*'
+    return ' & '.join(terms)
+
+class PostgresCursor:
+    """psycopg2 cursor with the parts of the sqlite3 cursor interface the queries use.
+
+    Rows are dicts, and every statement counts against the current request.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        count_db_query()
+        self._cursor.execute(translate(sql), params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        count_db_query()
+        # Sends the statements in pages instead of one round trip each
+        psycopg2.extras.execute_batch(self._cursor, translate(sql), seq_of_params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+class PostgresConnection:
+    """psycopg2 connection with the parts of the sqlite3 interface the queries use."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return PostgresCursor(self._conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor))
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+    @property
+    def in_transaction(self):
+        if self._conn.closed:
+            raise psycopg2.InterfaceError('connection already closed')
+        return self._conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+class PostgresConnectionPool(storage.ConnectionPool):
+    """Pool of PostgreSQL connections, shared by the threads of one process."""
+
+    error = psycopg2.Error
+
+    def __init__(self, url, max_size=None, timeout=None):
+        self.url = url
+        super().__init__(max_size, timeout)
+
+    def _connect(self):
+        conn = psycopg2.connect(self.url, connect_timeout=int(self.timeout), application_name='claude_chat')
+        logger.debug("Opened pooled connection to PostgreSQL")
+        return PostgresConnection(conn)
+
+class PostgresDatabase(Database):
+    """PostgreSQL storage backend."""
+
+    ONE_DAY_AGO = "to_char(CURRENT_TIMESTAMP AT TIME ZONE 'UTC' - INTERVAL '1 day', 'YYYY-MM-DD HH24:MI:SS')"
+
+    def __init__(self, url):
+        storage.StorageBackend.__init__(self)
+        self.url = url
+        self.pool = PostgresConnectionPool(url)
+        self.archive = ArchiveStore(self.pool, blob_type='BYTEA', create_table=False)
+
+    def _insert(self, c, statement, params=(), ignore_conflicts=False):
+        c.execute(f"INSERT {statement} {'ON CONFLICT DO NOTHING ' if ignore_conflicts else ''}RETURNING id", params)
+        row = c.fetchone()
+        return row['id'] if row else None
+
+    # Schema migrations; see Database.MIGRATIONS
+    MIGRATIONS = (
+        'create_tables',
+        'create_indexes',
+        'create_list_version',
+        'create_archive_table',
+    )
+
+    def _begin_migration(self, conn):
+        # The advisory lock is held until the transaction ends, so nodes
+        # starting together migrate one at a time
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (SCHEMA_LOCK_ID,))
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT DEFAULT {NOW}
+            )
+        ''')
+
+    def _table_exists(self, conn, name):
+        return conn.execute('SELECT to_regclass(?) AS name', (name,)).fetchone()['name'] is not None
+
+    def create_tables(self, c):
+        """Create the tables, with the same columns as in SQLite."""
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS conversations (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_at TEXT DEFAULT {NOW},
+                updated_at TEXT DEFAULT {NOW},
+                is_archived INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS messages (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                conversation_id BIGINT REFERENCES conversations (id),
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TEXT DEFAULT {NOW},
+                content_hash TEXT,
+                token_count INTEGER
+            )
+        ''')
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS attachments (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                sha256 TEXT NOT NULL UNIQUE,
+                type TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size BIGINT NOT NULL,
+                token_count INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT DEFAULT {NOW}
+            )
+        ''')
+        # Links go with their message, as duplicate cleanup deletes messages directly
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS message_attachments (
+                message_id BIGINT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                attachment_id BIGINT NOT NULL REFERENCES attachments (id),
+                filename TEXT NOT NULL,
+                PRIMARY KEY (message_id, position)
+            )
+        ''')
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                created_at TEXT DEFAULT {NOW}
+            )
+        ''')
+        # Requests outlive deleted conversations, as in SQLite
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS batch_requests (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                job_id BIGINT NOT NULL REFERENCES batch_jobs (id),
+                conversation_id BIGINT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                message_batch_id TEXT,
+                message_id BIGINT,
+                error TEXT,
+                updated_at TEXT DEFAULT {NOW}
+            )
+        ''')
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                conversation_id BIGINT PRIMARY KEY REFERENCES conversations (id),
+                through_message_id BIGINT NOT NULL,
+                content TEXT NOT NULL,
+                token_count INTEGER NOT NULL,
+                created_at TEXT DEFAULT {NOW}
+            )
+        ''')
+
+    def create_indexes(self, c):
+        """Create the indexes used by deduplication, history, list and search queries."""
+        c.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_dedup
+            ON messages (conversation_id, role, content_hash)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_context
+            ON messages (conversation_id, id, token_count)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_conversations_updated
+            ON conversations (is_archived, updated_at DESC, id DESC)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_message_attachments_attachment
+            ON message_attachments (attachment_id)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_batch_requests_status
+            ON batch_requests (status, message_batch_id)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_batch_requests_job
+            ON batch_requests (job_id)
+        ''')
+        # Full-text search matches against these expressions
+        c.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_messages_search
+            ON messages USING GIN (to_tsvector('{TEXT_SEARCH_CONFIG}', content))
+        ''')
+        c.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_conversations_search
+            ON conversations USING GIN (to_tsvector('{TEXT_SEARCH_CONFIG}', title))
+        ''')
+
+    def create_list_version(self, c):
+        """Maintain a version number that changes whenever the conversation list does.
+
+        A statement trigger adds one to a counter row chosen by backend
+        process, and the version is the sum of the rows. The update is
+        part of the writer's transaction, so the version only changes once
+        the change to the list is visible.
+        """
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_list_version (
+                id INTEGER PRIMARY KEY,
+                version BIGINT NOT NULL
+            )
+        ''')
+        c.execute(f'''
+            INSERT INTO conversation_list_version (id, version)
+            SELECT shard, 0 FROM generate_series(0, {LIST_VERSION_SHARDS - 1}) AS shard
+            ON CONFLICT DO NOTHING
+        ''')
+        c.execute(f'''
+            CREATE OR REPLACE FUNCTION bump_conversation_list_version() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                UPDATE conversation_list_version SET version = version + 1
+                WHERE id = pg_backend_pid() % {LIST_VERSION_SHARDS};
+                RETURN NULL;
+            END
+            $$
+        ''')
+        c.execute('DROP TRIGGER IF EXISTS conversations_list_change ON conversations')
+        c.execute('''
+            CREATE TRIGGER conversations_list_change
+            AFTER INSERT OR DELETE OR UPDATE OF title, updated_at, is_archived ON conversations
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_conversation_list_version()
+        ''')
+
+    def create_archive_table(self, c):
+        """Create the table of archived conversations (see archive.py)."""
+        self.archive.create_table(c)
+
+    def _lock_conversation(self, conn, conversation_id):
+        # Only writers to this conversation wait for the row lock
+        return conn.execute(
+            'SELECT is_archived FROM conversations WHERE id = ? FOR UPDATE',
+            (conversation_id,)
+        ).fetchone()
+
+    def _archive_db(self, conn):
+        """The archive is a table of this database, written in the same transaction."""
+        return contextlib.nullcontext(conn)
+
+    def get_conversation_list_version(self):
+        with self.get_db() as conn:
+            row = conn.execute('SELECT COALESCE(SUM(version), 0) AS version FROM conversation_list_version').fetchone()
+            return int(row['version'])
+
+    def search_messages(self, text, limit=20, offset=0):
+        """Full-text search over message content, best matches first.
+
+        As with SQLite, only the newest Config.SEARCH_CANDIDATES matches
+        are ranked. They are scored with ts_rank, normalized by document
+        length; snippets wrap matched terms in SNIPPET_START / SNIPPET_END.
+        """
+        query = ts_query(text)
+        if query is None:
+            return []
+        with self.get_db() as conn:
+            rows = conn.execute(f'''
+                WITH candidates AS (
+                    SELECT id FROM messages
+                    WHERE to_tsvector('{TEXT_SEARCH_CONFIG}', content) @@ to_tsquery('{TEXT_SEARCH_CONFIG}', ?)
+                    ORDER BY id DESC
+                    LIMIT ?
+                ),
+                ranked AS (
+                    SELECT m.id, m.conversation_id, m.role, m.timestamp, m.content, c.title,
+                           ts_rank(to_tsvector('{TEXT_SEARCH_CONFIG}', m.content),
+                                   to_tsquery('{TEXT_SEARCH_CONFIG}', ?), 1) AS score
+                    FROM candidates
+                    JOIN messages m ON m.id = candidates.id
+                    JOIN conversations c ON c.id = m.conversation_id
+                    WHERE c.is_archived = 0
+                    ORDER BY score DESC, m.id DESC
+                    LIMIT ? OFFSET ?
+                )
+                SELECT id AS message_id, conversation_id, title, role, timestamp,
+                       ts_headline('{TEXT_SEARCH_CONFIG}', content, to_tsquery('{TEXT_SEARCH_CONFIG}', ?), ?) AS snippet
+                FROM ranked
+                ORDER BY score DESC, id DESC
+            ''', (
+                query, Config.SEARCH_CANDIDATES, query, limit, offset, query,
+                f'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords=16, MinWords=8'
+            )).fetchall()
+            return [dict(row) for row in rows]
+
+    def search_conversations(self, text, limit=5):
+        query = ts_query(text)
+        if query is None:
+            return []
+        with self.get_db() as conn:
+            rows = conn.execute(f'''
+                WITH candidates AS (
+                    SELECT id FROM conversations
+                    WHERE to_tsvector('{TEXT_SEARCH_CONFIG}', title) @@ to_tsquery('{TEXT_SEARCH_CONFIG}', ?)
+                    ORDER BY id DESC
+                    LIMIT ?
+                )
+                SELECT c.id, c.title, c.updated_at,
+                       ts_headline('{TEXT_SEARCH_CONFIG}', c.title, to_tsquery('{TEXT_SEARCH_CONFIG}', ?), ?) AS snippet
+                FROM candidates
+                JOIN conversations c ON c.id = candidates.id
+                WHERE c.is_archived = 0
+                ORDER BY ts_rank(to_tsvector('{TEXT_SEARCH_CONFIG}', c.title),
+                                 to_tsquery('{TEXT_SEARCH_CONFIG}', ?)) DESC, c.id DESC
+                LIMIT ?
+            ''', (
+                query, Config.SEARCH_CANDIDATES, query,
+                f'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, HighlightAll=true',
+                query, limit
+            )).fetchall()
+            return [dict(row) for row in rows]
+
+    def save_attachment(self, sha256, type, content, size, token_count=0):
+        """Store an attachment unless one with the same hash exists; return its id.
+
+        UTF-8 encoded ``content`` is sent as bytea and decoded by the server.
+        """
+        value = "convert_from(?, 'UTF8')" if isinstance(content, (bytes, bytearray)) else '?'
+        try:
+            with self.get_db() as conn:
+                conn.execute(f'''
+                    INSERT INTO attachments (sha256, type, content, size, token_count)
+                    VALUES (?, ?, {value}, ?, ?)
+                    ON CONFLICT (sha256) DO NOTHING
+                ''', (sha256, type, content, size, token_count))
+                conn.commit()
+                return conn.execute(
+                    'SELECT id FROM attachments WHERE sha256 = ?',
+                    (sha256,)
+                ).fetchone()['id']
+        except Exception as e:
+            logger.error(f"Failed to save attachment: {e}")
+            raise
+
+    def cleanup_duplicate_messages(self):
+        """Backfill missing content hashes and remove any duplicate messages.
+
+        Hashes are computed here rather than in SQL. As with SQLite, this is
+        an offline maintenance job only.
+        """
+        try:
+            with self.get_db() as conn:
+                rows = conn.execute('SELECT id, content FROM messages WHERE content_hash IS NULL').fetchall()
+                conn.executemany(
+                    'UPDATE messages SET content_hash = ? WHERE id = ?',
+                    [(content_hash(row['content']), row['id']) for row in rows]
+                )
+                # Keep the earliest copy of each message
+                conn.execute('''
+                    DELETE FROM messages
+                    WHERE id NOT IN (
+                        SELECT MIN(id)
+                        FROM messages
+                        GROUP BY conversation_id, role, content_hash
+                    )
+                ''')
+                conn.commit()
+                logger.info("Cleaned up duplicate messages")
+        except Exception as e:
+            logger.error(f"Failed to cleanup duplicate messages: {e}")
+
+    def run_maintenance(self):
+        """Run the offline maintenance tasks and refresh the planner statistics."""
+        self.cleanup_database()
+        self.cleanup_duplicate_messages()
+        self.cleanup_attachments()
+        with self.get_db() as conn:
+            conn.execute('ANALYZE')
+            conn.commit()
+        logger.info("Database maintenance completed")
@@ -0,0 +1,159 @@
+"""Opt-in cache of Claude responses for identical requests.
+
+Responses are keyed by a hash of the request parameters that determine the
+output (model, messages, max_tokens, temperature). Lookups go to an
+in-memory LRU first and then, if Config.RESPONSE_CACHE_DB_PATH is set, to a
+SQLite table that is shared between worker processes. Both tiers honour
+Config.RESPONSE_CACHE_TTL.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from database import ConnectionPool
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = counter(
+    'response_cache_requests_total',
+    'Response cache lookups, by tier that answered and result.',
+    ('tier', 'result')
+)
+
+def make_key(params):
+    """Hash the request parameters that determine the response.
+
+    Prompt-cache markers are dropped because they do not change the output.
+    """
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items() if k != 'cache_control'}
+        if isinstance(value, list):
+            return [strip(v) for v in value]
+        return value
+
+    keyed = {
+        'model': params['model'],
+        'messages': strip(params['messages']),
+        'max_tokens': params['max_tokens'],
+        'temperature': params.get('temperature'),
+    }
+    return hashlib.sha256(json.dumps(keyed, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    def __init__(self, max_entries=None, ttl=None, max_entry_bytes=None, db_path=None):
+        self.max_entries = max_entries or Config.RESPONSE_CACHE_MAX_ENTRIES
+        self.ttl = ttl or Config.RESPONSE_CACHE_TTL
+        self.max_entry_bytes = max_entry_bytes or Config.RESPONSE_CACHE_MAX_ENTRY_BYTES
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.pool = None
+        if db_path:
+            self.pool = ConnectionPool(db_path)
+            self._init_db()
+
+    def _init_db(self):
+        conn = self.pool.acquire()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_response_cache_expires 
+                ON response_cache (expires_at)
+            ''')
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+
+    def get(self, params):
+        """Return the cached response text for these parameters, or None."""
+        key = make_key(params)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                CACHE_REQUESTS.inc(tier='memory', result='hit')
+                return entry[1]
+            if entry:
+                del self._entries[key]
+        
+        if self.pool:
+            try:
+                conn = self.pool.acquire()
+                try:
+                    row = conn.execute(
+                        'SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at > ?',
+                        (key, now)
+                    ).fetchone()
+                finally:
+                    self.pool.release(conn)
+                if row:
+                    self._remember(key, row['response'], row['expires_at'])
+                    CACHE_REQUESTS.inc(tier='sqlite', result='hit')
+                    return row['response']
+            except Exception as e:
+                logger.error(f"Response cache lookup failed: {e}")
+        
+        CACHE_REQUESTS.inc(tier='none', result='miss')
+        return None
+
+    def set(self, params, response):
+        """Cache a response, unless it is larger than the per-entry limit."""
+        if len(response.encode('utf-8')) > self.max_entry_bytes:
+            return
+        key = make_key(params)
+        expires_at = time.time() + self.ttl
+        self._remember(key, response, expires_at)
+        
+        if self.pool:
+            try:
+                conn = self.pool.acquire()
+                try:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO response_cache (key, response, expires_at) VALUES (?, ?, ?)',
+                        (key, response, expires_at)
+                    )
+                    self._writes += 1
+                    if self._writes % 100 == 0:
+                        self._prune(conn)
+                    conn.commit()
+                finally:
+                    self.pool.release(conn)
+            except Exception as e:
+                logger.error(f"Response cache write failed: {e}")
+
+    def _remember(self, key, response, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune(self, conn):
+        """Drop expired rows and keep the SQLite tier within max_entries."""
+        conn.execute('DELETE FROM response_cache WHERE expires_at <= ?', (time.time(),))
+        conn.execute('''
+            DELETE FROM response_cache WHERE key IN (
+                SELECT key FROM response_cache 
+                ORDER BY expires_at DESC 
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+
+def cache_bypassed(cache_control_header, cache_field):
+    """Return True if the client asked to skip the response cache for this request."""
+    return 'no-cache' in (cache_control_header or '').lower() or cache_field == '0'
+
+response_cache = ResponseCache(db_path=Config.RESPONSE_CACHE_DB_PATH) if Config.RESPONSE_CACHE_ENABLED else None
@@ -0,0 +1,421 @@
+"""Scheduling for requests to the Messages API.
+
+Every upstream call goes through the shared ``scheduler``, which:
+
+- caps the number of requests in flight (Config.UPSTREAM_MAX_CONCURRENCY),
+  handing free slots to waiting conversations in round-robin order so one
+  busy conversation cannot starve the others;
+- paces requests with token buckets for requests, input tokens and output
+  tokens per minute, mirroring the API's own rate limits;
+- retries rate-limited, overloaded and failed requests with jittered
+  exponential backoff, honouring ``retry-after`` when the API sends it. A
+  ``retry-after`` also pauses every other request until it has passed.
+
+The same scheduler serves the Flask threads and the ASGI event loop, so the
+limits hold across both. Create the Anthropic clients with
+``max_retries=0`` so retries are not applied twice.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from config import Config
+from metrics import counter
+from utils import lazy_import
+
+logger = logging.getLogger(__name__)
+
+# Loaded on first use: only error handling needs it, once a client exists
+anthropic = lazy_import('anthropic')
+
+UPSTREAM_RETRIES = counter(
+    'claude_upstream_retries_total',
+    'Messages API requests retried by the scheduler, by status code.',
+    ('status',)
+)
+
+UPSTREAM_THROTTLE_SECONDS = counter(
+    'claude_upstream_throttle_seconds_total',
+    'Time requests spent waiting on the scheduler rate limits.'
+)
+
+# Mirrors the statuses the Anthropic SDK retries; 529 is "overloaded"
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Retry-after values beyond this are ignored in favour of our own backoff
+MAX_RETRY_AFTER = 60.0
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_minute``.
+
+    Reservations may take the bucket negative; the caller then waits for
+    the returned delay, which keeps reservations in arrival order. A rate
+    of zero disables the bucket.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """Take ``amount`` tokens and return the seconds to wait before using them."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def adjust(self, amount):
+        """Charge (or, if negative, refund) tokens after the fact."""
+        if not self.rate or not amount:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+class _Waiter:
+    __slots__ = ('key', 'granted', 'event', 'future', 'loop')
+
+    def __init__(self, key, loop=None):
+        self.key = key
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.event = None
+            self.future = loop.create_future()
+
+    def wake(self):
+        self.granted = True
+        if self.future is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+class FairSemaphore:
+    """A semaphore that serves waiters round-robin by key.
+
+    Each key (a conversation) has its own FIFO queue, and free slots go to
+    the queues in turn. Both threads and coroutines can wait on it.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._available = limit
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, waiter):
+        with self._lock:
+            if self._available > 0 and not self._queues:
+                self._available -= 1
+                self._granted(waiter.key)
+                return True
+            self._queues.setdefault(waiter.key, deque()).append(waiter)
+            return False
+
+    def _grant_waiting(self):
+        # Called with the lock held
+        while self._available > 0 and self._queues:
+            key, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self._available -= 1
+            self._granted(key)
+            waiter.wake()
+
+    def _granted(self, key):
+        """Called with the lock held each time a slot goes to ``key``; subclasses may record it."""
+
+    def acquire(self, key):
+        waiter = _Waiter(key)
+        if not self._try_acquire(waiter):
+            waiter.event.wait()
+
+    async def acquire_async(self, key):
+        waiter = _Waiter(key, asyncio.get_running_loop())
+        if self._try_acquire(waiter):
+            return
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    queue = self._queues[key]
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[key]
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            self._available += 1
+            self._grant_waiting()
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+def estimate_input_tokens(messages):
+    """Cheap upper-bound estimate of a request's input tokens.
+
+    Used only to pace requests; the estimate is corrected from the reported
+    usage once the response arrives.
+    """
+    total = 0
+    for message in messages:
+        content = message['content']
+        if isinstance(content, str):
+            total += len(content) // 4 + 1
+            continue
+        for block in content:
+            if block.get('type') == 'image':
+                total += 1600  # Largest image the API bills after resizing
+            else:
+                total += len(block.get('text', '')) // 4 + 1
+    return total
+
+def parse_retry_after(headers):
+    """Seconds to wait according to ``retry-after-ms`` / ``retry-after``, or None."""
+    if headers is None:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value is not None:
+            return float(value) / 1000
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+def retry_status(error):
+    """The status to retry ``error`` under, or None if it should not be retried."""
+    if isinstance(error, anthropic.APIConnectionError):
+        return 'connection'
+    if isinstance(error, anthropic.APIStatusError) and error.status_code in RETRYABLE_STATUSES:
+        return str(error.status_code)
+    return None
+
+class UpstreamScheduler:
+    def __init__(self, max_concurrency=None, requests_per_minute=None,
+                 input_tokens_per_minute=None, output_tokens_per_minute=None,
+                 max_retries=None, backoff_base=None, backoff_max=None):
+        def setting(value, default):
+            return default if value is None else value
+
+        self.slots = FairSemaphore(setting(max_concurrency, Config.UPSTREAM_MAX_CONCURRENCY))
+        self.requests = TokenBucket(setting(requests_per_minute, Config.UPSTREAM_REQUESTS_PER_MINUTE))
+        self.input_tokens = TokenBucket(
+            setting(input_tokens_per_minute, Config.UPSTREAM_INPUT_TOKENS_PER_MINUTE)
+        )
+        self.output_tokens = TokenBucket(
+            setting(output_tokens_per_minute, Config.UPSTREAM_OUTPUT_TOKENS_PER_MINUTE)
+        )
+        self.max_retries = setting(max_retries, Config.UPSTREAM_MAX_RETRIES)
+        self.backoff_base = setting(backoff_base, Config.UPSTREAM_BACKOFF_BASE)
+        self.backoff_max = setting(backoff_max, Config.UPSTREAM_BACKOFF_MAX)
+        self._paused_until = 0.0
+
+    def _admission_delay(self, estimated_input):
+        """Reserve rate-limit capacity for one request and return how long to wait."""
+        delay = max(
+            self.requests.reserve(1),
+            self.input_tokens.reserve(estimated_input),
+            # Output is charged once known; wait only while the bucket is in debt
+            self.output_tokens.reserve(0),
+            self._paused_until - time.monotonic(),
+        )
+        if delay > 0:
+            UPSTREAM_THROTTLE_SECONDS.inc(delay)
+        return max(0.0, delay)
+
+    def _record_usage(self, estimated_input, usage):
+        if usage is None:
+            return
+        actual_input = (getattr(usage, 'input_tokens', 0) or 0) + \
+            (getattr(usage, 'cache_creation_input_tokens', 0) or 0)
+        self.input_tokens.adjust(actual_input - estimated_input)
+        self.output_tokens.adjust(getattr(usage, 'output_tokens', 0) or 0)
+
+    def _backoff(self, error, attempt):
+        """Return the delay before retrying ``error``, or None to give up."""
+        status = retry_status(error)
+        if status is None or attempt >= self.max_retries:
+            return None
+        UPSTREAM_RETRIES.inc(status=status)
+
+        retry_after = parse_retry_after(getattr(getattr(error, 'response', None), 'headers', None))
+        if retry_after is not None and 0 <= retry_after <= MAX_RETRY_AFTER:
+            # The API told every client when to come back; hold the others too
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        else:
+            # Full jitter
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        logger.warning(f"Messages API returned {status}; retry {attempt + 1} in {delay:.2f}s")
+        return delay
+
+    @contextmanager
+    def _slot(self, key, estimated_input):
+        self.slots.acquire(key)
+        try:
+            delay = self._admission_delay(estimated_input)
+            if delay:
+                time.sleep(delay)
+            yield
+        finally:
+            self.slots.release()
+
+    @asynccontextmanager
+    async def _async_slot(self, key, estimated_input):
+        await self.slots.acquire_async(key)
+        try:
+            delay = self._admission_delay(estimated_input)
+            if delay:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            self.slots.release()
+
+    def create(self, client, params, key=None):
+        """``client.messages.create(**params)`` under the scheduler's limits."""
+        estimated_input = estimate_input_tokens(params['messages'])
+        attempt = 0
+        while True:
+            try:
+                with self._slot(key, estimated_input):
+                    response = client.messages.create(**params)
+                self._record_usage(estimated_input, response.usage)
+                return response
+            except anthropic.APIError as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            time.sleep(delay)
+
+    def call(self, func, *args, key=None, **kwargs):
+        """``func(*args, **kwargs)`` for other API calls, e.g. to the Message Batches API.
+
+        The call takes a slot and a request from the request bucket and is
+        retried like :meth:`create`; it is not charged any tokens.
+        """
+        attempt = 0
+        while True:
+            try:
+                with self._slot(key, 0):
+                    return func(*args, **kwargs)
+            except anthropic.APIError as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            time.sleep(delay)
+
+    async def create_async(self, client, params, key=None):
+        """Async counterpart of :meth:`create` for an ``AsyncAnthropic`` client."""
+        estimated_input = estimate_input_tokens(params['messages'])
+        attempt = 0
+        while True:
+            try:
+                async with self._async_slot(key, estimated_input):
+                    response = await client.messages.create(**params)
+                self._record_usage(estimated_input, response.usage)
+                return response
+            except anthropic.APIError as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @contextmanager
+    def stream(self, client, params, key=None):
+        """``client.messages.stream(**params)`` under the scheduler's limits.
+
+        Opening the stream is retried; once events are flowing, errors are
+        raised to the caller. The slot is held until the stream is closed.
+        """
+        estimated_input = estimate_input_tokens(params['messages'])
+        attempt = 0
+        while True:
+            with self._slot(key, estimated_input):
+                manager = client.messages.stream(**params)
+                try:
+                    stream = manager.__enter__()
+                except anthropic.APIError as e:
+                    delay = self._backoff(e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    try:
+                        yield stream
+                    finally:
+                        manager.__exit__(None, None, None)
+                        self._record_usage(estimated_input, stream_usage(stream))
+                    return
+            attempt += 1
+            time.sleep(delay)
+
+    @asynccontextmanager
+    async def stream_async(self, client, params, key=None):
+        """Async counterpart of :meth:`stream` for an ``AsyncAnthropic`` client."""
+        estimated_input = estimate_input_tokens(params['messages'])
+        attempt = 0
+        while True:
+            async with self._async_slot(key, estimated_input):
+                manager = client.messages.stream(**params)
+                try:
+                    stream = await manager.__aenter__()
+                except anthropic.APIError as e:
+                    delay = self._backoff(e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    try:
+                        yield stream
+                    finally:
+                        await manager.__aexit__(None, None, None)
+                        self._record_usage(estimated_input, stream_usage(stream))
+                    return
+            attempt += 1
+            await asyncio.sleep(delay)
+
+def stream_usage(stream):
+    """Usage seen on a (possibly unfinished) message stream, or None."""
+    try:
+        return stream.current_message_snapshot.usage
+    except Exception:
+        return None
+
+scheduler = UpstreamScheduler()
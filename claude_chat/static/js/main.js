@@ -2,6 +2,21 @@
 let currentConversationId = null;
 let isProcessing = false;
 let attachments = [];
+let oldestMessageId = null;
+let hasOlderMessages = false;
+let isLoadingOlderMessages = false;
+let conversationsCursor = null;
+let conversationsEtag = null;
+let isLoadingConversations = false;
+let conversationsLoaded = false;
+
+let searchQuery = '';
+let searchOffset = null;
+let isSearching = false;
+let searchTimer = null;
+
+const CONVERSATIONS_PAGE_SIZE = 50;
+const SEARCH_DEBOUNCE_MS = 200;
 
 // Initialize when document is ready
 document.addEventListener('DOMContentLoaded', () => {
@@ -10,8 +25,30 @@ document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('clear-chat').addEventListener('click', clearChat);
     
     setupTextareaHandlers();
-    setupConversationHandlers();
     setupFileInput();
+    setupSearch();
+    
+    // Load more conversations when the sidebar is scrolled to the bottom
+    const conversationsList = document.getElementById('conversations-list');
+    conversationsList.addEventListener('scroll', () => {
+        if (conversationsList.scrollTop + conversationsList.clientHeight >= conversationsList.scrollHeight - 100) {
+            loadMoreConversations();
+        }
+    });
+    
+    // Pick up changes made in other tabs; unchanged lists come back as 304
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'visible') {
+            refreshConversations();
+        }
+    });
+    
+    // Load older messages when scrolled to the top of the conversation
+    document.getElementById('messages').addEventListener('scroll', (e) => {
+        if (e.target.scrollTop < 50) {
+            loadOlderMessages();
+        }
+    });
 
     // Configure marked options for markdown
     marked.setOptions({
@@ -25,36 +62,8 @@ document.addEventListener('DOMContentLoaded', () => {
         gfm: true
     });
 
-    // Set up handlers for existing conversations
-    document.querySelectorAll('.conversation-item').forEach(item => {
-        const conversationId = parseInt(item.dataset.id);
-        
-        // Add click handler for the conversation
-        item.addEventListener('click', () => loadConversation(conversationId));
-        
-        // Add click handlers for buttons
-        const editBtn = item.querySelector('.edit-conversation');
-        if (editBtn) {
-            editBtn.addEventListener('click', (e) => {
-                e.stopPropagation();
-                editConversationTitle(conversationId);
-            });
-        }
-        
-        const deleteBtn = item.querySelector('.delete-conversation');
-        if (deleteBtn) {
-            deleteBtn.addEventListener('click', (e) => {
-                e.stopPropagation();
-                deleteConversation(conversationId);
-            });
-        }
-    });
-
-    // Load the first conversation if it exists
-    const firstConversation = document.querySelector('.conversation-item');
-    if (firstConversation) {
-        loadConversation(parseInt(firstConversation.dataset.id));
-    }
+    // The page is served without the conversation list; fetch it now
+    loadConversationsList();
 });
 
 // Setup handlers for textarea
@@ -74,45 +83,6 @@ function setupTextareaHandlers() {
     });
 }
 
-function setupConversationHandlers() {
-    document.querySelectorAll('.conversation-item').forEach(item => {
-        const conversationId = parseInt(item.dataset.id);
-        
-        // Remove existing listeners
-        const newItem = item.cloneNode(true);
-        item.parentNode.replaceChild(newItem, item);
-        
-        // Add conversation click handler
-        newItem.addEventListener('click', (e) => {
-            e.preventDefault();
-            e.stopPropagation();
-            loadConversation(conversationId);
-        });
-        
-        // Add delete button handler
-        const deleteBtn = newItem.querySelector('.delete-conversation');
-        if (deleteBtn) {
-            deleteBtn.addEventListener('click', async (e) => {
-                e.preventDefault();
-                e.stopPropagation();
-                await deleteConversation(conversationId);
-            });
-        }
-        
-        // Add edit button handler
-        const editBtn = newItem.querySelector('.edit-conversation');
-        if (editBtn) {
-            editBtn.addEventListener('click', (e) => {
-                e.preventDefault();
-                e.stopPropagation();
-                editConversationTitle(conversationId);
-            });
-        }
-    });
-}
-
-
-
 async function loadConversation(conversationId) {
     try {
         // Clear current messages
@@ -122,13 +92,15 @@ async function loadConversation(conversationId) {
         currentConversationId = conversationId;
         setActiveConversation(conversationId);
         
-        // Fetch conversation messages
-        const response = await fetch(`/conversation/${conversationId}`);
+        // Fetch the newest page of conversation messages
+        const response = await fetch(`/conversation/${conversationId}?limit=${MESSAGES_PAGE_SIZE}`);
         if (!response.ok) {
             throw new Error('Failed to load conversation');
         }
         
         const messages = await response.json();
+        oldestMessageId = messages.length > 0 ? messages[0].id : null;
+        hasOlderMessages = messages.length === MESSAGES_PAGE_SIZE;
         
         // Clear messages again (in case any were added while fetching)
         document.getElementById('messages').innerHTML = '';
@@ -141,7 +113,7 @@ async function loadConversation(conversationId) {
         
         // Display each message
         messages.forEach(message => {
-            showMessage(message.content, message.role);
+            showMessage(formatStoredMessage(message), message.role);
         });
         
         // Update conversation title
@@ -156,6 +128,60 @@ async function loadConversation(conversationId) {
     }
 }
 
+// Prepend the previous page of messages for the current conversation
+async function loadOlderMessages() {
+    if (!hasOlderMessages || isLoadingOlderMessages || !currentConversationId) return;
+
+    const conversationId = currentConversationId;
+    isLoadingOlderMessages = true;
+    try {
+        const response = await fetch(
+            `/conversation/${conversationId}?limit=${MESSAGES_PAGE_SIZE}&before_id=${oldestMessageId}`
+        );
+        if (!response.ok) {
+            throw new Error('Failed to load older messages');
+        }
+
+        const messages = await response.json();
+        
+        // Ignore the page if the user switched conversations meanwhile
+        if (conversationId !== currentConversationId) return;
+
+        const messagesDiv = document.getElementById('messages');
+        const firstExisting = messagesDiv.firstChild;
+        const previousHeight = messagesDiv.scrollHeight;
+        const previousTop = messagesDiv.scrollTop;
+
+        messages.forEach(message => {
+            const messageDiv = showMessage(formatStoredMessage(message), message.role);
+            messagesDiv.insertBefore(messageDiv, firstExisting);
+        });
+
+        // Keep the viewport anchored on the messages that were already shown
+        messagesDiv.scrollTop = previousTop + (messagesDiv.scrollHeight - previousHeight);
+
+        if (messages.length > 0) {
+            oldestMessageId = messages[0].id;
+        }
+        hasOlderMessages = messages.length === MESSAGES_PAGE_SIZE;
+    } catch (error) {
+        console.error('Error loading older messages:', error);
+        displayError('Failed to load older messages');
+    } finally {
+        isLoadingOlderMessages = false;
+    }
+}
+
+// Render a stored message, linking its attachments instead of inlining them
+function formatStoredMessage(message) {
+    let content = message.content;
+    if (message.attachments && message.attachments.length > 0) {
+        content += '\n\nAttachments:\n' + 
+            message.attachments.map(a => `- [${a.filename}](/attachment/${a.id})`).join('\n');
+    }
+    return content;
+}
+
 // Set active conversation
 function setActiveConversation(id) {
     document.querySelectorAll('.conversation-item').forEach(item => {
@@ -163,16 +189,206 @@ function setActiveConversation(id) {
     });
 }
 
+// Search conversations as the user types
+function setupSearch() {
+    const input = document.getElementById('search-input');
+    const results = document.getElementById('search-results');
+    
+    input.addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => startSearch(input.value.trim()), SEARCH_DEBOUNCE_MS);
+    });
+    input.addEventListener('keydown', (e) => {
+        if (e.key === 'Escape') {
+            input.value = '';
+            startSearch('');
+        }
+    });
+    results.addEventListener('scroll', () => {
+        if (results.scrollTop + results.clientHeight >= results.scrollHeight - 100) {
+            loadSearchResults();
+        }
+    });
+}
+
+function startSearch(query) {
+    const results = document.getElementById('search-results');
+    const conversationsList = document.getElementById('conversations-list');
+    
+    searchQuery = query;
+    results.innerHTML = '';
+    results.hidden = !query;
+    conversationsList.hidden = !!query;
+    searchOffset = query ? 0 : null;
+    if (query) {
+        loadSearchResults();
+    }
+}
+
+// Fetch the next page of search results
+async function loadSearchResults() {
+    if (searchOffset === null || isSearching) return;
+    
+    const query = searchQuery;
+    isSearching = true;
+    try {
+        const params = new URLSearchParams({ q: query, offset: searchOffset });
+        const response = await fetch(`/search?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        
+        // Ignore the page if the query changed meanwhile
+        if (query !== searchQuery) return;
+        
+        const results = document.getElementById('search-results');
+        data.conversations.forEach(conversation => {
+            results.appendChild(createSearchResult(conversation.id, conversation.snippet, ''));
+        });
+        data.messages.forEach(message => {
+            results.appendChild(createSearchResult(message.conversation_id, null, message.snippet, message.title));
+        });
+        if (searchOffset === 0 && !results.children.length) {
+            results.innerHTML = '<div class="search-empty">No matches</div>';
+        }
+        searchOffset = data.next_offset;
+    } catch (error) {
+        console.error('Error searching conversations:', error);
+    } finally {
+        isSearching = false;
+        // The query may have changed while this page was loading
+        if (query !== searchQuery && searchOffset !== null) {
+            loadSearchResults();
+        }
+    }
+}
+
+// Snippets are HTML from the server, escaped except for the <mark> tags
+function createSearchResult(conversationId, titleHtml, snippetHtml, title) {
+    const div = document.createElement('div');
+    div.className = 'search-result';
+    div.innerHTML = `
+        <div class="search-result-title"></div>
+        <div class="search-result-snippet"></div>
+    `;
+    const titleDiv = div.querySelector('.search-result-title');
+    if (titleHtml !== null) {
+        titleDiv.innerHTML = titleHtml;
+    } else {
+        titleDiv.textContent = title;
+    }
+    div.querySelector('.search-result-snippet').innerHTML = snippetHtml;
+    
+    div.addEventListener('click', () => {
+        document.getElementById('search-input').value = '';
+        startSearch('');
+        loadConversation(conversationId);
+    });
+    return div;
+}
+
+// Load the next page of conversations into the sidebar
+async function loadMoreConversations() {
+    if (!conversationsCursor || isLoadingConversations) return;
+    
+    isLoadingConversations = true;
+    try {
+        const params = new URLSearchParams({ limit: CONVERSATIONS_PAGE_SIZE, cursor: conversationsCursor });
+        const response = await fetch(`/conversations?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        
+        const conversationsList = document.getElementById('conversations-list');
+        data.conversations.forEach(conversation => {
+            if (!document.querySelector(`.conversation-item[data-id="${conversation.id}"]`)) {
+                conversationsList.appendChild(createConversationItem(conversation.id, conversation.title));
+            }
+        });
+        conversationsCursor = data.next_cursor;
+    } catch (error) {
+        console.error('Error loading conversations:', error);
+    } finally {
+        isLoadingConversations = false;
+    }
+}
+
+// Fetch the first page of the sidebar, then open the most recent conversation
+async function loadConversationsList() {
+    await refreshConversations();
+    await fillConversationsList();
+    
+    const firstConversation = document.querySelector('.conversation-item');
+    if (firstConversation && !currentConversationId) {
+        loadConversation(parseInt(firstConversation.dataset.id));
+    }
+}
+
+// Keep loading pages until the sidebar can scroll, so the scroll handler can take over
+async function fillConversationsList() {
+    const conversationsList = document.getElementById('conversations-list');
+    while (conversationsCursor && conversationsList.scrollHeight <= conversationsList.clientHeight) {
+        const cursor = conversationsCursor;
+        await loadMoreConversations();
+        if (conversationsCursor === cursor) break;
+    }
+}
+
+// Re-fetch the first page and move updated conversations to the top
+async function refreshConversations() {
+    try {
+        const headers = conversationsEtag ? { 'If-None-Match': conversationsEtag } : {};
+        const response = await fetch(`/conversations?limit=${CONVERSATIONS_PAGE_SIZE}`, {
+            headers,
+            cache: 'no-store'
+        });
+        if (response.status === 304) return;
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        conversationsEtag = response.headers.get('ETag');
+        const data = await response.json();
+        // Later pages continue from the first one fetched
+        if (!conversationsLoaded) {
+            conversationsCursor = data.next_cursor;
+            conversationsLoaded = true;
+        }
+        
+        const conversationsList = document.getElementById('conversations-list');
+        data.conversations.slice().reverse().forEach(conversation => {
+            let item = document.querySelector(`.conversation-item[data-id="${conversation.id}"]`);
+            if (item) {
+                item.querySelector('.conversation-title').textContent = conversation.title;
+            } else {
+                item = createConversationItem(conversation.id, conversation.title);
+            }
+            conversationsList.insertBefore(item, conversationsList.firstChild);
+        });
+        if (currentConversationId) {
+            setActiveConversation(currentConversationId);
+        }
+    } catch (error) {
+        console.error('Error refreshing conversations:', error);
+    }
+}
+
 // Add conversation to sidebar list
 function addConversationToList(id, title) {
     const conversationsList = document.getElementById('conversations-list');
-    
+    conversationsList.insertBefore(createConversationItem(id, title), conversationsList.firstChild);
+    setActiveConversation(id);
+}
+
+// Build a sidebar entry with its click handlers
+function createConversationItem(id, title) {
     const div = document.createElement('div');
     div.className = 'conversation-item';
     div.dataset.id = id;
     
     div.innerHTML = `
-        <span class="conversation-title">${title}</span>
+        <span class="conversation-title"></span>
         <div class="conversation-actions">
             <button class="edit-conversation" data-id="${id}">
                 <i class="fas fa-edit"></i>
@@ -183,6 +399,8 @@ function addConversationToList(id, title) {
         </div>
     `;
     
+    div.querySelector('.conversation-title').textContent = title;
+    
     // Add click handler for loading conversation
     div.addEventListener('click', () => loadConversation(id));
     
@@ -204,8 +422,7 @@ function addConversationToList(id, title) {
         });
     }
     
-    conversationsList.insertBefore(div, conversationsList.firstChild);
-    setActiveConversation(id);
+    return div;
 }
 
 // Edit conversation title
@@ -400,6 +617,7 @@ async function sendMessage() {
     
     if (!message && attachments.length === 0) return;
 
+    let loadingDiv = null;
     try {
         isProcessing = true;
         input.value = '';
@@ -429,37 +647,94 @@ async function sendMessage() {
         attachments = [];
         
         // Show loading indicator
-        const loadingDiv = createLoadingIndicator();
+        loadingDiv = createLoadingIndicator();
         document.getElementById('messages').appendChild(loadingDiv);
 
-        const response = await fetch('/chat', {
+        const response = await fetch('/chat/stream', {
             method: 'POST',
             body: formData
         });
 
-        const data = await response.json();
-        loadingDiv.remove();
-
-        if (data.error) {
-            throw new Error(data.error);
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error || `HTTP error! status: ${response.status}`);
         }
 
-        // Update conversation ID if this is a new conversation
-        if (!currentConversationId) {
-            currentConversationId = data.conversation_id;
-            // Reload the conversations list to show the new conversation
-            window.location.reload();
-        }
+        let assistantDiv = null;
+        let assistantContent = '';
+        const isNewConversation = !currentConversationId;
 
-        showMessage(data.response, 'assistant');
+        await readEventStream(response, (event, data) => {
+            if (event === 'start') {
+                if (!currentConversationId) {
+                    currentConversationId = data.conversation_id;
+                }
+            } else if (event === 'delta') {
+                if (!assistantDiv) {
+                    loadingDiv.remove();
+                    assistantDiv = showMessage('', 'assistant');
+                }
+                assistantContent += data.text;
+                updateMessage(assistantDiv, assistantContent);
+            } else if (event === 'error') {
+                throw new Error(data.error);
+            }
+        });
+
+        // Show the new conversation, or move this one to the top of the list
+        await refreshConversations();
+        const newConversation = document.querySelector(`.conversation-item[data-id="${currentConversationId}"]`);
+        if (isNewConversation && newConversation) {
+            document.getElementById('current-chat-title').textContent =
+                newConversation.querySelector('.conversation-title').textContent;
+        }
         
     } catch (error) {
         displayError(error.message);
     } finally {
+        // Also covers an error event that arrives before any text
+        if (loadingDiv) {
+            loadingDiv.remove();
+        }
         isProcessing = false;
     }
 }
 
+// Read a server-sent event stream from a fetch response
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+
+            if (data) {
+                onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+}
+
 // Create new conversation
 async function createNewConversation() {
     try {
@@ -504,6 +779,20 @@ function showMessage(content, role) {
     const contentDiv = document.createElement('div');
     contentDiv.className = 'message-content';
     
+    messageDiv.appendChild(iconDiv);
+    messageDiv.appendChild(contentDiv);
+    messagesDiv.appendChild(messageDiv);
+    
+    updateMessage(messageDiv, content);
+    
+    return messageDiv;
+}
+
+// Render (or re-render) the markdown content of a message
+function updateMessage(messageDiv, content) {
+    const messagesDiv = document.getElementById('messages');
+    const contentDiv = messageDiv.querySelector('.message-content');
+    
     // Render markdown content
     contentDiv.innerHTML = marked.parse(content);
     
@@ -523,12 +812,8 @@ function showMessage(content, role) {
         pre.appendChild(copyButton);
     });
     
-    messageDiv.appendChild(iconDiv);
-    messageDiv.appendChild(contentDiv);
-    messagesDiv.appendChild(messageDiv);
-    
     // Initialize syntax highlighting
-    messageDiv.querySelectorAll('pre code').forEach((block) => {
+    contentDiv.querySelectorAll('pre code').forEach((block) => {
         hljs.highlightBlock(block);
     });
     
@@ -563,7 +848,10 @@ function clearChat() {
     document.getElementById('messages').innerHTML = '';
     document.getElementById('attachment-preview').innerHTML = '';
     attachments = [];
+    oldestMessageId = null;
+    hasOlderMessages = false;
 }
 
 // Constants
-const MAX_FILE_SIZE = 10 * 1024 * 1024; // 10MB
\ No newline at end of file
+const MAX_FILE_SIZE = 10 * 1024 * 1024; // 10MB
+const MESSAGES_PAGE_SIZE = 50;
\ No newline at end of file
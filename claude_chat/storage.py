@@ -0,0 +1,329 @@
+"""Storage backend interface shared by the SQLite and PostgreSQL databases.
+
+StorageBackend lists every operation the app, the workers and the
+maintenance jobs perform on the database. Database (SQLite, database.py)
+and PostgresDatabase (postgres_database.py) implement it; database.db is
+the instance selected by Config.DATABASE_URL.
+"""
+import hashlib
+import logging
+import os
+import queue
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ConversationNotFoundError(Exception):
+    """Raised when writing to a conversation that does not exist."""
+
+def content_hash(content, attachment_hashes=()):
+    """Return the SHA-256 hex digest used to deduplicate message content.
+
+    Attachment hashes are folded in so the same text sent with different
+    files is not treated as a duplicate.
+    """
+    digest = hashlib.sha256(content.encode('utf-8'))
+    for attachment_hash in attachment_hashes:
+        digest.update(b'\0' + attachment_hash.encode('ascii'))
+    return digest.hexdigest()
+
+class ConnectionPool(ABC):
+    """Bounded, thread-safe pool of long-lived database connections.
+
+    Connections are opened lazily (up to ``max_size``) by ``_connect`` and
+    then reused across requests. The pool is reset in forked child
+    processes, since connections must not be shared across a fork.
+    Subclasses set ``error`` to their driver's base exception class.
+    """
+
+    error = Exception
+
+    def __init__(self, max_size=None, timeout=None):
+        self.max_size = max_size or Config.DB_POOL_SIZE
+        self.timeout = timeout or Config.DB_BUSY_TIMEOUT
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pool = queue.LifoQueue(maxsize=self.max_size)
+        self._size = 0
+        self._pid = os.getpid()
+
+    @abstractmethod
+    def _connect(self):
+        """Open and configure a new connection."""
+
+    def _timeout_error(self):
+        return self.error("Timed out waiting for a database connection")
+
+    def acquire(self):
+        """Take a connection from the pool, opening a new one if below capacity."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            pool = self._pool
+            create = pool.empty() and self._size < self.max_size
+            if create:
+                self._size += 1
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+
+        try:
+            return pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise self._timeout_error()
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except self.error as e:
+            logger.error(f"Discarding broken database connection: {e}")
+            self.discard(conn)
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._pool.put_nowait(conn)
+
+    def discard(self, conn):
+        """Close a connection and free its slot in the pool."""
+        try:
+            conn.close()
+        except self.error:
+            pass
+        with self._lock:
+            if self._pid == os.getpid():
+                self._size -= 1
+
+    def close_all(self):
+        """Close every idle connection in the pool."""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+class StorageBackend(ABC):
+    """Everything the app stores: conversations, messages, attachments,
+    summaries and bulk jobs.
+
+    Implementations provide ``pool``, a ConnectionPool whose connections
+    follow the sqlite3 interface (``execute``, ``cursor``, ``commit``,
+    rows readable by column name), and the methods below. The conversation
+    existence cache is shared by all of them.
+    """
+
+    def __init__(self):
+        # LRU of conversation id -> whether it exists and is not archived
+        self._conversation_cache = OrderedDict()
+        self._conversation_cache_lock = threading.Lock()
+
+    @contextmanager
+    def get_db(self):
+        conn = self.pool.acquire()
+        try:
+            yield conn
+        except Exception as e:
+            logger.error(f"Database connection error: {e}")
+            raise
+        finally:
+            self.pool.release(conn)
+
+    # Schema and maintenance
+
+    @abstractmethod
+    def init_db(self):
+        """Create or migrate the schema."""
+
+    @abstractmethod
+    def cleanup_database(self):
+        """Delete rows that belong to conversations that no longer exist."""
+
+    @abstractmethod
+    def cleanup_duplicate_messages(self):
+        """Backfill missing content hashes and remove duplicate messages."""
+
+    @abstractmethod
+    def cleanup_attachments(self):
+        """Delete attachments and attachment links that nothing references."""
+
+    @abstractmethod
+    def run_maintenance(self):
+        """Run the offline maintenance tasks (see maintenance.py)."""
+
+    # Conversations
+
+    @abstractmethod
+    def get_conversations(self, limit=None, after=None, archived=False):
+        """Return active (or, with ``archived``, archived) conversations
+        (id, title, updated_at), most recently updated first.
+
+        ``after`` is the ``(updated_at, id)`` of the last conversation of
+        the previous page.
+        """
+
+    @abstractmethod
+    def get_conversation_list_version(self):
+        """Return a number that changes whenever the conversation list does."""
+
+    @abstractmethod
+    def get_conversation(self, conversation_id):
+        """Return a conversation by id, or None."""
+
+    @abstractmethod
+    def create_conversation(self, title):
+        """Create a conversation and return its id."""
+
+    @abstractmethod
+    def update_conversation_title(self, conversation_id, title):
+        """Rename a conversation."""
+
+    @abstractmethod
+    def delete_conversation(self, conversation_id):
+        """Delete a conversation with everything stored for it; return True on success."""
+
+    def conversation_exists(self, conversation_id):
+        """Return True if the conversation exists and is not archived.
+
+        Results are kept in a small per-process LRU cache that is updated on
+        create and invalidated on delete. Writes still verify existence
+        inside their own transaction, so a stale entry cannot attach
+        messages to a deleted conversation.
+        """
+        with self._conversation_cache_lock:
+            if conversation_id in self._conversation_cache:
+                self._conversation_cache.move_to_end(conversation_id)
+                return self._conversation_cache[conversation_id]
+
+        conv = self.get_conversation(conversation_id)
+        exists = bool(conv) and not conv['is_archived']
+        self._cache_conversation(conversation_id, exists)
+        return exists
+
+    def _cache_conversation(self, conversation_id, exists):
+        with self._conversation_cache_lock:
+            self._conversation_cache[conversation_id] = exists
+            self._conversation_cache.move_to_end(conversation_id)
+            while len(self._conversation_cache) > Config.CONVERSATION_CACHE_SIZE:
+                self._conversation_cache.popitem(last=False)
+
+    def invalidate_conversation(self, conversation_id):
+        """Drop a conversation from the existence cache."""
+        with self._conversation_cache_lock:
+            self._conversation_cache.pop(conversation_id, None)
+
+    def open_conversation(self, conversation_id):
+        """Return True if the conversation exists, restoring it first if it is archived."""
+        return self.conversation_exists(conversation_id) or self.restore_conversation(conversation_id)
+
+    # Archive tiering (see archive.py)
+
+    @abstractmethod
+    def archive_conversation(self, conversation_id):
+        """Move a conversation's messages to the archive store; return True if it is archived.
+
+        Returns False if it cannot be archived now, and raises
+        ConversationNotFoundError if it does not exist.
+        """
+
+    @abstractmethod
+    def restore_conversation(self, conversation_id):
+        """Move an archived conversation back; return True if it exists and is active."""
+
+    @abstractmethod
+    def get_archive_candidates(self, idle_since, limit=100):
+        """Return ids of active conversations not updated since ``idle_since``, least recent first."""
+
+    # Messages
+
+    @abstractmethod
+    def get_conversation_messages(self, conversation_id, before_id=None, limit=None):
+        """Return a conversation's messages, oldest first, with attachment metadata."""
+
+    @abstractmethod
+    def get_context(self, conversation_id, max_tokens):
+        """Return a conversation's summary (or None) and the newest messages that fit in max_tokens."""
+
+    @abstractmethod
+    def add_message(self, conversation_id, role, content, token_count=None, attachments=()):
+        """Add a message; raise ConversationNotFoundError if the conversation does not exist."""
+
+    @abstractmethod
+    def add_messages(self, messages):
+        """Add many text messages in one transaction; return their ids (None if skipped)."""
+
+    @abstractmethod
+    def search_messages(self, text, limit=20, offset=0):
+        """Full-text search over message content, best matches first."""
+
+    @abstractmethod
+    def search_conversations(self, text, limit=5):
+        """Full-text search over conversation titles, best matches first."""
+
+    # Attachments
+
+    @abstractmethod
+    def get_attachment(self, attachment_id):
+        """Return a stored attachment, including its content, or None."""
+
+    @abstractmethod
+    def get_attachment_by_hash(self, sha256):
+        """Return a stored attachment's metadata by the SHA-256 of its uploaded bytes, or None."""
+
+    @abstractmethod
+    def save_attachment(self, sha256, type, content, size, token_count=0):
+        """Store an attachment unless one with the same hash exists; return its id."""
+
+    # Compaction
+
+    @abstractmethod
+    def get_compaction_candidates(self, min_tokens, limit=100):
+        """Return ids of conversations with more than min_tokens of unsummarized messages."""
+
+    @abstractmethod
+    def get_messages_to_compact(self, conversation_id, keep_tokens, max_tokens):
+        """Return a conversation's summary and the oldest messages it does not cover yet."""
+
+    @abstractmethod
+    def save_summary(self, conversation_id, through_message_id, content, token_count):
+        """Store a summary covering messages up to through_message_id; return True if stored."""
+
+    # Bulk jobs
+
+    @abstractmethod
+    def create_batch_job(self, requests):
+        """Queue a bulk job; return its id and each request's id and conversation id."""
+
+    @abstractmethod
+    def get_batch_job(self, job_id):
+        """Return a job's requests and a count per status, or None."""
+
+    @abstractmethod
+    def get_pending_batch_requests(self, limit):
+        """Return up to ``limit`` requests that have not been submitted yet, oldest first."""
+
+    @abstractmethod
+    def mark_batch_requests_submitted(self, request_ids, message_batch_id):
+        """Record that requests were submitted as a Message Batch."""
+
+    @abstractmethod
+    def get_submitted_batches(self):
+        """Return the ids of Message Batches that still have unfinished requests."""
+
+    @abstractmethod
+    def complete_batch_requests(self, message_batch_id, results):
+        """Write back the results of a finished Message Batch; return the messages added."""
@@ -0,0 +1,220 @@
+"""Bounded-memory handling of uploaded attachments.
+
+Uploads are measured, hashed and sniffed while they are received, so an
+oversized file is rejected as soon as it crosses the limit instead of after
+it has been buffered, and all the attachments in one request share a byte
+budget. File bodies are spooled to disk past Config.UPLOAD_SPOOL_SIZE, and
+text is transcoded to UTF-8 in chunks with an incremental decoder, so a
+text attachment is never held in memory as one Python string.
+
+The type and encoding of a file are sniffed from its first bytes rather
+than trusted from its extension.
+"""
+import codecs
+import hashlib
+from tempfile import SpooledTemporaryFile
+from config import Config
+from utils import estimate_tokens
+
+# Bytes kept from the start of each upload for sniffing
+SNIFF_BYTES = 8192
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+
+# DIB header sizes of the BMP variants, BITMAPCOREHEADER to BITMAPV5HEADER
+BMP_DIB_HEADER_SIZES = frozenset((12, 16, 40, 52, 56, 64, 108, 124))
+
+# UTF-32 first: its little-endian BOM starts with the UTF-16 one
+TEXT_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Control characters that are common in text files
+TEXT_CONTROL_BYTES = frozenset(b'\t\n\r\f\b\x1b')
+
+# Share of other control bytes above which 8-bit data is treated as binary
+MAX_CONTROL_RATIO = 0.05
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the per-file or per-request size limit."""
+
+class UploadBudget:
+    """Bytes that the attachments of a single request may still use."""
+
+    def __init__(self, limit=None):
+        self.remaining = Config.MAX_UPLOAD_SIZE if limit is None else limit
+
+    def consume(self, amount):
+        self.remaining -= amount
+        if self.remaining < 0:
+            raise UploadTooLargeError(
+                f'Attachments exceed the maximum of {format_size(Config.MAX_UPLOAD_SIZE)} per message'
+            )
+
+def format_size(size):
+    return f'{size // (1024 * 1024)}MB'
+
+def request_too_large():
+    return UploadTooLargeError(f'Request exceeds maximum size of {format_size(Config.MAX_REQUEST_SIZE)}')
+
+def file_too_large(filename):
+    return UploadTooLargeError(f'File {filename} exceeds maximum size of {format_size(Config.MAX_FILE_SIZE)}')
+
+class UploadSpool:
+    """Writable file that checks, hashes and sniffs an upload as it is written.
+
+    Used as the destination of multipart file parts, so the limits apply
+    while the request body is still being received. Reads, seeks and the
+    rest of the file interface go to the underlying spooled file.
+    """
+
+    def __init__(self, filename, budget):
+        self.filename = filename
+        self.budget = budget
+        self.size = 0
+        self.head = b''
+        self._digest = hashlib.sha256()
+        self._file = SpooledTemporaryFile(max_size=Config.UPLOAD_SPOOL_SIZE)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > Config.MAX_FILE_SIZE:
+            raise file_too_large(self.filename)
+        self.budget.consume(len(data))
+        self._digest.update(data)
+        if len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+class Upload:
+    """A fully received attachment: its size, hash and sniffed type."""
+
+    __slots__ = ('filename', 'stream', 'size', 'sha256', 'kind', 'encoding')
+
+    def __init__(self, filename, stream, size, sha256, head):
+        self.filename = filename
+        self.stream = stream
+        self.size = size
+        self.sha256 = sha256
+        self.kind, self.encoding = sniff(head, complete=size <= len(head), size=size)
+
+    def read(self):
+        self.stream.seek(0)
+        return self.stream.read()
+
+    def transcode(self):
+        """Decode the upload as text, chunk by chunk, re-encoding it as UTF-8.
+
+        Returns the UTF-8 bytes and an estimate of their tokens, counted per
+        chunk. The output is spooled and read back in one piece, so the
+        text is only held once, as exactly sized bytes.
+        """
+        self.stream.seek(0)
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        with SpooledTemporaryFile(max_size=Config.UPLOAD_SPOOL_SIZE) as output:
+            token_count = 0
+            final = False
+            while not final:
+                chunk = self.stream.read(Config.UPLOAD_CHUNK_SIZE)
+                final = not chunk
+                text = decoder.decode(chunk, final=final)
+                if text:
+                    token_count += estimate_tokens(text)
+                    output.write(text.encode('utf-8'))
+            output.seek(0)
+            return output.read(), token_count
+
+def receive_upload(file, budget):
+    """Describe an uploaded file (a werkzeug FileStorage).
+
+    Files received through an UploadSpool were checked while they were
+    written. Others, such as uploads parsed by Starlette, are read through
+    once in chunks to apply the same limits and compute the same hash.
+    """
+    stream = file.stream
+    if isinstance(stream, UploadSpool):
+        return Upload(file.filename, stream, stream.size, stream.sha256, stream.head)
+
+    stream.seek(0)
+    size = 0
+    head = b''
+    digest = hashlib.sha256()
+    while True:
+        chunk = stream.read(Config.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > Config.MAX_FILE_SIZE:
+            raise file_too_large(file.filename)
+        budget.consume(len(chunk))
+        digest.update(chunk)
+        if len(head) < SNIFF_BYTES:
+            head += chunk[:SNIFF_BYTES - len(head)]
+    return Upload(file.filename, stream, size, digest.hexdigest(), head)
+
+def is_bmp(head, size=None):
+    """Whether ``head`` starts a BMP file of ``size`` bytes (if given).
+
+    "BM" alone also starts plenty of text, so the declared file size and
+    the DIB header size must be valid too.
+    """
+    if len(head) < 18 or not head.startswith(b'BM'):
+        return False
+    if size is not None and int.from_bytes(head[2:6], 'little') != size:
+        return False
+    return int.from_bytes(head[14:18], 'little') in BMP_DIB_HEADER_SIZES
+
+def sniff(head, complete=False, size=None):
+    """Classify a file from its first bytes.
+
+    Returns ``('image', format)``, ``('text', encoding)`` or ``(None, None)``
+    for binary data. ``complete`` says whether ``head`` is the whole file,
+    in which case a multi-byte character cut off at the end is an error.
+    ``size`` is the size of the whole file, if known.
+    """
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return 'image', image_format
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image', 'webp'
+    if is_bmp(head, size):
+        return 'image', 'bmp'
+
+    for bom, encoding in TEXT_BOMS:
+        if head.startswith(bom):
+            return 'text', encoding
+    if b'\x00' in head:
+        return None, None
+
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=complete)
+        return 'text', 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    # Legacy 8-bit text, unless it is full of control characters
+    controls = sum(1 for byte in head if byte < 32 and byte not in TEXT_CONTROL_BYTES)
+    if controls > len(head) * MAX_CONTROL_RATIO:
+        return None, None
+    return 'text', 'cp1252'
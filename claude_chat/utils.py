@@ -1,29 +1,109 @@
-import tiktoken
+import importlib.util
+import logging
+import sys
+import threading
+import time
 from typing import List, Dict
 
+logger = logging.getLogger(__name__)
+
+def lazy_import(name):
+    """Return module ``name``, loaded only when one of its attributes is first used.
+
+    For heavy dependencies that most processes, or most requests, never
+    touch, so they do not add to startup time.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# Seconds to wait before trying to load the encoding again after a failure
+ENCODING_RETRY_INTERVAL = 300
+
+_encoding = None
+_encoding_retry_at = 0.0
+_encoding_failed = False
+_encoding_lock = threading.Lock()
+
+def get_encoding():
+    """Load the tiktoken encoding once and reuse it.
+
+    Returns None if the encoding cannot be loaded (e.g. the BPE file cannot
+    be downloaded), in which case token counts fall back to a heuristic.
+    Only a loaded encoding is kept: after a failure, loading is tried
+    again once ENCODING_RETRY_INTERVAL has passed, so a transient network
+    error does not leave the process on approximate counts for good.
+    """
+    global _encoding, _encoding_retry_at, _encoding_failed
+    if _encoding is not None or time.monotonic() < _encoding_retry_at:
+        return _encoding
+    with _encoding_lock:
+        if _encoding is not None or time.monotonic() < _encoding_retry_at:
+            return _encoding
+        try:
+            # Imported here: loading tiktoken slows down every process start
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+            if _encoding_failed:
+                logger.info("Loaded the tiktoken encoding; token counts are exact again")
+        except Exception as e:
+            _encoding_retry_at = time.monotonic() + ENCODING_RETRY_INTERVAL
+            if not _encoding_failed:
+                logger.warning(f"Falling back to approximate token counts: {e}")
+            else:
+                logger.debug(f"Still unable to load the tiktoken encoding: {e}")
+            _encoding_failed = True
+        return _encoding
+
 def estimate_tokens(text: str) -> int:
     """Estimate the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text))
+    encoding = get_encoding()
+    if encoding is None:
+        # Roughly four characters per token for English text
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimate the input tokens Claude charges for an image of the given size.
+
+    Roughly one token per 750 pixels; larger images are downscaled by the
+    API, which caps the cost at about 1,600 tokens.
+    """
+    return min((width * height + 749) // 750, 1600)
 
 def truncate_messages_to_token_limit(messages: List[Dict], max_tokens: int) -> List[Dict]:
-    """Truncate messages to fit within token limit while maintaining newest messages."""
+    """Truncate messages to fit within token limit while maintaining newest messages.
+
+    Uses a message's stored ``token_count`` when present instead of
+    re-tokenizing its content.
+    """
     total_tokens = 0
     truncated_messages = []
     
     for message in reversed(messages):
-        message_tokens = estimate_tokens(message['content'])
+        message_tokens = message.get('token_count')
+        if message_tokens is None:
+            message_tokens = estimate_tokens(message['content'])
         if total_tokens + message_tokens > max_tokens:
             break
-        truncated_messages.insert(0, message)
+        truncated_messages.append(message)
         total_tokens += message_tokens
     
+    truncated_messages.reverse()
     return truncated_messages
 
 def format_error_message(error: Exception) -> str:
     """Format error messages for client display."""
     if "rate limit" in str(error).lower():
         return "Rate limit exceeded. Please wait a moment and try again."
+    elif "overloaded" in str(error).lower():
+        return "Claude is overloaded right now. Please try again shortly."
     elif "maximum context length" in str(error).lower():
         return "The conversation is too long. Please start a new one."
     else: